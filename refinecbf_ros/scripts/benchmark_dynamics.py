@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measures the per-call cost of the dynamics (drift, control / disturbance matrix, state Jacobian) for single states and
+batches, and checks the closed-form state Jacobians against central finite differences:
+
+    rosrun refinecbf_ros benchmark_dynamics.py --calls 10000 --batch 4096
+
+With JAX installed, the state Jacobian is also timed the way it used to be computed (jax.jacfwd of a fresh lambda on
+every call) for reference.
+"""
+
+import argparse
+import timeit
+import numpy as np
+from refinecbf_ros.dynamics import QuadNearHoverPlanarDynamics, DubinsCarDynamics, CrazyflieDynamics
+
+DYNAMICS = {
+    "quad_near_hover": QuadNearHoverPlanarDynamics,
+    "dubins_car": DubinsCarDynamics,
+    "crazyflie": CrazyflieDynamics,
+}
+
+
+def dynamics_value(dynamics, state, control):
+    drift = np.asarray(dynamics.open_loop_dynamics(state, 0.0))
+    return drift + np.asarray(dynamics.control_matrix(state, 0.0)) @ control
+
+
+def finite_difference_jacobian(dynamics, state, control, eps=1e-6):
+    jacobian = np.zeros((dynamics.n_dims, dynamics.n_dims))
+    for i in range(dynamics.n_dims):
+        step = np.zeros(dynamics.n_dims)
+        step[i] = eps
+        jacobian[:, i] = (
+            dynamics_value(dynamics, state + step, control) - dynamics_value(dynamics, state - step, control)
+        ) / (2 * eps)
+    return jacobian
+
+
+def time_call(fn, calls):
+    return min(timeit.repeat(fn, number=calls, repeat=3)) / calls
+
+
+def benchmark(dynamics, calls, batch, rng):
+    state = rng.uniform(-1.0, 1.0, dynamics.n_dims)
+    control = rng.uniform(-1.0, 1.0, dynamics.control_dims)
+    states = rng.uniform(-1.0, 1.0, (batch, dynamics.n_dims))
+    controls = rng.uniform(-1.0, 1.0, (batch, dynamics.control_dims))
+    methods = {
+        "drift": lambda x, u: dynamics.open_loop_dynamics(x, 0.0),
+        "control matrix": lambda x, u: dynamics.control_matrix(x, 0.0),
+        "disturbance matrix": lambda x, u: dynamics.disturbance_matrix(x, 0.0),
+        "state jacobian": lambda x, u: dynamics.state_jacobian(x, u),
+    }
+    results = {}
+    for name, method in methods.items():
+        results[name] = (
+            time_call(lambda: method(state, control), calls),
+            time_call(lambda: method(states, controls), max(1, calls // 100)) / batch,
+        )
+    try:
+        import jax
+    except ImportError:
+        return results
+    jacfwd = lambda x, u: jax.jacfwd(lambda y: dynamics.open_loop_dynamics(y) + dynamics.control_matrix(y) @ u)(x)
+    jacfwd(state, control).block_until_ready()
+    results["state jacobian (jax.jacfwd)"] = (
+        time_call(lambda: jacfwd(state, control).block_until_ready(), max(1, calls // 100)),
+        float("nan"),
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dynamics evaluations")
+    parser.add_argument("--dynamics", nargs="+", default=list(DYNAMICS), choices=list(DYNAMICS))
+    parser.add_argument("--calls", type=int, default=10000, help="Calls timed per single-state evaluation")
+    parser.add_argument("--batch", type=int, default=4096, help="Number of states of the batched evaluations")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for name in args.dynamics:
+        dynamics = DYNAMICS[name](params={"g": 9.81}, dt=0.05, test=False)
+        state = rng.uniform(-1.0, 1.0, dynamics.n_dims)
+        control = rng.uniform(-1.0, 1.0, dynamics.control_dims)
+        error = np.max(
+            np.abs(dynamics.state_jacobian(state, control) - finite_difference_jacobian(dynamics, state, control))
+        )
+        print("{} (state jacobian max error vs finite differences: {:.1e})".format(name, error))
+        print("  {:<28} {:>14} {:>18}".format("", "single [us]", "batch [us/state]"))
+        for method, (single, batched) in benchmark(dynamics, args.calls, args.batch, rng).items():
+            print("  {:<28} {:>14.2f} {:>18.4f}".format(method, single * 1e6, batched * 1e6))
+
+
+if __name__ == "__main__":
+    main()
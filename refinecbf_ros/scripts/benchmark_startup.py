@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Measures the startup cost (wall time and peak RSS) of building the configuration the way the different nodes do,
+each profile in a fresh interpreter:
+
+    rosrun refinecbf_ros benchmark_startup.py --env config/Crazyflie/detection_env.yaml
+
+Profiles:
+    light: Config(hj_setup=False) and one dynamics evaluation (disturbance node, crazyflie nominal controller)
+    obstacles: Config(hj_setup=True) without touching the HJ parts (modify_environment)
+    hj: Config(hj_setup=True) with the hj.Grid and HJ dynamics built, which every node paid before they were made lazy
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+PROFILE_SNIPPET = """
+import json, resource, sys, time
+start = time.perf_counter()
+import numpy as np
+import yaml
+from refinecbf_ros.config import Config
+with open({env!r}) as f:
+    env = yaml.safe_load(f)
+config = Config(hj_setup={hj_setup}, env=env)
+state = np.zeros(config.dynamics.n_dims)
+config.dynamics.open_loop_dynamics(state) + config.dynamics.control_matrix(state) @ np.zeros(config.dynamics.control_dims)
+if {touch_hj}:
+    config.hj_grid
+    config.hj_dynamics
+print(json.dumps({{
+    "seconds": time.perf_counter() - start,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    "jax_imported": "jax" in sys.modules,
+}}))
+"""
+
+PROFILES = {
+    "light": {"hj_setup": False, "touch_hj": False},
+    "obstacles": {"hj_setup": True, "touch_hj": False},
+    "hj": {"hj_setup": True, "touch_hj": True},
+}
+
+
+def run_profile(env, profile, repeats):
+    snippet = PROFILE_SNIPPET.format(env=env, **PROFILES[profile])
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", snippet], check=True, capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "seconds": min(run["seconds"] for run in runs),
+        "max_rss_mb": min(run["max_rss_mb"] for run in runs),
+        "jax_imported": runs[0]["jax_imported"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the configuration startup cost of the nodes")
+    parser.add_argument("--env", required=True, help="Environment YAML (as loaded in the /env namespace)")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per profile, the best run is reported")
+    args = parser.parse_args()
+
+    print("{:<10} {:>10} {:>12} {:>6}".format("profile", "time [s]", "RSS [MB]", "jax"))
+    for profile in args.profiles:
+        result = run_profile(args.env, profile, args.repeats)
+        print(
+            "{:<10} {:>10.2f} {:>12.1f} {:>6}".format(
+                profile, result["seconds"], result["max_rss_mb"], "yes" if result["jax_imported"] else "no"
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
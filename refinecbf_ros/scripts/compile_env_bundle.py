@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Compiles an env / control / CBF YAML set into an environment bundle that all nodes load instead of querying the
+parameter server and rebuilding the environment:
+
+    rosrun refinecbf_ros compile_env_bundle.py --env config/Crazyflie/detection_env.yaml \
+        --control config/Crazyflie/crazyflie_control.yaml --cbf config/Crazyflie/crazyflie_CBF_params.yaml \
+        --out bundles/detection_env
+
+Nodes use the bundle when the /env_bundle parameter (or the REFINECBF_ENV_BUNDLE environment variable) points to it.
+"""
+
+import argparse
+import numpy as np
+import yaml
+from refinecbf_ros.bundle import write_bundle, EnvironmentBundle
+from refinecbf_ros.config import Config
+from refinecbf_ros.sdf import compose_sdf
+
+
+def load_yaml(path):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile an environment bundle")
+    parser.add_argument("--env", required=True, help="Environment YAML (loaded in the /env namespace)")
+    parser.add_argument("--control", help="Control YAML (loaded in the /ctr namespace)")
+    parser.add_argument("--cbf", help="CBF parameter YAML (loaded in the /cbf namespace)")
+    parser.add_argument("--initial-vf", help="Initial value function (.npy) to include")
+    parser.add_argument("--out", required=True, help="Output directory of the bundle")
+    args = parser.parse_args()
+
+    sources = [args.env]
+    sections = {"env": load_yaml(args.env)}
+    for name, path in [("ctr", args.control), ("cbf", args.cbf)]:
+        if path is not None:
+            sections[name] = load_yaml(path)
+            sources.append(path)
+
+    config = Config(hj_setup=True, env=sections["env"])
+    sections["grid"] = {
+        "lo": config.state_domain["lo"],
+        "hi": config.state_domain["hi"],
+        "shape": list(config.grid.shape),
+        "periodic_dims": config.state_domain["periodic_dims"],
+    }
+    sections["active_obstacle_names"] = config.active_obstacle_names
+    arrays = {"initial_sdf": compose_sdf(config.grid, config.boundary, config.active_obstacles).astype(np.float32)}
+    if args.initial_vf is not None:
+        initial_vf = np.load(args.initial_vf)
+        if initial_vf.ndim == config.grid.ndim + 1:
+            initial_vf = initial_vf[-1]
+        assert initial_vf.shape == config.grid.shape, "initial vf is not compatible with grid size"
+        arrays["initial_vf"] = initial_vf
+        sources.append(args.initial_vf)
+
+    manifest = write_bundle(args.out, sections, arrays, sources)
+    EnvironmentBundle(args.out).verify()
+    print("Wrote bundle {} ({})".format(args.out, manifest["bundle_hash"][:12]))
+
+
+if __name__ == "__main__":
+    main()
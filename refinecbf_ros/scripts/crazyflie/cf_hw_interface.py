@@ -12,6 +12,7 @@ from crazyflie_msgs.msg import (
     DisturbanceStamped,
 )
 from refinecbf_ros.msg import Array
+from refinecbf_ros.ingestion import LatestValue
 import sys
 import os
 
@@ -51,8 +52,10 @@ class CrazyflieInterface(BaseInterface):
 
     def init_subscribers(self):
         super().init_subscribers()
-        self.in_flight_flag_sub = rospy.Subscriber(self.in_flight_flag_topic, Empty, self.callback_in_flight)
-        self.external_setpoint_sub = rospy.Subscriber("/control/external_setpoint", PositionVelocityStateStamped, self.callback_setpoint)  # TODO: Remove hardcoding
+        self.in_flight_flag_cache = LatestValue(self.in_flight_flag_topic, Empty, callback=self.callback_in_flight)
+        self.external_setpoint_cache = LatestValue(
+            "/control/external_setpoint", PositionVelocityStateStamped, callback=self.callback_setpoint
+        )  # TODO: Remove hardcoding
 
     def callback_state(self, state_in_msg):
         #  state_msg is a PositionVelocityYawStateStamped message
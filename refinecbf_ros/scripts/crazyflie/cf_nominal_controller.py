@@ -2,8 +2,6 @@
 
 import rospy
 import numpy as np
-import hj_reachability as hj
-import jax.numpy as jnp
 from std_msgs.msg import Empty
 
 from refinecbf_ros.config import Config
@@ -28,7 +26,7 @@ class CrazyflieNominalControl(NominalController):
         self.max_pitch = rospy.get_param("~control/max_pitch")
         self.safety_controls_idis = self.config.safety_controls
 
-        self.target = jnp.array(rospy.get_param("/ctr/nominal/goal/coordinates"))
+        self.target = np.array(rospy.get_param("/ctr/nominal/goal/coordinates"))
         self.state = np.zeros_like(self.target)
         # assert len(self.target) == self.dynamics.n_dims  # TODO: Different check needed
 
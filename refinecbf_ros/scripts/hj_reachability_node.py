@@ -4,15 +4,21 @@ import rospy
 import numpy as np
 import hj_reachability as hj
 import jax.numpy as jnp
-from threading import Lock
-from refinecbf_ros.msg import ValueFunctionMsg, HiLoArray
+from threading import Lock, Thread
+from refinecbf_ros.msg import ValueFunctionMsg, HiLoArray, ControlTableMsg, Array, Obstacles, EnvironmentReload
 from refinecbf_ros.config import Config
-from refinecbf_ros.config import QuadraticCBF
+from refinecbf_ros.tables import safest_control_table
+from refinecbf_ros.grid import evaluate_grid, DEFAULT_CHUNK_SIZE
+from refinecbf_ros.ingestion import LatestValue
+from refinecbf_ros.sdf import SDFTableCache
+from refinecbf_ros.speculation import SpeculativeVFCache, rank_candidates
+from refinecbf_ros.tv_vf import scheduled_sdfs, solve_tv_vf
+from refinecbf_ros.dynamics import QuadraticCBF
+from refinecbf_ros.decomposition import SUBSYSTEMS, DecomposedReachability, assert_decoupled
 from refine_cbfs import HJControlAffineDynamics
 from std_msgs.msg import Bool
 from refine_cbfs import (
     HJControlAffineDynamics,
-    TabularControlAffineCBF,
     TabularTVControlAffineCBF,
     utils,
 )
@@ -24,12 +30,24 @@ class HJReachabilityNode:
     HJReachabilityNode is a ROS node that computes the Hamilton-Jacobi reachability for a robot.
 
     Subscribers:
-    - disturbance_update_sub (~topics/disturbance_update): Updates the disturbance.
-    - actuation_update_sub (~topics/actuation_update): Updates the actuation.
-    - sdf_update_sub (~topics/sdf_update): Updates the obstacles.
+    - disturbance_update_cache (~topics/disturbance_update): Updates the disturbance.
+    - actuation_update_cache (~topics/actuation_update): Updates the actuation.
+    - sdf_update_cache (~topics/sdf_update): Updates the obstacles.
+
+    Subscribers (with ~speculation/active):
+    - state_cache (~topics/cbf_state): Robot state, ranks the Detection obstacles for speculation.
+    - obstacle_update_cache (~topics/obstacle_update): Active obstacle names, swaps in speculative VFs.
+
+    Subscribers (with ~decomposition/active):
+    - obstacle_update_cache (~topics/obstacle_update): Active obstacle names, sets the subsystem constraints.
+
+    Subscribers (with ~speculation/active or ~decomposition/active):
+    - env_reload_cache (~topics/env_reload): Reloads of /env, rebuild the obstacle snapshots.
+    - modified_obstacles_cache (~topics/modified_obstacles): Obstacles modified at runtime, dropped from the snapshots.
 
     Publishers:
     - vf_pub (~topics/vf_update): Publishes the value function.
+    - safe_control_table_pub (~topics/safe_control_table): Publishes the safest control table of the value function.
     """
 
     def __init__(self) -> None:
@@ -41,7 +59,7 @@ class HJReachabilityNode:
         config = Config(hj_setup=True)
         # Initialize dynamics, grid, and Hamilton-Jacobi dynamics
         self.dynamics = config.dynamics
-        self.grid = config.grid
+        self.grid = config.hj_grid
         self.hj_dynamics = config.hj_dynamics
         self.control_space = self.hj_dynamics.control_space
         self.disturbance_space = self.hj_dynamics.disturbance_space
@@ -73,14 +91,20 @@ class HJReachabilityNode:
         if self.vf_initialization_method == "sdf":
             self.vf = self.sdf_values.copy()
         elif self.vf_initialization_method == "cbf":
-            cbf_params = rospy.get_param("/cbf")["Parameters"]
+            if config.bundle is not None and config.bundle.section("cbf") is not None:
+                cbf_params = config.bundle.section("cbf")["Parameters"]
+            else:
+                cbf_params = rospy.get_param("/cbf")["Parameters"]
             original_cbf = QuadraticCBF(self.dynamics, cbf_params, test=False)
-            tabular_cbf = TabularControlAffineCBF(self.dynamics, params={}, test=False, grid=self.grid)
-            tabular_cbf.tabularize_cbf(original_cbf)
-            self.vf = tabular_cbf.vf_table.copy()
+            # Tabulated in chunks (vf is vectorized over a batch of states) to bound the peak memory
+            self.vf = evaluate_grid(
+                self.grid, original_cbf.vf, rospy.get_param("~grid_chunk_size", DEFAULT_CHUNK_SIZE)
+            )
         elif self.vf_initialization_method == "file":
-            file_path = rospy.get_param("/vf_file")
-            self.vf = np.load(file_path)
+            if config.bundle is not None and config.bundle.has_array("initial_vf"):
+                self.vf = np.array(config.bundle.array("initial_vf"))
+            else:
+                self.vf = np.load(rospy.get_param("/vf_file"))
             if self.vf.ndim == self.grid.ndim + 1:
                 self.vf = self.vf[-1]
             assert self.vf.shape == self.grid.shape, "vf file is not compatible with grid size"
@@ -94,6 +118,24 @@ class HJReachabilityNode:
             self.vf_pub = rospy.Publisher(self.vf_topic, ValueFunctionMsg, queue_size=1)
         else:  # self.vf_update_method == "file":
             self.vf_pub = rospy.Publisher(self.vf_topic, Bool, queue_size=1)
+        self.vf_version = 0
+        # Latest environment change (version, publication stamp, receipt stamp), stamped on the VFs incorporating it
+        self.env_info = (0, 0.0, 0.0)
+
+        # Safest control table, used by the safety filter as a bounded-time fallback. It is recomputed in the background
+        # for new VF versions, at most once per ~safe_control_table_period
+        self.publish_safe_control_table_flag = rospy.get_param("~publish_safe_control_table", False)
+        self.safe_control_table_period = rospy.get_param("~safe_control_table_period", 1.0)
+        self.table_grid = config.grid
+        self.grid_chunk_size = rospy.get_param("~grid_chunk_size", DEFAULT_CHUNK_SIZE)
+        self.latest_vf = None  # (version, VF) of the latest published VF
+        safe_control_table_topic = rospy.get_param("~topics/safe_control_table", "/safety_filter/safe_control_table")
+        self.safe_control_table_pub = rospy.Publisher(safe_control_table_topic, ControlTableMsg, queue_size=1)
+
+        # SDF updates that only change a region of the grid re-seed the value function there instead of everywhere
+        self.region_reseed_margin = rospy.get_param("~region_reseed_margin", 2)
+
+        self.decomposition = None
 
         self.update_vf_flag = rospy.get_param("~update_vf_online")
         if not self.update_vf_flag:
@@ -101,35 +143,111 @@ class HJReachabilityNode:
 
         # Set up subscribers for disturbance, actuation, and obstacle updates
         disturbance_update_topic = rospy.get_param("~topics/disturbance_update")
-        self.disturbance_update_sub = rospy.Subscriber(
-            disturbance_update_topic, HiLoArray, self.callback_disturbance_update
+        self.disturbance_update_cache = LatestValue(
+            disturbance_update_topic, HiLoArray, callback=self.callback_disturbance_update
         )
 
         actuation_update_topic = rospy.get_param("~topics/actuation_update")
-        self.actuation_update_sub = rospy.Subscriber(actuation_update_topic, HiLoArray, self.callback_actuation_update)
+        self.actuation_update_cache = LatestValue(
+            actuation_update_topic, HiLoArray, callback=self.callback_actuation_update
+        )
 
         if self.vf_update_method == "pubsub":
-            self.sdf_update_sub = rospy.Subscriber(
-                sdf_update_topic, ValueFunctionMsg, self.callback_sdf_update_pubsub
+            self.sdf_update_cache = LatestValue(
+                sdf_update_topic, ValueFunctionMsg, callback=self.callback_sdf_update_pubsub, large=True
             )
         else:  # self.vf_update_method == "file"
-            self.sdf_update_sub = rospy.Subscriber(
-                sdf_update_topic, Bool, self.callback_sdf_update_file
-            )
+            self.sdf_update_cache = LatestValue(sdf_update_topic, Bool, callback=self.callback_sdf_update_file)
+
+        # Speculative precomputation of VFs for the Detection obstacles the robot is closest to detecting
+        self.speculation_active = rospy.get_param("~speculation/active", False)
+        if self.speculation_active:
+            self.setup_speculation(config)
+
+        # Time-varying VF anticipating the scheduled Update obstacles, indexed by experiment time in the safety filter
+        self.tv_vf_active = rospy.get_param("~tv_vf/active", False)
+        if self.tv_vf_active:
+            self.setup_tv_vf(config)
+
+        # Value function combined from the value functions of decoupled subsystems, each solved on its own grid
+        if rospy.get_param("~decomposition/active", False):
+            self.setup_decomposition(config)
+
+        # Speculation and decomposition keep snapshots of the obstacle geometry, kept in sync with the environment
+        if self.speculation_active or self.decomposition is not None:
+            self.setup_obstacle_sync(config)
 
         # Start updating the value function
         self.publish_initial_vf()
+        if self.publish_safe_control_table_flag:
+            Thread(target=self.safe_control_table_loop, daemon=True).start()
         self.update_vf()  # This keeps spinning
 
     def publish_initial_vf(self):
         while self.vf_pub.get_num_connections() <=2 and not rospy.is_shutdown():
             rospy.loginfo("HJR node: Waiting for subscribers to connect")
             rospy.sleep(1)
+        self.publish_vf()
+
+    def publish_vf(self, env_info=None):
+        """
+        Publishes the current value function with a new version.
+
+        Args:
+            env_info (tuple, optional): Environment change incorporated in the value function, defaults to the latest.
+        """
+        env_version, env_stamp, hj_received_stamp = self.env_info if env_info is None else env_info
+        vf = self.vf
+        self.vf_version += 1
         if self.vf_update_method == "pubsub":
-            self.vf_pub.publish(ValueFunctionMsg(vf=self.vf.flatten()))
+            self.vf_pub.publish(
+                ValueFunctionMsg(
+                    vf=np.array(vf).flatten(),
+                    version=self.vf_version,
+                    env_version=env_version,
+                    env_stamp=env_stamp,
+                    hj_received_stamp=hj_received_stamp,
+                    vf_stamp=rospy.get_time(),
+                )
+            )
         else:  # self.vf_update_method == "file"
-            np.save("./vf.npy", self.vf)
+            np.save("./vf.npy", vf)
             self.vf_pub.publish(Bool(True))
+        self.latest_vf = (self.vf_version, vf)
+
+    def safe_control_table_loop(self):
+        """
+        Publishes the safest control table of the latest published VF whenever its version changed, at most once per
+        safe_control_table_period. The table is computed outside of vf_lock, so it never delays the VF updates.
+        """
+        published_version = None
+        while not rospy.is_shutdown():
+            if self.latest_vf is not None and self.latest_vf[0] != published_version:
+                published_version, vf = self.latest_vf
+                self.publish_safe_control_table(published_version, vf)
+            rospy.sleep(self.safe_control_table_period)
+
+    def publish_safe_control_table(self, vf_version, vf):
+        """
+        Publishes the control maximizing Lg V . u within the current control space at every grid node.
+        For the file update method the table is saved to ./safe_control.npy and an empty table is published.
+        """
+        control_space = self.control_space
+        table = safest_control_table(
+            self.dynamics, self.table_grid, np.asarray(vf), control_space.lo, control_space.hi, self.grid_chunk_size
+        )
+        if self.vf_update_method == "pubsub":
+            self.safe_control_table_pub.publish(ControlTableMsg(vf_version=vf_version, table=table.flatten()))
+        else:  # self.vf_update_method == "file"
+            np.save("./safe_control.npy", table)
+            self.safe_control_table_pub.publish(ControlTableMsg(vf_version=vf_version, table=[]))
+
+    def record_env_change(self, msg):
+        """
+        Records the environment version of an incoming update (called with vf_lock held).
+        """
+        if msg.env_version > self.env_info[0]:
+            self.env_info = (msg.env_version, msg.env_stamp, rospy.get_time())
 
     def callback_disturbance_update(self, msg):
         """
@@ -144,6 +262,7 @@ class HJReachabilityNode:
             max_disturbance = msg.hi
             min_disturbance = msg.lo
             self.disturbance_space = hj.sets.Box(lo=jnp.array(min_disturbance), hi=jnp.array(max_disturbance))
+            self.record_env_change(msg)
             self.update_dynamics()  # FIXME:Check whether this is required or happens automatically
 
     def callback_actuation_update(self, msg):
@@ -159,6 +278,7 @@ class HJReachabilityNode:
             max_control = msg.hi
             min_control = msg.lo
             self.control_space = hj.sets.Box(lo=jnp.array(min_control), hi=jnp.array(max_control))
+            self.record_env_change(msg)
             self.update_dynamics()  # FIXME:Check whether this is required or happens automatically
 
     def callback_sdf_update_pubsub(self, msg):
@@ -171,10 +291,34 @@ class HJReachabilityNode:
         This method updates the obstacle and the solver settings.
         """
         with self.vf_lock:
+            old_sdf_values = self.sdf_values
             self.sdf_values = np.array(msg.vf).reshape(self.grid.shape)
+            self.record_env_change(msg)
+            if len(msg.region_lo) != 0:
+                self.reseed_region(old_sdf_values, msg.region_lo, msg.region_hi)
             self.solver_settings = hj.SolverSettings.with_accuracy(
                 self.vf_update_accuracy, value_postprocessor=self.brt(self.sdf_values)
             )
+            self.check_decomposition()
+
+    def reseed_region(self, old_sdf_values, region_lo, region_hi):
+        """
+        Re-seeds the value function with the new SDF in the region where the SDF changed (dilated by
+        region_reseed_margin cells), if the SDF increased there (i.e. an obstacle moved away or was removed).
+        Decreases need no re-seeding, they are applied by the min with the SDF in the value postprocessor.
+
+        Args:
+            old_sdf_values (np.ndarray): SDF before the update.
+            region_lo (list): Lower grid indices of the changed region.
+            region_hi (list): Upper grid indices (exclusive) of the changed region.
+        """
+        lo = np.maximum(np.array(region_lo) - self.region_reseed_margin, 0)
+        hi = np.minimum(np.array(region_hi) + self.region_reseed_margin, self.grid.shape)
+        region = tuple(slice(l, h) for l, h in zip(lo, hi))
+        if np.any(self.sdf_values[region] > old_sdf_values[region]):
+            self.vf = np.array(self.vf)
+            self.vf[region] = self.sdf_values[region]
+            rospy.loginfo("Re-seeded value function in region {} - {}".format(lo.tolist(), hi.tolist()))
 
     def callback_sdf_update_file(self, msg):
         with self.vf_lock:
@@ -184,8 +328,262 @@ class HJReachabilityNode:
             self.solver_settings = hj.SolverSettings.with_accuracy(
                 self.vf_update_accuracy, value_postprocessor=self.brt(self.sdf_values)
             )
+            self.check_decomposition()
             rospy.loginfo("Processed SDF update")
 
+    def setup_tv_vf(self, config):
+        """
+        Precomputes (or, with ~tv_vf/precompute false, reuses an offline computed) time-varying VF covering the
+        schedule of Update obstacles, saves it to ~tv_vf/file and notifies the safety filter on ~topics/tv_vf_update.
+        """
+        tv_vf_file = rospy.get_param("~tv_vf/file", "./vf_tv.npz")
+        if rospy.get_param("~tv_vf/precompute", True):
+            rospy.loginfo("Precomputing time-varying VF for {} Update obstacles".format(len(config.update_obstacles)))
+            sdf_tables = SDFTableCache(self.grid, rospy.get_param("~sdf_cache_budget_mb", 256) * 2**20)
+            appear_times, sdfs = scheduled_sdfs(self.grid, self.sdf_values, config.update_obstacles, sdf_tables)
+            times, values = solve_tv_vf(
+                self.vf_update_accuracy,
+                self.hj_dynamics,
+                self.grid,
+                self.vf,
+                appear_times,
+                sdfs,
+                dt=rospy.get_param("~tv_vf/dt", 0.5),
+                terminal_horizon=rospy.get_param("~tv_vf/terminal_horizon", 5.0),
+            )
+            np.savez(tv_vf_file, times=times, values=values)
+        tv_vf_topic = rospy.get_param("~topics/tv_vf_update", "/safety_filter/tv_vf_update")
+        self.tv_vf_pub = rospy.Publisher(tv_vf_topic, Bool, queue_size=1, latch=True)
+        self.tv_vf_pub.publish(Bool(True))
+
+    def setup_decomposition(self, config):
+        """
+        Sets up the decomposed solver (see DecomposedReachability) for the subsystems of ~decomposition/subsystems
+        (default: SUBSYSTEMS of the dynamics class) and the active obstacle names subscriber to update its constraints.
+        The constraints are built from the obstacles of the config, the combined VF is bounded by the SDF of the obstacle
+        node and the node falls back to the full-grid solver once that SDF contains constraints the subsystems are not
+        solved for (moved, sensed or unknown obstacles, see check_decomposition).
+        """
+        if self.speculation_active or self.tv_vf_active:
+            rospy.logwarn("Decomposition is not combined with speculation / time-varying VFs, disabling it")
+            return
+        subsystems = rospy.get_param("~decomposition/subsystems", SUBSYSTEMS.get(config.dynamics_class))
+        if subsystems is None:
+            raise NotImplementedError("No decoupled subsystems known for {}".format(config.dynamics_class))
+        assert_decoupled(self.dynamics, subsystems, config.grid.domain.lo, config.grid.domain.hi)
+        self.decomposition = DecomposedReachability(
+            config.grid, self.dynamics, subsystems, config.control_space, config.disturbance_space
+        )
+        self.decomposition_boundary = config.boundary
+        self.decomposition_obstacles = {
+            obstacle.obstacleName: obstacle
+            for obstacle in config.detection_obstacles
+            + config.service_obstacles
+            + config.update_obstacles
+            + config.active_obstacles
+        }
+        self.decomposition_active_names = frozenset(config.active_obstacle_names)
+        self.decomposition.set_environment(self.decomposition_boundary, config.active_obstacles)
+        self.vf = np.minimum(np.array(self.vf), self.decomposition.combine())
+        self.check_decomposition()
+        if self.decomposition is None:
+            return
+        rospy.loginfo(
+            "Decomposed reachability on subgrids {}".format(
+                {name: subsystem["grid"].shape for name, subsystem in self.decomposition.subsystems.items()}
+            )
+        )
+
+        obstacle_update_topic = rospy.get_param("~topics/obstacle_update", "/visualization/obstacle_update")
+        self.obstacle_update_cache = LatestValue(
+            obstacle_update_topic, Obstacles, callback=self.callback_decomposition_obstacle_update
+        )
+
+    def callback_decomposition_obstacle_update(self, msg):
+        """
+        Callback for the active obstacles subscriber in decomposed mode, updates the subsystem constraints.
+
+        Args:
+            msg (Obstacles): Names of the active obstacles.
+        """
+        active_names = frozenset(msg.obstacle_names)
+        with self.vf_lock:
+            if active_names == self.decomposition_active_names:
+                return
+            if self.decomposition is None:
+                return
+            self.decomposition_active_names = active_names
+            self.set_decomposition_environment()
+
+    def set_decomposition_environment(self):
+        """
+        Sets the subsystem constraints to the boundary and the active obstacles, falls back to the full-grid solver if
+        the geometry of an active obstacle is not known (called with vf_lock held).
+        """
+        unknown = [name for name in self.decomposition_active_names if name not in self.decomposition_obstacles]
+        if unknown:
+            self.disable_decomposition("unknown obstacles {}".format(sorted(unknown)))
+            return
+        obstacles = [self.decomposition_obstacles[name] for name in self.decomposition_active_names]
+        self.decomposition.set_environment(self.decomposition_boundary, obstacles)
+
+    def check_decomposition(self):
+        """
+        Falls back to the full-grid solver if the current SDF contains constraints the subsystems are not solved for
+        (called with vf_lock held).
+        """
+        if self.decomposition is not None and not self.decomposition.covers(self.sdf_values):
+            self.disable_decomposition("the SDF contains moved, sensed or unknown obstacles")
+
+    def disable_decomposition(self, reason):
+        """
+        Switches to the full-grid solver, warm started from the current VF (called with vf_lock held).
+        """
+        rospy.logerr("Decomposition disabled, {}: falling back to the full-grid solver".format(reason))
+        self.decomposition = None
+        self.vf = np.minimum(np.array(self.vf), self.sdf_values)
+
+    def setup_speculation(self, config):
+        """
+        Sets up the background solver of speculative VFs, the active obstacle names subscriber (to swap in a
+        precomputed VF on detection) and the robot state subscriber (to rank the candidates).
+        """
+        self.detection_obstacles = config.detection_obstacles
+        self.safety_states_idis = config.safety_states
+        self.active_obstacle_names = frozenset(config.active_obstacle_names)
+        self.speculation_max_candidates = rospy.get_param("~speculation/max_candidates", 2)
+        self.speculation_horizon = rospy.get_param("~speculation/horizon", 1.0)
+        self.speculation_period = rospy.get_param("~speculation/period", 0.5)
+        self.speculative_vfs = SpeculativeVFCache(rospy.get_param("~speculation/budget_mb", 512) * 2**20)
+        self.speculation_generation = 0  # Incremented when the obstacle geometry changes, outdates running solves
+        self.speculation_sdf_tables = SDFTableCache(self.grid, rospy.get_param("~sdf_cache_budget_mb", 256) * 2**20)
+
+        cbf_state_topic = rospy.get_param("~topics/cbf_state", "/safety_filter/state")
+        self.state_cache = LatestValue(
+            cbf_state_topic, Array, transform=lambda msg: np.array(msg.value)[self.safety_states_idis]
+        )
+        obstacle_update_topic = rospy.get_param("~topics/obstacle_update", "/visualization/obstacle_update")
+        self.obstacle_update_cache = LatestValue(
+            obstacle_update_topic, Obstacles, callback=self.callback_obstacle_update
+        )
+        Thread(target=self.speculate, daemon=True).start()
+
+    def callback_obstacle_update(self, msg):
+        """
+        Callback for the active obstacles subscriber, swaps in the speculative VF of the new set of active obstacles.
+
+        Args:
+            msg (Obstacles): Names of the active obstacles.
+        """
+        active_names = frozenset(msg.obstacle_names)
+        with self.vf_lock:
+            if active_names == self.active_obstacle_names:
+                return
+            self.active_obstacle_names = active_names
+            speculative_vf = self.speculative_vfs.get(active_names)
+            if speculative_vf is not None:
+                # The speculative VF already accounts for the new obstacle, the min keeps the progress of the current VF
+                self.vf = np.minimum(np.array(self.vf), speculative_vf)
+                rospy.loginfo("Swapped in speculative VF for {}".format(sorted(active_names)))
+            self.speculative_vfs.discard_stale(active_names)
+
+    def speculate(self):
+        """
+        Background loop: solves the VF of the current environment plus the most likely next Detection obstacle that
+        is not cached yet (one solve per period, so the ranking follows the robot).
+        """
+        while not rospy.is_shutdown():
+            rospy.sleep(self.speculation_period)
+            state = self.state_cache.get()
+            if state is None:
+                continue
+            with self.vf_lock:
+                active_names = self.active_obstacle_names
+                generation = self.speculation_generation
+                vf = np.array(self.vf)
+                sdf_values = self.sdf_values
+                hj_dynamics = self.hj_dynamics
+            candidates = rank_candidates(
+                self.detection_obstacles, state, active_names, self.speculation_max_candidates
+            )
+            for obstacle in candidates:
+                key = active_names | {obstacle.obstacleName}
+                if key in self.speculative_vfs:
+                    continue
+                sdf = np.minimum(sdf_values, self.speculation_sdf_tables.get(obstacle))
+                solver_settings = hj.SolverSettings.with_accuracy(
+                    self.vf_update_accuracy, value_postprocessor=self.brt(sdf)
+                )
+                values = hj.step(
+                    solver_settings, hj_dynamics, self.grid, 0.0, np.minimum(vf, sdf), -self.speculation_horizon,
+                    progress_bar=False,
+                )
+                with self.vf_lock:
+                    # Otherwise the base environment or the obstacle geometry is outdated
+                    if self.active_obstacle_names == active_names and self.speculation_generation == generation:
+                        self.speculative_vfs.put(key, np.array(values))
+                break
+
+    def setup_obstacle_sync(self, config):
+        """
+        Subscribes to reloads of the environment, which rebuild the obstacle snapshots of speculation / decomposition
+        from /env, and to the obstacles modified at runtime (UpdateObstacle), whose geometry is only known to the
+        obstacle node and which are dropped from the snapshots (see sync_obstacles).
+        """
+        self.env_config = config
+        self.modified_obstacle_names = frozenset()
+        env_reload_topic = rospy.get_param("~topics/env_reload", "/env/reload")
+        self.env_reload_cache = LatestValue(env_reload_topic, EnvironmentReload, callback=self.callback_env_reload)
+        modified_obstacles_topic = rospy.get_param("~topics/modified_obstacles", "/env/modified_obstacles")
+        self.modified_obstacles_cache = LatestValue(
+            modified_obstacles_topic, Obstacles, callback=self.callback_modified_obstacles
+        )
+
+    def callback_env_reload(self, msg):
+        if "boundary" not in msg.changes and "obstacles" not in msg.changes:
+            return
+        config = Config(hj_setup=True, env=rospy.get_param("/env"))
+        with self.vf_lock:
+            self.env_config = config
+            self.sync_obstacles()
+        rospy.loginfo("Obstacle snapshots rebuilt after an environment reload")
+
+    def callback_modified_obstacles(self, msg):
+        """
+        Callback for the modified obstacles subscriber.
+
+        Args:
+            msg (Obstacles): Names of all obstacles modified at runtime since the last reload.
+        """
+        modified_names = frozenset(msg.obstacle_names)
+        with self.vf_lock:
+            if modified_names == self.modified_obstacle_names:
+                return
+            self.modified_obstacle_names = modified_names
+            self.sync_obstacles()
+
+    def sync_obstacles(self):
+        """
+        Rebuilds the obstacle snapshots from env_config without the modified obstacles, drops the speculative VFs
+        (solved for the old geometry) and resets the subsystem constraints (called with vf_lock held).
+        """
+        config = self.env_config
+        known = lambda obstacles: [o for o in obstacles if o.obstacleName not in self.modified_obstacle_names]
+        if self.speculation_active:
+            self.detection_obstacles = known(config.detection_obstacles)
+            self.speculative_vfs.clear()
+            self.speculation_generation += 1
+        if self.decomposition is not None:
+            self.decomposition_boundary = config.boundary
+            self.decomposition_obstacles = {
+                obstacle.obstacleName: obstacle
+                for obstacle in known(
+                    config.detection_obstacles + config.service_obstacles + config.update_obstacles
+                    + config.active_obstacles
+                )
+            }
+            self.set_decomposition_environment()
+
     def update_dynamics(self):
         """
         Updates the Hamilton-Jacobi dynamics based on the current control and disturbance spaces.
@@ -195,6 +593,10 @@ class HJReachabilityNode:
             control_space=self.control_space,
             disturbance_space=self.disturbance_space,
         )
+        if self.decomposition is not None:
+            self.decomposition.set_spaces(
+                self.control_space.lo, self.control_space.hi, self.disturbance_space.lo, self.disturbance_space.hi
+            )
 
     def update_vf(self):
         """
@@ -203,25 +605,26 @@ class HJReachabilityNode:
         while not rospy.is_shutdown():
             if self.update_vf_flag:
                 with self.vf_lock:
+                    env_info = self.env_info  # Changes received from here on are only in the next VF
                     # rospy.loginfo("Share of safe cells: {:.3f}".format(np.sum(self.vf >= 0) / self.vf.size))
                     time_now = rospy.Time.now().to_sec()
-                    new_values = hj.step(
-                        self.solver_settings,
-                        self.hj_dynamics,
-                        self.grid,
-                        0.0,
-                        self.vf.copy(),
-                        -0.1,
-                        progress_bar=False,
-                    )
+                    if self.decomposition is not None:
+                        self.decomposition.step(self.vf_update_accuracy, 0.1)
+                        new_values = np.minimum(self.decomposition.combine(), self.sdf_values)
+                    else:
+                        new_values = hj.step(
+                            self.solver_settings,
+                            self.hj_dynamics,
+                            self.grid,
+                            0.0,
+                            self.vf.copy(),
+                            -0.1,
+                            progress_bar=False,
+                        )
                     # rospy.loginfo("Time taken to calculate vf: {:.2f}".format(rospy.Time.now().to_sec() - time_now))
                     self.vf = new_values
                 
-                if self.vf_update_method == "pubsub":
-                    self.vf_pub.publish(ValueFunctionMsg(np.array(self.vf).flatten()))
-                else:  # self.vf_update_method == "file"
-                    np.save("./vf.npy", self.vf)
-                    self.vf_pub.publish(Bool(True))
+                self.publish_vf(env_info)
             
             rospy.sleep(0.05)  # To make sure that subscribers can run
 
@@ -1,6 +1,9 @@
 import hj_reachability as hj
+import jax
 import jax.numpy as jnp
 import numpy as np
+from refinecbf_ros.grid import evaluate_grid, DEFAULT_CHUNK_SIZE
+from refinecbf_ros.tables import GradientTableCache, interpolate_table, grad_table
 from tqdm import tqdm
 
 
@@ -15,7 +18,19 @@ class NominalControlHJ:
         self.solver_accuracy = kwargs.get("solver_accuracy", "medium")
         self.pad = kwargs.get("padding", 0.1 * jnp.ones(self.grid.ndim))
         self.tv_vf = None
+        # "tv_vf" keeps the value function of every time interval, "time_to_reach" only the first time at which each
+        # node reaches the target (and its gradient), from which the policy is derived
+        self.representation = kwargs.get("representation", "tv_vf")
+        assert self.representation in ["tv_vf", "time_to_reach"], "Invalid representation"
+        self.ttr = None
         self.target = kwargs.get("target")
+        self.chunk_size = kwargs.get("chunk_size", DEFAULT_CHUNK_SIZE)  # Grid nodes evaluated at once for tables
+        # Gradient tables of the time slices, cached up to this budget (all of them precomputed if they fit)
+        self.gradient_cache_bytes = kwargs.get("gradient_cache_mb", 256) * 2**20
+        self.grad_tables = None
+        self._optimal_control = jax.jit(
+            jax.vmap(lambda x, t, grad_val: self.dyn.optimal_control_state(x, t, grad_val), in_axes=(0, None, 0))
+        )
 
     def _get_target_function(self, target):
         return lambda x: jnp.min(
@@ -33,39 +48,91 @@ class NominalControlHJ:
         self.target = target if target is not None else self.target
         assert self.target.shape[0] == self.grid.ndim, "Target has to match dimension of grid + dynamics"
         target_f = self._get_target_function(self.target)
-        init_values = hj.utils.multivmap(target_f, jnp.arange(self.grid.ndim))(self.grid.states)
+        init_values = jnp.array(evaluate_grid(self.grid, jax.jit(jax.vmap(target_f)), self.chunk_size))
         solver_settings = hj.SolverSettings.with_accuracy(
             self.solver_accuracy, value_postprocessor=self.value_pp(init_values)
         )
-        self.tv_vf = hj.solve(solver_settings, self.dyn, self.grid, self.times, init_values)
+        if self.representation == "time_to_reach":
+            self._solve_time_to_reach(solver_settings, init_values)
+            return
+        self.tv_vf = np.asarray(hj.solve(solver_settings, self.dyn, self.grid, self.times, init_values))
+        # Time slices along the last axis, so that one interpolation returns the values of all of them
+        self.tv_vf_by_time = np.moveaxis(self.tv_vf, 0, -1)
+        self.grad_tables = GradientTableCache(self.grid, self.tv_vf, self.gradient_cache_bytes)
+        self.grad_tables.precompute()
+
+    def _solve_time_to_reach(self, solver_settings, init_values):
+        """
+        Steps through the time intervals keeping only the current value function, and records for every node the
+        time it reaches the target, interpolated linearly between the steps at which its value crosses the threshold.
+        Nodes that never do get one interval more than the horizon, so that the time-to-reach stays finite. The policy
+        follows the negated time-to-reach gradient, and the gradient of the final value function wherever that gradient
+        involves a node that does not reach the target within the horizon (the jump to horizon + interval).
+        """
+        values = init_values
+        previous = np.asarray(values)
+        ttr = np.where(previous > 1e-4, 0.0, np.inf)
+        for time, next_time in zip(self.times[:-1], self.times[1:]):
+            values = hj.step(solver_settings, self.dyn, self.grid, time, values, next_time, progress_bar=False)
+            current = np.asarray(values)
+            crossed = np.isinf(ttr) & (current > 1e-4)
+            fraction = np.clip((1e-4 - previous) / np.maximum(current - previous, 1e-12), 0.0, 1.0)
+            ttr = np.where(crossed, abs(float(time)) + fraction * abs(float(next_time - time)), ttr)
+            previous = current
+        self.ttr_horizon = abs(float(self.times[-1]))
+        self.ttr = np.where(np.isinf(ttr), self.ttr_horizon + abs(float(self.times[1] - self.times[0])), ttr)
+        self.ttr_grad = grad_table(self.grid, -self.ttr)
+        self.final_grad = grad_table(self.grid, previous)
+        # Nodes whose central difference stencil touches an unreached node, as a table whose interpolation is positive
+        # as soon as one of the interpolation corners is such a node
+        unreached = np.isinf(ttr)
+        near_unreached = unreached.copy()
+        for axis, periodic in enumerate(self.grid._is_periodic_dim):
+            if periodic:
+                near_unreached |= np.roll(unreached, 1, axis) | np.roll(unreached, -1, axis)
+            else:
+                lower = [slice(None)] * unreached.ndim
+                upper = [slice(None)] * unreached.ndim
+                lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+                near_unreached[tuple(upper)] |= unreached[tuple(lower)]
+                near_unreached[tuple(lower)] |= unreached[tuple(upper)]
+        self.ttr_unreached = near_unreached.astype(float)
 
     def get_reachable_set(self, time):
+        if self.ttr is not None:
+            return abs(time) - self.ttr  # Non-negative where the target is reached within time
         idx = (jnp.abs(self.times - time)).argmin()
         return self.tv_vf[idx]
 
-    def _line_search(self, x):
-        upper = self.time_intervals
-        lower = 0
-
-        while upper > lower:
-            mid = (upper + lower) // 2
-            val = self.grid.interpolate(self.tv_vf[mid], x)
-
-            lower, upper = jnp.where(
-                val > 1e-4, jnp.array([lower, mid]), jnp.array([mid + 1, upper])
-            )
-        return mid
+    def _time_indices(self, states):
+        """
+        First time index at which each state can reach the target (the last one if it can not), for a single state
+        or a batch, from one interpolation of all time slices.
+        """
+        reached = interpolate_table(self.grid, self.tv_vf_by_time, states) > 1e-4
+        return np.where(reached.any(axis=-1), reached.argmax(axis=-1), self.time_intervals - 1)
+
+    def get_nominal_control_batch(self, states, t):
+        states = np.asarray(states, dtype=float)
+        if self.ttr is not None:
+            grad_vals = interpolate_table(self.grid, self.ttr_grad, states)
+            # Next to nodes that do not reach the target the time-to-reach gradient is the jump, follow the final VF
+            unreached = interpolate_table(self.grid, self.ttr_unreached, states) > 0.0
+            final_grad_vals = interpolate_table(self.grid, self.final_grad, states)
+            grad_vals = np.where(unreached[..., None], final_grad_vals, grad_vals)
+            return np.asarray(self._optimal_control(states, t, grad_vals))
+        indices = self._time_indices(states)
+        grad_vals = np.empty(states.shape)
+        for idx in np.unique(indices):
+            in_slice = indices == idx
+            grad_vals[in_slice] = interpolate_table(self.grid, self.grad_tables.get(idx), states[in_slice])
+        return np.asarray(self._optimal_control(states, t, grad_vals))
 
     def get_nominal_control(self, x, t):
-        idx = self._line_search(x)
-        grad_vals = self.grid.grad_values(self.tv_vf[idx])
-        grad_val = self.grid.interpolate(grad_vals, x)
-        return self.dyn.optimal_control_state(x, t, grad_val)
+        return self.get_nominal_control_batch(np.asarray(x, dtype=float)[None], t)[0]
 
     def get_nominal_control_table(self):
-        return hj.utils.multivmap(self.get_nominal_control, jnp.arange(self.grid.ndim))(
-            self.grid.states
-        )
+        return evaluate_grid(self.grid, lambda states: self.get_nominal_control_batch(states, 0.0), self.chunk_size)
 
     def get_nominal_controller(self, target):
         self.solve(target)
@@ -6,6 +6,7 @@ import hj_reachability as hj
 import jax.numpy as jnp
 
 from refinecbf_ros.config import Config
+from refinecbf_ros.grid import DEFAULT_CHUNK_SIZE
 
 import sys
 import os
@@ -34,6 +35,7 @@ class JackalNominalControl(NominalController):
         self.time_intervals = int(rospy.get_param("/ctr/nominal/goal/time_intervals"))
         assert self.time_intervals > 0
         self.solver_accuracy = rospy.get_param("/ctr/nominal/goal/solver_accuracy", "low")
+        self.representation = rospy.get_param("/ctr/nominal/goal/representation", "tv_vf")
         assert self.solver_accuracy in ["low", "medium", "high", "very_high"]
         self.umin = jnp.array(rospy.get_param("/env/control_space/lo"))
         self.umax = jnp.array(rospy.get_param("/env/control_space/hi"))
@@ -44,12 +46,15 @@ class JackalNominalControl(NominalController):
         if controller_type == "HJR":
             self.controller_prep = NominalControlHJ(
                 self.hj_dynamics,
-                self.grid,
+                self.config.hj_grid,
                 final_time=self.max_time,
                 time_intervals=self.time_intervals,
                 solver_accuracy=self.solver_accuracy,
                 target=self.target,
                 padding=self.padding,
+                chunk_size=rospy.get_param("~grid_chunk_size", DEFAULT_CHUNK_SIZE),
+                gradient_cache_mb=rospy.get_param("~gradient_cache_mb", 256),
+                representation=self.representation,
             )
             rospy.loginfo("Solving for nominal control, nominal control default is 0")
             self.controller = lambda x, t: np.zeros(self.dynamics.control_dims)
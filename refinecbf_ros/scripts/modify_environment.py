@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 
 import rospy
-from refinecbf_ros.msg import Array, HiLoArray, ValueFunctionMsg
+from refinecbf_ros.msg import Array, HiLoArray, ValueFunctionMsg, EnvironmentReload
 from std_msgs.msg import String
 from refinecbf_ros.srv import ModifyEnvironment, ModifyEnvironmentResponse
+from refinecbf_ros.srv import ReloadEnvironment, ReloadEnvironmentResponse
 from refinecbf_ros.config import Config
+from refinecbf_ros.versioning import next_env_version, EnvironmentAckWaiter
+from refinecbf_ros.reload import RELAUNCH_SECTIONS, RUNTIME_PARAMS, load_env, diff_env
 import numpy as np
 
 class ModifyEnvironmentServer:
@@ -12,6 +15,8 @@ class ModifyEnvironmentServer:
         
         # Load configuration
         config = Config(hj_setup=True)
+        self.env = config.env
+        self.cbf_params = rospy.get_param("/ctr/cbf", None)  # Announced to the safety filters when it changes
         self.disturbance_space = config.disturbance_space
         self.control_space = config.control_space
         self.actuation_update_list = config.actuation_updates_list
@@ -29,6 +34,18 @@ class ModifyEnvironmentServer:
         # Set up services
         modify_environment_service = rospy.get_param("~services/modify_environment")
         rospy.Service(modify_environment_service, ModifyEnvironment, self.handle_modified_environment)
+        reload_environment_service = rospy.get_param("~services/reload_environment", "/env/reload_environment")
+        rospy.Service(reload_environment_service, ReloadEnvironment, self.handle_reload_environment)
+
+        # Reloaded environments are announced to the nodes, which re-read the parameters of the changed sections
+        env_reload_topic = rospy.get_param("~topics/env_reload", "/env/reload")
+        self.env_reload_pub = rospy.Publisher(env_reload_topic, EnvironmentReload, queue_size=1, latch=True)
+
+        # Environment versions stamped on the updates, callers can wait for the safety filter to acknowledge them
+        self.env_version = 0
+        env_ack_topic = rospy.get_param("~topics/env_ack", "/env/ack")
+        self.env_ack_waiter = EnvironmentAckWaiter(env_ack_topic)
+        self.env_ack_timeout = rospy.get_param("~env_ack_timeout", 10.0)
 
 
     def update_disturbances(self):
@@ -40,8 +57,13 @@ class ModifyEnvironmentServer:
             hi = np.array(disturbance_space["hi"])
             lo = np.array(disturbance_space["lo"])
             self.disturbance_idx += 1
-            self.disturbance_update_pub.publish(HiLoArray(hi=hi, lo=lo))
+            self.publish_update(self.disturbance_update_pub, hi, lo)
     
+    def publish_update(self, publisher, hi, lo):
+        self.env_version = next_env_version(self.env_version)
+        publisher.publish(HiLoArray(hi=hi, lo=lo, env_version=self.env_version, env_stamp=rospy.get_time()))
+        return self.env_version
+
     def update_actuation(self):
         if self.actuation_idx >= len(self.actuation_update_list):
             rospy.logwarn("No more actuations to update, no update sent")
@@ -50,15 +72,17 @@ class ModifyEnvironmentServer:
             hi = np.array(control_space["hi"])
             lo = np.array(control_space["lo"])
             self.actuation_idx += 1
-            self.actuation_update_pub.publish(HiLoArray(hi=hi, lo=lo))
+            self.publish_update(self.actuation_update_pub, hi, lo)
     
     def handle_modified_environment(self, req):
         '''
         To add disturbances, paste the following in a terminal:
-          rosservice call /env/modify_environment "update_disturbance"
-          rosservice call /env/modify_environment "update_actuation"
+          rosservice call /env/modify_environment "{modification: 'update_disturbance'}"
+          rosservice call /env/modify_environment "{modification: 'update_actuation'}"
+        To block until the safety filter enforces the change, add "wait: true" (and optionally "timeout: 5.0").
         '''
         modification_request = req.modification
+        env_version = self.env_version
         # if modification_request == "actuation":
         #     # Get the new actuation values
         #     self.actuation_update_pub.publish()
@@ -70,7 +94,86 @@ class ModifyEnvironmentServer:
             output = "Actuation Updated"
         else:
             output = "Invalid modification request"
-        return ModifyEnvironmentResponse(output)
+        response = ModifyEnvironmentResponse(status=output)
+        if self.env_version != env_version:
+            response.env_version = self.env_version
+            if req.wait:
+                timeout = req.timeout if req.timeout > 0 else self.env_ack_timeout
+                response = self.env_ack_waiter.fill_response(response, timeout)
+        return response
+
+    def handle_reload_environment(self, req):
+        '''
+        To reload the environment after editing its YAML, paste the following in a terminal:
+          rosservice call /env/reload_environment "{env_file: '/path/to/env.yaml', ctr_file: '/path/to/control.yaml'}"
+          rosservice call /env/reload_environment "{bundle: '/path/to/bundle'}"
+        An empty request re-reads the /env and /ctr namespaces (e.g. after a rosparam load).
+        Only the changed sections are pushed: control and disturbance spaces as updates, boundary and obstacles to the
+        obstacle node (the HJ node then re-seeds the changed region of its warm value function), CBF gamma to the
+        safety filter. Changing the grid or the dynamics is refused as it requires a relaunch.
+        '''
+        try:
+            if req.bundle or req.env_file:
+                new_env, new_ctr = load_env(req.env_file, req.ctr_file, req.bundle)
+            else:
+                new_env, new_ctr = rospy.get_param("/env"), rospy.get_param("/ctr", {})
+        except (IOError, ValueError, KeyError) as e:
+            return ReloadEnvironmentResponse(status="Could not load environment: {}".format(e))
+        new_env = dict(new_env)
+        for name in RUNTIME_PARAMS:
+            if name in self.env:
+                new_env[name] = self.env[name]
+
+        changes = diff_env(self.env, new_env)
+        relaunch = [section for section in changes if section in RELAUNCH_SECTIONS]
+        if relaunch:
+            return ReloadEnvironmentResponse(
+                status="Reload refused, relaunch required for: {}".format(", ".join(relaunch)), changes=relaunch
+            )
+        # Compared with the parameters of the last reload, /ctr/cbf may already hold the new ones (rosparam load)
+        new_cbf_params = new_ctr.get("cbf") if new_ctr is not None else self.cbf_params
+        if new_cbf_params != self.cbf_params:
+            rospy.set_param("/ctr/cbf", new_cbf_params if new_cbf_params is not None else {})
+            self.cbf_params = new_cbf_params
+            changes.append("cbf")
+        if not changes:
+            return ReloadEnvironmentResponse(status="Environment Unchanged")
+
+        rospy.set_param("/env", new_env)
+        self.env = new_env
+        env_version = self.env_version
+        if "actuation_updates" in changes:
+            self.actuation_update_list = new_env["actuation_updates"]
+            self.actuation_idx = 0
+        if "disturbance_updates" in changes:
+            self.disturbance_update_list = new_env["disturbance_updates"]
+            self.disturbance_idx = 0
+        if "control_space" in changes:
+            self.control_space = new_env["control_space"]
+            self.publish_update(
+                self.actuation_update_pub, np.array(self.control_space["hi"]), np.array(self.control_space["lo"])
+            )
+        if "disturbance_space" in changes:
+            self.disturbance_space = new_env["disturbance_space"]
+            self.publish_update(
+                self.disturbance_update_pub,
+                np.array(self.disturbance_space["hi"]),
+                np.array(self.disturbance_space["lo"]),
+            )
+        if "boundary" in changes or "obstacles" in changes:
+            self.env_version = next_env_version(self.env_version)
+        self.env_reload_pub.publish(
+            EnvironmentReload(changes=changes, env_version=self.env_version, env_stamp=rospy.get_time())
+        )
+        rospy.loginfo("Environment reloaded, changed: {}".format(", ".join(changes)))
+
+        response = ReloadEnvironmentResponse(status="Environment Reloaded", changes=changes)
+        if self.env_version != env_version:
+            response.env_version = self.env_version
+            if req.wait:
+                timeout = req.timeout if req.timeout > 0 else self.env_ack_timeout
+                response = self.env_ack_waiter.fill_response(response, timeout)
+        return response
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import rospy
+import numpy as np
+from refinecbf_ros.msg import ValueFunctionMsg, Array, HiLoArray, EnvironmentReload
+from std_msgs.msg import Bool, Float32
+from refinecbf_ros.cbf import GridTabularCBF
+from refinecbf_ros.config import Config
+from refinecbf_ros.ingestion import LatestValue
+from refinecbf_ros.tables import interpolate_table
+from cbf_opt import ControlAffineASIF, SlackifiedControlAffineASIF
+import cvxpy as cp
+from threading import Lock
+from functools import partial
+
+
+class MultiSafetyFilterNode:
+    """
+    MultiSafetyFilterNode serves the safety filter for several namespaced robots that share one environment.
+    A single value function table, grid and QP are held in memory and every tick the pending nominal controls
+    of all robots are filtered in one batch (one vectorized VF lookup and one batched ASIF call).
+
+    Fairness / deadline policy:
+    - Robots with a pending nominal control are served oldest-first, so no robot can be starved.
+    - At most ~max_batch_size robots are solved in one batch, batches are solved until ~tick_deadline has passed.
+      Robots that did not fit in the tick stay pending and are served first on the next tick.
+    - Nominal controls older than ~max_control_age are dropped instead of being filtered.
+
+    Subscribers (per robot, prefixed by the robot namespace):
+    - state_caches (~topics/state): Robot state.
+    - nominal_control_caches (~topics/nominal_control): Nominal control of the robot.
+    Subscribers (shared):
+    - vf_cache (~topics/vf_update): Value function updates.
+    - actuation_update_cache (~topics/actuation_update): Updates the control bounds.
+    - disturbance_update_cache (~topics/disturbance_update): Updates the disturbance bounds.
+    - env_reload_cache (~topics/env_reload): Environment reloads, updates the CBF gamma.
+
+    Publishers (per robot, prefixed by the robot namespace):
+    - filtered_control_pubs (~topics/filtered_control): Filtered control of the robot.
+    - value_function_pubs (~topics/value_function): Value function at the current state of the robot.
+    """
+
+    def __init__(self):
+        self.initialized_safety_filter = False  # To ensure initialized when callback is triggered
+        self.safety_filter_active = rospy.get_param("~safety_filter_active", True)
+        self.robots = rospy.get_param("~robots")
+        assert len(self.robots) > 0, "At least one robot namespace has to be provided"
+        vf_topic = rospy.get_param("~topics/vf_update")
+        self.vf_update_method = rospy.get_param("~vf_update_method")
+        gamma = rospy.get_param("/ctr/cbf/gamma", 1.0)
+        slackify_safety_constraint = rospy.get_param("/ctr/cbf/slack", False)
+
+        tick_rate = rospy.get_param("~tick_rate", 50.0)
+        self.tick_period = 1.0 / tick_rate
+        self.tick_deadline = rospy.get_param("~tick_deadline", 0.8 * self.tick_period)
+        self.max_batch_size = rospy.get_param("~max_batch_size", len(self.robots))
+        self.max_control_age = rospy.get_param("~max_control_age", 5 * self.tick_period)
+
+        self.gamma = gamma
+        config = Config(hj_setup=True)
+        self.dynamics = config.dynamics
+        self.grid = config.grid
+        self.safety_states_idis = config.safety_states
+        self.safety_controls_idis = config.safety_controls
+
+        if self.vf_update_method == "pubsub":
+            self.vf_cache = LatestValue(vf_topic, ValueFunctionMsg, callback=self.callback_vf_update_pubsub, large=True)
+        elif self.vf_update_method == "file":
+            self.vf_cache = LatestValue(vf_topic, Bool, callback=self.callback_vf_update_file)
+        else:
+            raise NotImplementedError("{} is not a valid vf update method".format(self.vf_update_method))
+
+        alpha = lambda x: self.gamma * x  # Reads self.gamma, so reloads of the CBF parameters apply directly
+        self.cbf = GridTabularCBF(self.dynamics, grid=config.grid, alpha=alpha)
+
+        if slackify_safety_constraint:
+            self.safety_filter_solver = SlackifiedControlAffineASIF(self.dynamics, self.cbf, solver=cp.GUROBI)
+        else:  # strict equality
+            self.safety_filter_solver = ControlAffineASIF(self.dynamics, self.cbf, solver=cp.GUROBI)
+
+        self.safety_filter_solver.umin = np.array(config.control_space["lo"])
+        self.safety_filter_solver.umax = np.array(config.control_space["hi"])
+        if not config.disturbance_space["n_dims"] == 0:
+            self.safety_filter_solver.dmin = np.array(config.disturbance_space["lo"])
+            self.safety_filter_solver.dmax = np.array(config.disturbance_space["hi"])
+
+        state_topic = rospy.get_param("~topics/state", "/state_array")
+        nom_control_topic = rospy.get_param("~topics/nominal_control", "/control/nominal")
+        filtered_control_topic = rospy.get_param("~topics/filtered_control", "/control/filtered")
+        value_function_topic = rospy.get_param("~topics/value_function", "/visualization/value_function")
+
+        self.pending_controls = {}  # robot -> (nominal control message, receipt time)
+        self.pending_lock = Lock()
+        self.coalesced_controls = {robot: 0 for robot in self.robots}  # Nominal controls replaced before being served
+        self.state_caches = {}
+        self.nominal_control_caches = {}
+        self.filtered_control_pubs = {}
+        self.value_function_pubs = {}
+        for robot in self.robots:
+            self.state_caches[robot] = LatestValue(
+                self.robot_topic(robot, state_topic), Array, transform=self.process_state
+            )
+            self.nominal_control_caches[robot] = LatestValue(
+                self.robot_topic(robot, nom_control_topic),
+                Array,
+                callback=partial(self.callback_nominal_control, robot=robot),
+            )
+            self.filtered_control_pubs[robot] = rospy.Publisher(
+                self.robot_topic(robot, filtered_control_topic), Array, queue_size=1
+            )
+            self.value_function_pubs[robot] = rospy.Publisher(
+                self.robot_topic(robot, value_function_topic), Float32, queue_size=1
+            )
+
+        actuation_update_topic = rospy.get_param("~topics/actuation_update", "/env/actuation_update")
+        self.actuation_update_cache = LatestValue(
+            actuation_update_topic, HiLoArray, callback=self.callback_actuation_update
+        )
+
+        if not config.disturbance_space["n_dims"] == 0:
+            disturbance_update_topic = rospy.get_param("~topics/disturbance_update")
+            self.disturbance_update_cache = LatestValue(
+                disturbance_update_topic, HiLoArray, callback=self.callback_disturbance_update
+            )
+
+        env_reload_topic = rospy.get_param("~topics/env_reload", "/env/reload")
+        self.env_reload_cache = LatestValue(env_reload_topic, EnvironmentReload, callback=self.callback_env_reload)
+
+        if self.safety_filter_active:
+            # This has to be done to ensure real-time performance
+            self.initialized_safety_filter = False
+            self.safety_filter_solver.setup_optimization_problem()
+            rospy.loginfo("Multi-robot safety filter is used for {}, but not initialized yet".format(self.robots))
+        else:
+            self.initialized_safety_filter = True
+            rospy.logwarn("No safety filter, be careful!")
+
+    @staticmethod
+    def robot_topic(robot, topic):
+        return rospy.names.ns_join("/" + robot.strip("/"), topic.lstrip("/"))
+
+    def callback_actuation_update(self, msg):
+        self.safety_filter_solver.umin = np.array(msg.lo)
+        self.safety_filter_solver.umax = np.array(msg.hi)
+
+    def callback_disturbance_update(self, msg):
+        self.safety_filter_solver.dmin = np.array(msg.lo)
+        self.safety_filter_solver.dmax = np.array(msg.hi)
+
+    def callback_env_reload(self, msg):
+        if "cbf" in msg.changes:
+            self.gamma = rospy.get_param("/ctr/cbf/gamma", 1.0)
+            rospy.loginfo("CBF gamma reloaded: {}".format(self.gamma))
+
+    def callback_vf_update_file(self, vf_msg):
+        if not vf_msg.data:
+            return
+        self.cbf.vf_table = np.array(np.load("./vf.npy")).reshape(self.grid.shape)
+        if not self.initialized_safety_filter:
+            rospy.loginfo("Initialized multi-robot safety filter")
+            self.initialized_safety_filter = True
+
+    def callback_vf_update_pubsub(self, vf_msg):
+        self.cbf.vf_table = np.array(vf_msg.vf).reshape(self.grid.shape)
+        if not self.initialized_safety_filter:
+            rospy.loginfo("Initialized multi-robot safety filter")
+            self.initialized_safety_filter = True
+
+    def process_state(self, state_est_msg):
+        return np.array(state_est_msg.value)[self.safety_states_idis]
+
+    def callback_nominal_control(self, control_msg, robot):
+        # Only the latest nominal control of each robot is kept, the receipt time of the oldest unserved one is
+        # kept so that a robot that keeps publishing does not lose its place in the queue
+        with self.pending_lock:
+            receipt_time = rospy.get_time()
+            if robot in self.pending_controls:
+                receipt_time = self.pending_controls[robot][1]
+                self.coalesced_controls[robot] += 1
+            self.pending_controls[robot] = (control_msg, receipt_time)
+
+    def schedule(self, now):
+        """
+        Returns the robots to be served this tick, oldest pending nominal control first.
+        Drops nominal controls that are older than max_control_age and robots without a state estimate.
+        """
+        ready = []
+        with self.pending_lock:
+            for robot, (_, receipt_time) in list(self.pending_controls.items()):
+                if now - receipt_time > self.max_control_age:
+                    rospy.logwarn_throttle(5.0, "Dropping stale nominal control of {}".format(robot))
+                    del self.pending_controls[robot]
+                elif self.state_caches[robot].value is not None:
+                    ready.append((receipt_time, robot))
+        return [robot for _, robot in sorted(ready)]
+
+    def filter_batch(self, robots):
+        with self.pending_lock:
+            nom_controls = np.array([self.pending_controls.pop(robot)[0].value for robot in robots])
+        if not (self.safety_filter_active and self.initialized_safety_filter):
+            if self.safety_filter_active:
+                rospy.logwarn_throttle_identical(5.0, "Safety filter not initialized yet, outputting nominal control")
+            return nom_controls
+
+        states = np.array([self.state_caches[robot].get() for robot in robots])
+        # One vectorized lookup for the whole fleet
+        vfs = interpolate_table(self.grid, self.cbf.vf_table, states)
+        for robot, vf in zip(robots, vfs):
+            self.value_function_pubs[robot].publish(float(vf))
+
+        nom_controls_active = nom_controls[:, self.safety_controls_idis]
+        safety_controls_active = self.safety_filter_solver(states.copy(), nominal_control=nom_controls_active)
+        safety_controls = nom_controls.copy()
+        safety_controls[:, self.safety_controls_idis] = np.reshape(safety_controls_active, nom_controls_active.shape)
+        return safety_controls
+
+    def tick(self):
+        tick_start = rospy.get_time()
+        queue = self.schedule(tick_start)
+        while queue and rospy.get_time() - tick_start < self.tick_deadline:
+            batch, queue = queue[: self.max_batch_size], queue[self.max_batch_size :]
+            safety_controls = self.filter_batch(batch)
+            for robot, safety_control in zip(batch, safety_controls):
+                safety_control_msg = Array()
+                safety_control_msg.value = safety_control.tolist()  # Ensures compatibility
+                self.filtered_control_pubs[robot].publish(safety_control_msg)
+        rospy.loginfo_throttle(30.0, "Coalesced nominal controls per robot: {}".format(self.coalesced_controls))
+        if queue:
+            rospy.logwarn_throttle(
+                5.0, "Tick deadline missed, {} robot(s) deferred to the next tick".format(len(queue))
+            )
+
+    def run(self):
+        rate = rospy.Rate(1.0 / self.tick_period)
+        while not rospy.is_shutdown():
+            self.tick()
+            rate.sleep()
+
+
+if __name__ == "__main__":
+    rospy.init_node("multi_safety_filter_node")
+    safety_filter = MultiSafetyFilterNode()
+    safety_filter.run()
@@ -2,13 +2,19 @@
 
 import rospy
 import numpy as np
-import jax.numpy as jnp
-import jax
-import hj_reachability as hj
-from refinecbf_ros.msg import Array, ValueFunctionMsg, Obstacles
+from refinecbf_ros.msg import Array, ValueFunctionMsg, Obstacles, EnvironmentReload
 from refinecbf_ros.config import Config
+from refinecbf_ros.sdf import SDFTableCache, IncrementalSDF, subspace_axes, resample_map, union_region
+from refinecbf_ros.ingestion import LatestValue
+from refinecbf_ros.detection import DetectionIndex, UpdateSchedule
+from refinecbf_ros.versioning import next_env_version, EnvironmentAckWaiter
+from refinecbf_ros.reload import diff_obstacles
+from refinecbf_ros.scan import RollingOccupancy, laser_scan_points, point_cloud_points, transform_points
 from refinecbf_ros.srv import ActivateObstacle, ActivateObstacleResponse
+from refinecbf_ros.srv import UpdateObstacle, UpdateObstacleResponse, DeactivateObstacle, DeactivateObstacleResponse
 from std_msgs.msg import Bool
+from threading import Condition, Lock
+import copy
 import pdb
 import matplotlib.pyplot as plt
 
@@ -32,6 +38,43 @@ class ObstacleNode:
         self.boundary = config.boundary
         self.safety_states_idis = config.safety_states
 
+        # Per-obstacle SDF tables are cached, the running SDF is only recomposed when an obstacle is removed / changed
+        sdf_cache_budget = rospy.get_param("~sdf_cache_budget_mb", 256) * 2**20
+        self.sdf_table_cache = SDFTableCache(self.grid, sdf_cache_budget)
+        initial_sdf = None
+        if config.bundle is not None and config.bundle.has_array("initial_sdf"):
+            initial_sdf = config.bundle.array("initial_sdf")
+        self.sdf_composer = IncrementalSDF(
+            self.grid, self.boundary, self.sdf_table_cache, self.active_obstacles, initial_sdf=initial_sdf
+        )
+        # Grid region in which the SDF changed since the last publication, sent along so the HJ node can re-seed it
+        self.changed_region = None
+        self.full_sdf_update = True
+
+        # SDF changes are coalesced: they mark the SDF dirty and it is published at most once per window
+        self.sdf_publish_window = rospy.get_param("~sdf_publish_window", 0.2)
+        self.sdf_dirty = False
+        self.last_sdf_publish = -np.inf
+        self.sdf_changes = 0  # Changes requested since startup
+        self.sdf_publications = 0  # SDFs published since startup (after the initial one)
+        # Service handlers run in their own threads, environment changes are serialized with the main loop
+        self.env_lock = Lock()
+        self.sdf_published = Condition(self.env_lock)
+        self.published_changes = 0  # Value of sdf_changes contained in the last published SDF
+
+        # Every published SDF carries an environment version stamped at publication (versions of the different
+        # publishers are ordered by publication time), service callers can wait for the safety filter to acknowledge it
+        self.env_version = 0
+        env_ack_topic = rospy.get_param("~topics/env_ack", "/env/ack")
+        self.env_ack_waiter = EnvironmentAckWaiter(env_ack_topic)
+        self.env_ack_timeout = rospy.get_param("~env_ack_timeout", 10.0)
+
+        # Detection is evaluated in batches on a spatial index, update obstacles are walked in order of updateTime
+        self.active_obstacle_set = set(obstacle.obstacleName for obstacle in self.active_obstacles)
+        self.detection_index = DetectionIndex(self.detection_obstacles, rospy.get_param("~detection/cell_size", None))
+        self.detection_index.mark_detected(self.active_obstacle_set)
+        self.update_schedule = UpdateSchedule(self.update_obstacles)
+
         # Publishers:
         self.vf_update_method = rospy.get_param("~vf_update_method")
 
@@ -45,78 +88,376 @@ class ObstacleNode:
         
         obstacle_update_topic = rospy.get_param("~topics/obstacle_update")
         self.obstacle_update_pub = rospy.Publisher(obstacle_update_topic,Obstacles,queue_size=1)
+        # Obstacles modified by UpdateObstacle since the last reload, their geometry differs from /env (latched, the
+        # full set is published so only the latest message matters)
+        self.modified_obstacle_names = set()
+        modified_obstacles_topic = rospy.get_param("~topics/modified_obstacles", "/env/modified_obstacles")
+        self.modified_obstacles_pub = rospy.Publisher(modified_obstacles_topic, Obstacles, queue_size=1, latch=True)
 
         # Subscribers:
         cbf_state_topic = rospy.get_param("~topics/cbf_state")
-        state_sub = rospy.Subscriber(cbf_state_topic, Array, self.callback_state)
+        self.state_cache = LatestValue(
+            cbf_state_topic, Array, transform=lambda msg: np.array(msg.value)[self.safety_states_idis]
+        )
+
+        # Reloads of the environment description (boundary / obstacles) are applied without a restart
+        env_reload_topic = rospy.get_param("~topics/env_reload", "/env/reload")
+        self.env_reload_cache = LatestValue(env_reload_topic, EnvironmentReload, callback=self.callback_env_reload)
+
+        # Sensed obstacles (laser scans / point clouds) are rasterized into a rolling occupancy buffer
+        self.scan_active = rospy.get_param("~scan/active", False)
+        self.scan_table = None
+        if self.scan_active:
+            self.setup_scan()
 
         # Services:
         activate_obstacle_service = rospy.get_param("~services/activate_obstacle")
-        rospy.Service(activate_obstacle_service, ActivateObstacle, self.handle_activate_obstacle)
+        rospy.Service(activate_obstacle_service, ActivateObstacle, self.locked(self.handle_activate_obstacle))
+        update_obstacle_service = rospy.get_param("~services/update_obstacle", "/env/update_obstacle")
+        rospy.Service(update_obstacle_service, UpdateObstacle, self.locked(self.handle_update_obstacle))
+        deactivate_obstacle_service = rospy.get_param("~services/deactivate_obstacle", "/env/deactivate_obstacle")
+        rospy.Service(deactivate_obstacle_service, DeactivateObstacle, self.locked(self.handle_deactivate_obstacle))
 
         # Initialize SDF(just active obstacles + boundary):
-        self.update_sdf()  # Publish initial sdf
+        with self.env_lock:
+            self.publish_sdf()  # Publish initial sdf
         self.update_active_obstacles()  # Initial update
         # Set start time
         self.startTime = rospy.Time().now().to_sec()
+        rospy.set_param("/env/experiment_start_time", self.startTime)  # Indexes the time-varying VF
+
+    def locked(self, handler):
+        def locked_handler(req):
+            timeout = req.timeout if getattr(req, "timeout", 0) > 0 else self.env_ack_timeout
+            with self.env_lock:
+                changes = self.sdf_changes
+                response = handler(req)
+                if hasattr(response, "env_version") and self.sdf_changes > changes:
+                    # The version is only known once the main loop publishes the SDF containing the change
+                    change = self.sdf_changes
+                    if self.sdf_published.wait_for(lambda: self.published_changes >= change, timeout):
+                        response.env_version = self.env_version
+            # Waiting for the acknowledgment happens outside of the lock, the main loop keeps publishing
+            if getattr(req, "wait", False) and getattr(response, "env_version", 0):
+                response = self.env_ack_waiter.fill_response(response, timeout)
+            return response
+
+        return locked_handler
+
+    def step(self):
+        with self.env_lock:
+            self.obstacle_detection()
+            if self.scan_active:
+                self.scan_update()
+            self.flush_sdf_update()
 
     def obstacle_detection(self):
+        self.robot_state = self.state_cache.get()
+        if self.robot_state is None:
+            return
         updatesdf = False
-        for obstacle in self.detection_obstacles:
-            if obstacle not in self.active_obstacles:
-                if obstacle.distance_to_obstacle(self.robot_state) <= obstacle.detectionRadius:
-                    rospy.loginfo("Obstacle Detected: {}".format(obstacle.obstacleName))
-                    self.active_obstacles.append(obstacle)
-                    self.active_obstacle_names.append(obstacle.obstacleName)
-                    updatesdf = True
-        for obstacle in self.update_obstacles:
-            if obstacle not in self.active_obstacles:
-                when_to_update = rospy.Time.now().to_sec() - self.startTime
-                if when_to_update >= obstacle.updateTime:
-                    rospy.loginfo("Obstacle appeared: {}".format(obstacle.obstacleName))
-                    self.active_obstacles.append(obstacle)
-                    self.active_obstacle_names.append(obstacle.obstacleName)
-                    updatesdf = True
+        for obstacle in self.detection_index.detect(self.robot_state):
+            if obstacle.obstacleName not in self.active_obstacle_set:
+                rospy.loginfo("Obstacle Detected: {}".format(obstacle.obstacleName))
+                self.activate_obstacle(obstacle)
+                self.active_obstacle_names.append(obstacle.obstacleName)
+                updatesdf = True
+        when_to_update = rospy.Time.now().to_sec() - self.startTime
+        for obstacle in self.update_schedule.due(when_to_update):
+            if obstacle.obstacleName not in self.active_obstacle_set:
+                rospy.loginfo("Obstacle appeared: {}".format(obstacle.obstacleName))
+                self.activate_obstacle(obstacle)
+                self.active_obstacle_names.append(obstacle.obstacleName)
+                updatesdf = True
 
         if updatesdf:
             self.update_sdf()
+            self.update_active_obstacles()  # Ahead of the coalesced SDF, consumers see the names first
             self.update_active_obstacles()
 
+    def setup_scan(self):
+        self.scan_indices = rospy.get_param("~scan/indices", [0, 1])
+        self.scan_pose_indices = rospy.get_param("~scan/pose_indices", [0, 1, 2])  # x, y, yaw in the safety state
+        self.scan_sensor_offset = rospy.get_param("~scan/sensor_offset", [0.0, 0.0])
+        self.scan_padding = rospy.get_param("~scan/padding", 0.0)
+        self.scan_z_range = rospy.get_param("~scan/z_range", [-np.inf, np.inf])
+        self.scan_publish_period = 1.0 / rospy.get_param("~scan/publish_rate_hz", 2.0)
+        lo = [self.grid.coordinate_vectors[i][0] for i in self.scan_indices]
+        hi = [self.grid.coordinate_vectors[i][-1] for i in self.scan_indices]
+        resolution = rospy.get_param("~scan/resolution", float(min(self.grid.spacings[i] for i in self.scan_indices)))
+        self.rolling_occupancy = RollingOccupancy(
+            lo,
+            hi,
+            resolution,
+            truncation=rospy.get_param("~scan/truncation", 1.0),
+            decay_time=rospy.get_param("~scan/decay_time", 2.0),
+            threshold=rospy.get_param("~scan/threshold", 0.5),
+            tile_size=rospy.get_param("~scan/tile_size", 32),
+        )
+        self.scan_axes = subspace_axes(self.grid, self.scan_indices)
+        self.scan_lock = Lock()
+        self.last_scan_decay = rospy.get_time()
+        self.last_scan_publish = -np.inf
+        self.scans_integrated = 0
+
+        scan_topic = rospy.get_param("~topics/scan")
+        scan_type = rospy.get_param("~scan/type", "LaserScan")
+        if scan_type == "LaserScan":
+            from sensor_msgs.msg import LaserScan
+
+            self.scan_to_points = laser_scan_points
+            rospy.Subscriber(scan_topic, LaserScan, self.callback_scan, queue_size=5)
+        elif scan_type == "PointCloud2":
+            from sensor_msgs.msg import PointCloud2
+
+            self.scan_to_points = lambda msg: point_cloud_points(msg, self.scan_z_range)
+            rospy.Subscriber(scan_topic, PointCloud2, self.callback_scan, queue_size=5)
+        else:
+            raise NotImplementedError("{} is not a valid scan type".format(scan_type))
+
+    def callback_scan(self, msg):
+        # Every scan is integrated (not only the latest), hits are cheap to rasterize and missed scans leave holes
+        state = self.state_cache.get()
+        if state is None:
+            return
+        points = transform_points(self.scan_to_points(msg), state[self.scan_pose_indices], self.scan_sensor_offset)
+        with self.scan_lock:
+            self.rolling_occupancy.integrate(points)
+            self.scans_integrated += 1
+
+    def scan_update(self):
+        now = rospy.get_time()
+        with self.scan_lock:
+            self.rolling_occupancy.decay(now - self.last_scan_decay)
+            self.last_scan_decay = now
+            if not self.rolling_occupancy.is_dirty() or now - self.last_scan_publish < self.scan_publish_period:
+                return
+            n_tiles = self.rolling_occupancy.update_sdf()
+            map_sdf = self.rolling_occupancy.sdf.copy()
+        self.scan_table = (
+            resample_map(map_sdf, self.rolling_occupancy.resolution, self.rolling_occupancy.lo, self.scan_axes)
+            - self.scan_padding
+        )
+        self.last_scan_publish = now
+        self.full_sdf_update = True
+        rospy.logdebug("Sensed SDF: recomputed {} tiles from {} scans".format(n_tiles, self.scans_integrated))
+        self.update_sdf()
+
     def update_sdf(self):
-        sdf = hj.utils.multivmap(self.build_sdf(), jnp.arange(self.grid.ndim))(self.grid.states)
+        """
+        Marks the SDF dirty, all changes up to the next flush_sdf_update are published as one SDF.
+        """
+        self.sdf_dirty = True
+        self.sdf_changes += 1
+
+    def flush_sdf_update(self):
+        now = rospy.get_time()
+        if not self.sdf_dirty or now - self.last_sdf_publish < self.sdf_publish_window:
+            return
+        self.publish_sdf()
+        self.sdf_dirty = False
+        self.last_sdf_publish = now
+        self.sdf_publications += 1
+        rospy.loginfo_throttle(
+            30.0,
+            "SDF publications: {}, merged updates: {}".format(
+                self.sdf_publications, self.sdf_changes - self.sdf_publications
+            ),
+        )
+
+    def publish_sdf(self):
+        sdf = self.build_sdf()
+        self.env_version = next_env_version(self.env_version)
         rospy.loginfo("Share Safe SDF {:.2f}".format(((sdf >= 0).sum() / sdf.size) * 100))
+        if self.full_sdf_update or self.changed_region is None:
+            region_lo, region_hi = [], []
+        else:
+            region_lo, region_hi = self.changed_region[0].tolist(), self.changed_region[1].tolist()
+        self.changed_region = None
+        self.full_sdf_update = False
         if self.vf_update_method == "pubsub":
-            self.sdf_update_pub.publish(ValueFunctionMsg(sdf.flatten()))
+            self.sdf_update_pub.publish(
+                ValueFunctionMsg(
+                    vf=sdf.flatten(),
+                    region_lo=region_lo,
+                    region_hi=region_hi,
+                    env_version=self.env_version,
+                    env_stamp=rospy.get_time(),
+                )
+            )
         else:  # self.vf_update_method == "file"
             np.save("./sdf.npy", sdf)
             self.sdf_update_pub.publish(Bool(True))
+        self.published_changes = self.sdf_changes
+        self.sdf_published.notify_all()
+
+    def publish_modified_obstacles(self):
+        self.modified_obstacles_pub.publish(Obstacles(sorted(self.modified_obstacle_names)))
 
     def update_active_obstacles(self):
         self.obstacle_update_pub.publish(Obstacles(self.active_obstacle_names))
 
-    def callback_state(self, state_msg):
-        self.robot_state = np.array(state_msg.value)[self.safety_states_idis]
+    def activate_obstacle(self, obstacle):
+        self.active_obstacles.append(obstacle)
+        self.active_obstacle_set.add(obstacle.obstacleName)
+        # Single elementwise minimum with the (cached) table of the obstacle
+        self.changed_region = union_region(self.changed_region, self.sdf_composer.add(obstacle))
+
+    def find_obstacle(self, obstacle_name):
+        for obstacles in [self.active_obstacles, self.detection_obstacles, self.update_obstacles, self.service_obstacles]:
+            for obstacle in obstacles:
+                if obstacle.obstacleName == obstacle_name:
+                    return obstacle
+        return None
+
+    def replace_obstacle(self, old_obstacle, new_obstacle):
+        for obstacles in [self.active_obstacles, self.detection_obstacles, self.update_obstacles, self.service_obstacles]:
+            for i, obstacle in enumerate(obstacles):
+                if obstacle is old_obstacle:
+                    obstacles[i] = new_obstacle
+        if old_obstacle.obstacleName in self.active_obstacle_set:
+            region = self.sdf_composer.replace(new_obstacle)  # Only recomposes the old and new footprints
+            self.changed_region = union_region(self.changed_region, region)
+        elif old_obstacle.updateRule == "Update":
+            self.update_schedule.replace(old_obstacle, new_obstacle)
+        elif old_obstacle.updateRule == "Detection":
+            self.detection_index = DetectionIndex(self.detection_obstacles, rospy.get_param("~detection/cell_size", None))
+            self.detection_index.mark_detected(self.active_obstacle_set)
+
+    def all_obstacles(self):
+        obstacles = {}
+        for obstacle_list in [self.detection_obstacles, self.update_obstacles, self.service_obstacles, self.active_obstacles]:
+            for obstacle in obstacle_list:
+                obstacles[obstacle.obstacleName] = obstacle
+        return list(obstacles.values())
+
+    def callback_env_reload(self, msg):
+        if "boundary" not in msg.changes and "obstacles" not in msg.changes:
+            return
+        with self.env_lock:
+            self.reload_environment(msg)
+
+    def reload_environment(self, msg):
+        """
+        Applies a reloaded environment description: obstacles that were activated at runtime stay active (with their
+        new geometry) as long as they are still described, removed obstacles are dropped and added Active obstacles are
+        activated. Only the footprints of the changed obstacles are recomposed, unless the boundary changed.
+        """
+        config = Config(hj_setup=True, env=rospy.get_param("/env"))
+        new_obstacles = {
+            obstacle.obstacleName: obstacle
+            for obstacle in config.detection_obstacles + config.update_obstacles + config.service_obstacles
+            + config.active_obstacles
+        }
+        added, removed, changed = diff_obstacles(self.all_obstacles(), new_obstacles.values())
+        active_names = [name for name in self.active_obstacle_names if name in new_obstacles]
+        active_names += [name for name in config.active_obstacle_names if name not in active_names]
+
+        if "boundary" in msg.changes:
+            self.boundary = config.boundary
+            self.sdf_composer = IncrementalSDF(
+                self.grid, self.boundary, self.sdf_table_cache, [new_obstacles[name] for name in active_names]
+            )
+            self.full_sdf_update = True
+        else:
+            for name in removed:
+                if name in self.active_obstacle_set:
+                    self.changed_region = union_region(self.changed_region, self.sdf_composer.remove(name))
+            for name in changed:
+                if name in self.active_obstacle_set:
+                    region = self.sdf_composer.replace(new_obstacles[name])
+                    self.changed_region = union_region(self.changed_region, region)
+            for name in active_names:
+                if name not in self.active_obstacle_set:
+                    self.changed_region = union_region(self.changed_region, self.sdf_composer.add(new_obstacles[name]))
+
+        self.detection_obstacles = config.detection_obstacles
+        self.service_obstacles = config.service_obstacles
+        self.update_obstacles = config.update_obstacles
+        self.active_obstacles = [new_obstacles[name] for name in active_names]
+        self.active_obstacle_names = active_names
+        self.active_obstacle_set = set(active_names)
+        self.detection_index = DetectionIndex(self.detection_obstacles, rospy.get_param("~detection/cell_size", None))
+        self.detection_index.mark_detected(self.active_obstacle_set)
+        self.update_schedule = UpdateSchedule(self.update_obstacles)
+        # All obstacles have their /env geometry again
+        self.modified_obstacle_names = set()
+        self.publish_modified_obstacles()
+        rospy.loginfo(
+            "Environment reloaded: {} obstacles added, {} removed, {} changed".format(
+                len(added), len(removed), len(changed)
+            )
+        )
+        self.update_sdf()
+        # The published SDF carries a later version than the reload, so reload callers can wait for it
+        self.env_version = max(self.env_version, msg.env_version)
+        self.update_active_obstacles()
 
     def build_sdf(self):
-        def sdf(x):
-            sdf = self.boundary.boundary_sdf(x)
-            for obstacle in self.active_obstacles:
-                obstacle_sdf = obstacle.obstacle_sdf(x)
-                sdf = jnp.min(jnp.array([sdf, obstacle_sdf]))
-            return sdf
-        return sdf
+        # Every primitive is evaluated with array ops on the subgrid of its stateIndices and combined by broadcasting
+        if self.scan_table is None:
+            return self.sdf_composer.sdf
+        return np.minimum(self.sdf_composer.sdf, self.scan_table)
 
     def handle_activate_obstacle(self, req):
         obstacle_index = req.obstacleNumber
         if obstacle_index >= len(self.service_obstacles):
             output = "Invalid Obstacle Number"
-        elif self.service_obstacles[obstacle_index] in self.active_obstacles:
+        elif self.service_obstacles[obstacle_index].obstacleName in self.active_obstacle_set:
             output = "Obstacle Already Active"
         else:
-            self.active_obstacles.append(self.service_obstacles[obstacle_index])
+            self.activate_obstacle(self.service_obstacles[obstacle_index])
+            self.active_obstacle_names.append(self.service_obstacles[obstacle_index].obstacleName)
             self.update_sdf()
+            self.update_active_obstacles()
             output = "Obstacle Activated"
-        return ActivateObstacleResponse(output)
+        return ActivateObstacleResponse(response=output)
+
+    def handle_update_obstacle(self, req):
+        obstacle = self.find_obstacle(req.obstacleName)
+        if obstacle is None:
+            return UpdateObstacleResponse("Invalid Obstacle Name")
+        new_obstacle = copy.copy(obstacle)
+        n_dims = len(obstacle.stateIndices)
+        if req.updatePadding:
+            new_obstacle.padding = req.padding
+        if obstacle.type == "Circle":
+            if len(req.center) not in [0, n_dims]:
+                return UpdateObstacleResponse("Invalid Center Dimension")
+            if len(req.center) != 0:
+                new_obstacle.center = np.reshape(np.array(req.center), (-1, 1))
+            if req.radius > 0:
+                new_obstacle.radius = req.radius
+        elif obstacle.type == "Rectangle":
+            if len(req.minVal) not in [0, n_dims] or len(req.maxVal) not in [0, n_dims]:
+                return UpdateObstacleResponse("Invalid Bounds Dimension")
+            if len(req.minVal) != 0:
+                new_obstacle.minVal = np.reshape(np.array(req.minVal), (-1, 1))
+            if len(req.maxVal) != 0:
+                new_obstacle.maxVal = np.reshape(np.array(req.maxVal), (-1, 1))
+            if np.any(np.array(new_obstacle.minVal) > np.array(new_obstacle.maxVal)):
+                return UpdateObstacleResponse("Invalid Bounds")
+        elif len(req.center) != 0 or len(req.minVal) != 0 or len(req.maxVal) != 0:
+            return UpdateObstacleResponse("Only the padding of {} obstacles can be updated".format(obstacle.type))
+        self.replace_obstacle(obstacle, new_obstacle)
+        self.modified_obstacle_names.add(req.obstacleName)
+        self.publish_modified_obstacles()
+        if req.obstacleName in self.active_obstacle_set:
+            self.update_sdf()
+        return UpdateObstacleResponse("Obstacle Updated")
+
+    def handle_deactivate_obstacle(self, req):
+        if req.obstacleName not in self.active_obstacle_set:
+            return DeactivateObstacleResponse("Obstacle Not Active")
+        self.active_obstacles = [o for o in self.active_obstacles if o.obstacleName != req.obstacleName]
+        self.active_obstacle_set.discard(req.obstacleName)
+        if req.obstacleName in self.active_obstacle_names:
+            self.active_obstacle_names.remove(req.obstacleName)
+        region = self.sdf_composer.remove(req.obstacleName)  # Only recomposes the old footprint
+        self.changed_region = union_region(self.changed_region, region)
+        self.update_sdf()
+        self.update_active_obstacles()
+        return DeactivateObstacleResponse("Obstacle Deactivated")
 
 
 if __name__ == "__main__":
@@ -126,5 +467,5 @@ if __name__ == "__main__":
     rate = rospy.Rate(rospy.get_param("~/env/obstacle_update_rate_hz"))
 
     while not rospy.is_shutdown():
-        ObstacleNodeObject.obstacle_detection()
+        ObstacleNodeObject.step()
         rate.sleep()
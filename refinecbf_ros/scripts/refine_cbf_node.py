@@ -3,13 +3,19 @@
 import rospy
 import numpy as np
 import jax.numpy as jnp
-from refinecbf_ros.msg import ValueFunctionMsg, Array, HiLoArray
+from refinecbf_ros.msg import ValueFunctionMsg, Array, HiLoArray, ControlTableMsg, EnvironmentAck, EnvironmentReload
 from std_msgs.msg import Bool, Float32
 from cbf_opt import ControlAffineASIF
-from refine_cbfs import TabularControlAffineCBF
+from refinecbf_ros.cbf import GridTabularCBF
 from refinecbf_ros.config import Config
+from refinecbf_ros.ingestion import LatestValue, log_ingestion_stats
+from refinecbf_ros.tables import interpolate_table, lipschitz_bound
+from refinecbf_ros.tv_vf import tv_index
+from refinecbf_ros.srv import QueryValueFunction, QueryValueFunctionResponse
 from cbf_opt import ControlAffineASIF, SlackifiedControlAffineASIF
 import cvxpy as cp
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Lock
 
 
 class SafetyFilterNode:
@@ -25,23 +31,18 @@ class SafetyFilterNode:
         gamma = rospy.get_param("/ctr/cbf/gamma", 1.0)
         slackify_safety_constraint = rospy.get_param("/ctr/cbf/slack", False)
 
+        self.gamma = gamma
         config = Config(hj_setup=True)
         self.dynamics = config.dynamics
         self.grid = config.grid
         self.safety_states_idis = config.safety_states
         self.safety_controls_idis = config.safety_controls
 
-        if self.vf_update_method == "pubsub":
-            self.vf_sub = rospy.Subscriber(vf_topic, ValueFunctionMsg, self.callback_vf_update_pubsub)
-        elif self.vf_update_method == "file":
-            self.vf_sub = rospy.Subscriber(vf_topic, Bool, self.callback_vf_update_file)
-        else:
-            raise NotImplementedError("{} is not a valid vf update method".format(self.vf_update_method))
         self.state_topic = rospy.get_param("~topics/state", "/state_array")
-        self.state_sub = rospy.Subscriber(self.state_topic, Array, self.callback_state)
+        self.state_cache = LatestValue(self.state_topic, Array, transform=self.process_state)
 
-        alpha = lambda x: gamma * x
-        self.cbf = TabularControlAffineCBF(self.dynamics, grid=self.grid, alpha=alpha)
+        alpha = lambda x: self.gamma * x  # Reads self.gamma, so reloads of the CBF parameters apply directly
+        self.cbf = GridTabularCBF(self.dynamics, grid=config.grid, alpha=alpha)
 
         if slackify_safety_constraint:
             self.safety_filter_solver = SlackifiedControlAffineASIF(self.dynamics, self.cbf,solver=cp.GUROBI)
@@ -55,21 +56,82 @@ class SafetyFilterNode:
             self.safety_filter_solver.dmax = np.array(config.disturbance_space["hi"])
 
         nom_control_topic = rospy.get_param("~topics/nominal_control", "/control/nominal")
-        self.nominal_control_sub = rospy.Subscriber(nom_control_topic, Array, self.callback_safety_filter)
-        self.state = None
+        self.nominal_control_cache = LatestValue(nom_control_topic, Array, callback=self.callback_safety_filter)
         filtered_control_topic = rospy.get_param("~topics/filtered_control", "/control/filtered")
         self.pub_filtered_control = rospy.Publisher(filtered_control_topic, Array, queue_size=1)
 
         actuation_update_topic = rospy.get_param("~topics/actuation_update", "/env/actuation_update")
-        self.actuation_update_sub = rospy.Subscriber(actuation_update_topic, HiLoArray, self.callback_actuation_update)
+        self.actuation_update_cache = LatestValue(actuation_update_topic, HiLoArray, callback=self.callback_actuation_update)
 
         if not config.disturbance_space["n_dims"] == 0:
             disturbance_update_topic = rospy.get_param("~topics/disturbance_update")
-            self.disturbance_update_sub = rospy.Subscriber(disturbance_update_topic, HiLoArray, self.callback_disturbance_update)
+            self.disturbance_update_cache = LatestValue(
+                disturbance_update_topic, HiLoArray, callback=self.callback_disturbance_update
+            )
 
         value_function_topic = rospy.get_param("~topics/value_function", "/visualization/value_function")
         self.value_function_pub = rospy.Publisher(value_function_topic, Float32, queue_size=1)
 
+        # Bounded-time fallback: the QP is solved in a worker thread and if it misses the deadline (or fails) the
+        # safest control (maximizing Lg V . u) is interpolated from the table published alongside the VF. Without a
+        # table, the last QP solution is held (a zero control, clipped to the bounds, before the first one)
+        self.vf_version = 0
+        self.solver_deadline = rospy.get_param("~solver_deadline", 0.02)  # seconds
+        self.solver_executor = ThreadPoolExecutor(max_workers=1)
+        self.solver_future = None
+        self.safe_control_table = None
+        self.safe_control_table_version = None
+        self.last_safe_control = None
+        self.fallback_counts = {"calls": 0, "deadline": 0, "failure": 0, "stale_table": 0}
+        safe_control_table_topic = rospy.get_param("~topics/safe_control_table", "/safety_filter/safe_control_table")
+        self.safe_control_table_cache = LatestValue(
+            safe_control_table_topic, ControlTableMsg, callback=self.callback_safe_control_table, large=True
+        )
+
+        # Fast path: skip the QP when the nominal control provably satisfies the CBF constraint, using a bound on
+        # |grad V| of the current VF version (scaled by a margin to account for the grid approximation)
+        self.fast_path_active = rospy.get_param("~fast_path/active", True)
+        self.fast_path_margin = rospy.get_param("~fast_path/margin", 1.2)
+        self.vf_lipschitz = None
+        self.vf_lock = Lock()
+        self.fast_path_counts = {"calls": 0, "hits": 0}
+        self.disturbance_dims = config.disturbance_space["n_dims"]
+
+        # Batch value function queries (e.g. for planners checking candidate trajectories)
+        self.query_max_states = rospy.get_param("~query/max_states", 100000)
+        query_value_function_service = rospy.get_param(
+            "~services/query_value_function", "/safety_filter/query_value_function"
+        )
+        rospy.Service(query_value_function_service, QueryValueFunction, self.handle_query_value_function)
+
+        # Acknowledges environment versions once a VF incorporating them is enforced
+        self.acked_env_version = 0
+        env_ack_topic = rospy.get_param("~topics/env_ack", "/env/ack")
+        self.env_ack_pub = rospy.Publisher(env_ack_topic, EnvironmentAck, queue_size=10)
+
+        # Time-varying VF of the scheduled Update obstacles, the enforced table is min(online VF, TV VF at the
+        # experiment time) so scheduled obstacles are anticipated without waiting for an online re-solve
+        self.online_vf_table = None
+        self.tv_vf_times = None
+        self.tv_vf_values = None
+        self.tv_vf_index = None
+        self.experiment_start_time = None
+        if rospy.get_param("~tv_vf/active", False):
+            self.tv_vf_file = rospy.get_param("~tv_vf/file", "./vf_tv.npz")
+            tv_vf_topic = rospy.get_param("~topics/tv_vf_update", "/safety_filter/tv_vf_update")
+            self.tv_vf_cache = LatestValue(tv_vf_topic, Bool, callback=self.callback_tv_vf_update)
+
+        env_reload_topic = rospy.get_param("~topics/env_reload", "/env/reload")
+        self.env_reload_cache = LatestValue(env_reload_topic, EnvironmentReload, callback=self.callback_env_reload)
+
+        # Subscribed last, the VF callbacks use the bookkeeping set up above
+        if self.vf_update_method == "pubsub":
+            self.vf_cache = LatestValue(vf_topic, ValueFunctionMsg, callback=self.callback_vf_update_pubsub, large=True)
+        elif self.vf_update_method == "file":
+            self.vf_cache = LatestValue(vf_topic, Bool, callback=self.callback_vf_update_file)
+        else:
+            raise NotImplementedError("{} is not a valid vf update method".format(self.vf_update_method))
+
         if self.safety_filter_active:
             # This has to be done to ensure real-time performance
             self.initialized_safety_filter = False
@@ -89,36 +151,238 @@ class SafetyFilterNode:
         self.safety_filter_solver.dmin = np.array(msg.lo)
         self.safety_filter_solver.dmax = np.array(msg.hi)
 
+    def callback_env_reload(self, msg):
+        if "cbf" in msg.changes:
+            self.gamma = rospy.get_param("/ctr/cbf/gamma", 1.0)
+            rospy.loginfo("CBF gamma reloaded: {}".format(self.gamma))
+
     def callback_vf_update_file(self, vf_msg):
         if not vf_msg.data:
             return
-        self.cbf.vf_table = np.array(np.load("./vf.npy")).reshape(self.grid.shape)
+        with self.vf_lock:
+            self.online_vf_table = np.array(np.load("./vf.npy")).reshape(self.grid.shape)
+            self.cbf.vf_table = self.combined_vf_table()
+            self.vf_version += 1
+        self.update_vf_lipschitz()
         if not self.initialized_safety_filter:
             rospy.loginfo("Initialized safety filter")
             self.initialized_safety_filter = True
 
     def callback_vf_update_pubsub(self, vf_msg):
-        self.cbf.vf_table = np.array(vf_msg.vf).reshape(self.grid.shape)
+        with self.vf_lock:
+            self.online_vf_table = np.array(vf_msg.vf).reshape(self.grid.shape)
+            self.cbf.vf_table = self.combined_vf_table()
+            self.vf_version = vf_msg.version
+        self.update_vf_lipschitz()
+        if vf_msg.env_version > self.acked_env_version:
+            self.acked_env_version = vf_msg.env_version
+            self.env_ack_pub.publish(
+                EnvironmentAck(
+                    env_version=vf_msg.env_version,
+                    vf_version=vf_msg.version,
+                    env_stamp=vf_msg.env_stamp,
+                    hj_received_stamp=vf_msg.hj_received_stamp,
+                    vf_stamp=vf_msg.vf_stamp,
+                    filter_stamp=rospy.get_time(),
+                )
+            )
         if not self.initialized_safety_filter:
             rospy.loginfo("Initialized safety filter")
             self.initialized_safety_filter = True
 
+    def callback_tv_vf_update(self, msg):
+        if not msg.data:
+            return
+        tv_vf = np.load(self.tv_vf_file)
+        with self.vf_lock:
+            self.tv_vf_times = np.array(tv_vf["times"])
+            self.tv_vf_values = np.array(tv_vf["values"]).reshape((-1,) + self.grid.shape)
+            self.tv_vf_index = None
+        rospy.loginfo("Loaded time-varying VF with {} time steps".format(len(self.tv_vf_times)))
+
+    def combined_vf_table(self):
+        """
+        Value function table to enforce (called with vf_lock held): the online VF, combined with the time-varying VF
+        at the current experiment time if there is one.
+        """
+        if self.tv_vf_index is None:
+            return self.online_vf_table
+        if self.online_vf_table is None:
+            return self.tv_vf_values[self.tv_vf_index]
+        return np.minimum(self.online_vf_table, self.tv_vf_values[self.tv_vf_index])
+
+    def update_tv_vf_index(self):
+        """
+        Moves the time-varying VF to the current experiment time (set by the obstacle node on startup).
+        """
+        if self.tv_vf_values is None:
+            return
+        if self.experiment_start_time is None:
+            self.experiment_start_time = rospy.get_param("/env/experiment_start_time", None)
+            if self.experiment_start_time is None:
+                return
+        index = tv_index(self.tv_vf_times, rospy.get_time() - self.experiment_start_time)
+        if index == self.tv_vf_index:
+            return
+        with self.vf_lock:
+            self.tv_vf_index = index
+            self.cbf.vf_table = self.combined_vf_table()
+        self.update_vf_lipschitz()
+
+    def vf_snapshot(self):
+        """
+        Returns a consistent (vf table, gradient table, vf version) triple, the CBF computes the gradient table once
+        per VF.
+        """
+        with self.vf_lock:
+            return self.cbf.vf_table, self.cbf.grad_vf_table, self.vf_version
+
+    def update_vf_lipschitz(self):
+        if self.fast_path_active:
+            _, grad_values, _ = self.vf_snapshot()
+            self.vf_lipschitz = self.fast_path_margin * lipschitz_bound(grad_values)
+
+    def handle_query_value_function(self, req):
+        """
+        Evaluates V and grad V of the latest value function at a batch of states in one vectorized call.
+
+        Args:
+            req (QueryValueFunctionRequest): Flattened batch of states, n_states * n_safety_states entries.
+
+        Returns:
+            QueryValueFunctionResponse: Flattened values (n_states), gradients (n_states * n_safety_states) and the
+            version of the value function they were evaluated on.
+        """
+        if not self.initialized_safety_filter or getattr(self.cbf, "vf_table", None) is None:
+            raise rospy.ServiceException("No value function received yet")
+        states = np.array(req.states)
+        if states.size % self.grid.ndim != 0:
+            raise rospy.ServiceException("Number of entries has to be a multiple of {}".format(self.grid.ndim))
+        states = states.reshape(-1, self.grid.ndim)
+        if states.shape[0] > self.query_max_states:
+            raise rospy.ServiceException("At most {} states per query".format(self.query_max_states))
+        vf_table, grad_values, vf_version = self.vf_snapshot()
+        values = interpolate_table(self.grid, vf_table, states)
+        gradients = interpolate_table(self.grid, grad_values, states)
+        return QueryValueFunctionResponse(
+            values=values.flatten(), gradients=gradients.flatten(), vf_version=vf_version
+        )
+
+    def fast_path_certified(self, state, nominal_control, vf):
+        """
+        Certifies that the nominal control satisfies the CBF constraint without solving the QP.
+        With L >= |grad V|, grad V . (f + g u + D d) + gamma V >= gamma V - L (|f + g u| + max_d |D d|), so the
+        constraint holds whenever gamma V >= L (|f + g u| + max_d |D d|).
+        """
+        if not self.fast_path_active or self.vf_lipschitz is None or vf <= 0.0:
+            return False
+        x_dot = np.asarray(self.dynamics.open_loop_dynamics(state, 0.0)) + np.asarray(
+            self.dynamics.control_matrix(state, 0.0)
+        ) @ nominal_control
+        max_rate = np.linalg.norm(x_dot)
+        if self.disturbance_dims != 0:
+            d_max = np.maximum(np.abs(self.safety_filter_solver.dmin), np.abs(self.safety_filter_solver.dmax))
+            max_rate += np.linalg.norm(np.abs(np.asarray(self.dynamics.disturbance_matrix(state, 0.0))) @ d_max)
+        return self.gamma * vf >= self.vf_lipschitz * max_rate
+
+    def callback_safe_control_table(self, table_msg):
+        if self.vf_update_method == "pubsub":
+            table = np.array(table_msg.table)
+        else:  # self.vf_update_method == "file"
+            table = np.array(np.load("./safe_control.npy"))
+        self.safe_control_table = table.reshape(self.grid.shape + (-1,))
+        self.safe_control_table_version = table_msg.vf_version
+
+    def solve_with_deadline(self, state, nominal_control):
+        """
+        Solves the safety filter QP with a hard deadline of ~solver_deadline seconds.
+        Falls back to fallback_control if the QP misses the deadline, fails, or the previous solve is still running.
+
+        Returns:
+            np.ndarray: The safe control of shape (1, n_safety_controls).
+        """
+        self.fallback_counts["calls"] += 1
+        if self.solver_future is not None and not self.solver_future.done():
+            # The solver is still busy with a call that missed its deadline
+            reason = "deadline"
+        else:
+            self.solver_future = self.solver_executor.submit(
+                self.safety_filter_solver, state, nominal_control=nominal_control
+            )
+            try:
+                safety_control = np.array(self.solver_future.result(timeout=self.solver_deadline))
+                if np.all(np.isfinite(safety_control)):
+                    self.last_safe_control = safety_control
+                    return safety_control
+                reason = "failure"
+            except TimeoutError:
+                reason = "deadline"
+            except Exception as e:
+                rospy.logwarn_throttle(5.0, "Safety filter QP failed: {}".format(e))
+                reason = "failure"
+
+        self.fallback_counts[reason] += 1
+        rospy.logwarn_throttle(
+            5.0,
+            "Safety filter fallback used ({} deadline misses, {} failures out of {} calls)".format(
+                self.fallback_counts["deadline"], self.fallback_counts["failure"], self.fallback_counts["calls"]
+            ),
+        )
+        return self.fallback_control(state)
+
+    def fallback_control(self, state):
+        """
+        Safest control from the table if there is one, otherwise the last QP solution (or a zero control clipped to
+        the control bounds before the first solution).
+        """
+        if self.safe_control_table is not None:
+            if self.safe_control_table_version != self.vf_version:
+                self.fallback_counts["stale_table"] += 1
+                rospy.logwarn_throttle(
+                    5.0,
+                    "Safe control table version {} does not match VF version {} ({} stale fallbacks)".format(
+                        self.safe_control_table_version, self.vf_version, self.fallback_counts["stale_table"]
+                    ),
+                )
+            return np.atleast_2d(interpolate_table(self.grid, self.safe_control_table, state))
+        if self.last_safe_control is not None:
+            return self.last_safe_control
+        umin, umax = np.array(self.safety_filter_solver.umin), np.array(self.safety_filter_solver.umax)
+        return np.atleast_2d(np.clip(np.zeros_like(umin, dtype=float), umin, umax))
+
     def callback_safety_filter(self, control_msg):
         nom_control = np.array(control_msg.value)
-        if self.state is None:
+        state = self.state_cache.get()
+        if state is None:
             rospy.loginfo(" State not set yet, no control published")
             return
         if not self.initialized_safety_filter:
             safety_control_msg = control_msg
             rospy.logwarn_throttle_identical(5.0, "Safety filter not initialized yet, outputting nominal control")
         else:
+            log_ingestion_stats([self.state_cache, self.nominal_control_cache, self.vf_cache])
+            self.update_tv_vf_index()
             nom_control_active = nom_control[self.safety_controls_idis]
             safety_control_msg = Array()
+            fast_path = False
             if hasattr(self.safety_filter_solver, "cbf"):
-                vf = np.array(self.safety_filter_solver.cbf.vf(self.state.copy(), 0.0)).item()
+                vf = float(interpolate_table(self.grid, self.cbf.vf_table, state))
                 self.value_function_pub.publish(vf)
                 # rospy.loginfo_throttle_identical(1.0, "value at current state:{:.2f}".format(vf))
-            safety_control_active = self.safety_filter_solver(self.state.copy(), nominal_control=np.array([nom_control_active]))
+                self.fast_path_counts["calls"] += 1
+                fast_path = self.fast_path_certified(state, nom_control_active, vf)
+            if fast_path:
+                self.fast_path_counts["hits"] += 1
+                safety_control_active = np.array([nom_control_active])
+            else:
+                safety_control_active = self.solve_with_deadline(state.copy(), np.array([nom_control_active]))
+            if self.fast_path_active and self.fast_path_counts["calls"] > 0:
+                rospy.loginfo_throttle(
+                    10.0,
+                    "Safety filter fast path hit rate: {:.1f}%".format(
+                        100.0 * self.fast_path_counts["hits"] / self.fast_path_counts["calls"]
+                    ),
+                )
             safety_control = nom_control.copy()
 
             safety_control[self.safety_controls_idis] = safety_control_active[0]
@@ -126,8 +390,8 @@ class SafetyFilterNode:
 
         self.pub_filtered_control.publish(safety_control_msg)
 
-    def callback_state(self, state_est_msg):
-        self.state = np.array(state_est_msg.value)[self.safety_states_idis]
+    def process_state(self, state_est_msg):
+        return np.array(state_est_msg.value)[self.safety_states_idis]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Predicts the memory per node and the value function update / convergence time of an environment configuration
+before launching the stack, e.g. to pick state_domain.resolution and vf_update_accuracy:
+
+    rosrun refinecbf_ros resource_planner.py --env config/Crazyflie/detection_env.yaml --accuracy medium \
+        --target-rate-hz 5 --calibration-scale 0.5
+
+Memory is computed from the grid (tables are stored as in the nodes: float32 in JAX, float64 in NumPy). The update
+time is measured with hj.step on this machine, on the configured grid or on a grid scaled by --calibration-scale
+(extrapolated by the number of nodes and CFL substeps), and the convergence time from the number of updates the
+calibration grid needs until the value function changes by less than --tolerance.
+"""
+
+import argparse
+import copy
+import importlib.util
+import resource
+import time
+import numpy as np
+import yaml
+from refinecbf_ros.config import Config
+from refinecbf_ros.sdf import compose_sdf
+
+# Horizon of one value function update and sleep between updates of the HJ node (hj_reachability_node.update_vf)
+UPDATE_HORIZON = 0.1
+UPDATE_SLEEP = 0.05
+# Intermediates of one hj.step (upwind gradients on both sides per dimension, Hamiltonian, RK stages), in tables
+SOLVER_TABLES_PER_DIM = 4
+SOLVER_TABLES = 6
+# Default budget of the gradient table cache of the HJR nominal controller (~gradient_cache_mb)
+GRADIENT_CACHE_BYTES = 256 * 2**20
+
+
+def load_yaml(path):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def format_bytes(n_bytes):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n_bytes < 1024 or unit == "GB":
+            return "{:.1f} {}".format(n_bytes, unit)
+        n_bytes /= 1024.0
+
+
+def predict_memory(config, nominal_time_intervals=None, nominal_representation="tv_vf"):
+    """
+    Predicted size of the large tables held by every node.
+
+    Returns:
+        dict: Node name -> list of (table description, bytes).
+    """
+    n = config.grid.size
+    ndim = config.grid.ndim
+    control_dims = config.dynamics.control_dims
+    f32, f64 = 4, 8
+    memory = {
+        "hj_reachability_node": [
+            ("grid states (hj.Grid)", n * ndim * f32),
+            ("value function", n * f32),
+            ("sdf", n * f64),
+            ("solver intermediates", n * (SOLVER_TABLES_PER_DIM * ndim + SOLVER_TABLES) * f32),
+            ("safest control table", n * control_dims * f32),
+        ],
+        "obstacle_node": [
+            ("sdf (running and published)", 2 * n * f64),
+        ],
+        # The tabular CBF interpolates on the GridSpec (refinecbf_ros.cbf), the safety filter holds no hj.Grid states
+        "safety_filter": [
+            ("value function", n * f64),
+            ("gradient table", n * ndim * f64),
+            ("safest control table", n * control_dims * f64),
+        ],
+        "visualization": [
+            ("value function and sdf", 2 * n * f64),
+        ],
+        "messages": [
+            ("value function / sdf message", n * f32),
+        ],
+    }
+    if nominal_time_intervals and nominal_representation == "time_to_reach":
+        memory["nominal_controller (HJR)"] = [
+            ("grid states (hj.Grid)", n * ndim * f32),
+            ("value functions (two steps) and time-to-reach", 3 * n * f64),
+            ("time-to-reach gradient", n * ndim * f64),
+            ("final value function gradient", n * ndim * f64),
+            ("near-unreached nodes", n * f64),
+            ("nominal control table", n * control_dims * f32),
+        ]
+    elif nominal_time_intervals:
+        memory["nominal_controller (HJR)"] = [
+            ("grid states (hj.Grid)", n * ndim * f32),
+            ("time-varying value function", nominal_time_intervals * n * f32),
+            ("nominal control table", n * control_dims * f32),
+            ("gradient tables (cached)", min(nominal_time_intervals * n * ndim * f32, GRADIENT_CACHE_BYTES)),
+        ]
+    return memory
+
+
+def scaled_env(env, scale):
+    env = copy.deepcopy(env)
+    env["state_domain"]["resolution"] = [max(3, int(round(n * scale))) for n in env["state_domain"]["resolution"]]
+    return env
+
+
+def calibrate(env, accuracy, n_updates, max_updates, tolerance):
+    """
+    Runs value function updates as the HJ node does (hj.step over UPDATE_HORIZON from the SDF).
+
+    Returns:
+        dict: Grid shape, compile time, mean update time and number of updates until convergence (None if it did
+            not converge within max_updates).
+    """
+    import hj_reachability as hj
+    import jax.numpy as jnp
+
+    config = Config(hj_setup=True, env=env)
+    sdf = jnp.array(compose_sdf(config.grid, config.boundary, config.active_obstacles), dtype=jnp.float32)
+    solver_settings = hj.SolverSettings.with_accuracy(accuracy, value_postprocessor=lambda t, x: jnp.minimum(x, sdf))
+
+    def update(values):
+        values = hj.step(solver_settings, config.hj_dynamics, config.hj_grid, 0.0, values, -UPDATE_HORIZON,
+                         progress_bar=False)
+        return values.block_until_ready()
+
+    start = time.perf_counter()
+    values = update(sdf)  # Includes compilation
+    compile_time = time.perf_counter() - start
+    update_times = []
+    updates_to_converge = None
+    for i in range(1, max_updates):
+        start = time.perf_counter()
+        new_values = update(values)
+        update_times.append(time.perf_counter() - start)
+        change = float(jnp.max(jnp.abs(new_values - values)))
+        values = new_values
+        if change < tolerance:
+            updates_to_converge = i + 1
+            break
+    return {
+        "shape": config.grid.shape,
+        "spacings": config.grid.spacings,
+        "compile_time": compile_time,
+        "update_time": float(np.mean(update_times[:n_updates])) if update_times else compile_time,
+        "updates_to_converge": updates_to_converge,
+    }
+
+
+def extrapolate_update_time(calibration, grid):
+    """
+    Update time on grid from a calibration run: the cost of an update scales with the number of nodes and with the
+    number of CFL substeps over the fixed horizon, i.e. with the inverse of the smallest spacing.
+    """
+    node_ratio = grid.size / float(np.prod(calibration["shape"]))
+    substep_ratio = min(calibration["spacings"]) / min(grid.spacings)
+    return calibration["update_time"] * node_ratio * substep_ratio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict memory and solve time of an environment configuration")
+    parser.add_argument("--env", required=True, help="Environment YAML (loaded in the /env namespace)")
+    parser.add_argument("--control", help="Control YAML, for the size of the HJR nominal control tables")
+    parser.add_argument("--accuracy", default="medium", choices=["low", "medium", "high", "very_high"])
+    parser.add_argument("--target-rate-hz", type=float, help="Warn if value function updates are slower")
+    parser.add_argument("--calibration-scale", type=float, default=1.0, help="Resolution scale of the calibration")
+    parser.add_argument("--calibration-updates", type=int, default=5, help="Updates averaged for the update time")
+    parser.add_argument("--max-updates", type=int, default=200, help="Updates run at most to detect convergence")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Max VF change per update at convergence")
+    parser.add_argument("--skip-calibration", action="store_true", help="Only predict memory")
+    args = parser.parse_args()
+
+    env = load_yaml(args.env)
+    config = Config(hj_setup=True, env=env)
+    nominal_time_intervals = None
+    nominal_representation = "tv_vf"
+    if args.control is not None:
+        goal = load_yaml(args.control).get("nominal", {}).get("goal", {})
+        nominal_time_intervals = goal.get("time_intervals")
+        nominal_representation = goal.get("representation", "tv_vf")
+
+    print("Grid {} ({} nodes)".format(config.grid.shape, config.grid.size))
+    print("\nPredicted memory per node:")
+    for node, tables in predict_memory(config, nominal_time_intervals, nominal_representation).items():
+        print("  {:<28} {:>10}".format(node, format_bytes(sum(n_bytes for _, n_bytes in tables))))
+        for name, n_bytes in tables:
+            print("    {:<26} {:>10}".format(name, format_bytes(n_bytes)))
+
+    if args.skip_calibration:
+        return
+    calibration_env = env if args.calibration_scale == 1.0 else scaled_env(env, args.calibration_scale)
+    if importlib.util.find_spec("hj_reachability") is None:
+        print("\nhj_reachability is not installed, skipping the solver calibration")
+        return
+    calibration = calibrate(calibration_env, args.accuracy, args.calibration_updates, args.max_updates, args.tolerance)
+    update_time = extrapolate_update_time(calibration, config.grid)
+    update_rate = 1.0 / (update_time + UPDATE_SLEEP)
+    print("\nCalibration on grid {} ({} accuracy):".format(calibration["shape"], args.accuracy))
+    print("  compilation              {:>10.2f} s".format(calibration["compile_time"]))
+    print("  update (calibration)     {:>10.3f} s".format(calibration["update_time"]))
+    print("  update (configured grid) {:>10.3f} s -> {:.2f} Hz".format(update_time, update_rate))
+    if calibration["updates_to_converge"] is None:
+        print("  no convergence within {} updates (tolerance {})".format(args.max_updates, args.tolerance))
+    else:
+        print(
+            "  convergence              {:>10.1f} s ({} updates)".format(
+                calibration["updates_to_converge"] * (update_time + UPDATE_SLEEP), calibration["updates_to_converge"]
+            )
+        )
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print("  peak RSS (calibration)   {:>10}".format(format_bytes(peak_rss)))
+    if args.target_rate_hz is not None and update_rate < args.target_rate_hz:
+        print(
+            "\nWARNING: predicted update rate {:.2f} Hz is below the target of {:.2f} Hz, lower the resolution or the "
+            "accuracy".format(update_rate, args.target_rate_hz)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 
 import rospy
 from refinecbf_ros.msg import Array
+from refinecbf_ros.ingestion import LatestValue
 
 class BaseInterface:
     """
@@ -57,11 +58,14 @@ class BaseInterface:
         self.init_subscribers()
 
     def init_subscribers(self):
-        rospy.Subscriber(self.robot_state_topic, self.state_msg_type, self.callback_state)
-        rospy.Subscriber(self.cbf_safe_control_topic, Array, self.callback_safe_control)
-        rospy.Subscriber(self.robot_external_control_topic, self.external_control_msg_type, self.callback_external_control)
+        # Latest-only ingestion: the interface relays, so a backlog of old states / controls is never worth forwarding
+        self.robot_state_cache = LatestValue(self.robot_state_topic, self.state_msg_type, callback=self.callback_state)
+        self.safe_control_cache = LatestValue(self.cbf_safe_control_topic, Array, callback=self.callback_safe_control)
+        self.external_control_cache = LatestValue(
+            self.robot_external_control_topic, self.external_control_msg_type, callback=self.callback_external_control
+        )
         if not rospy.get_param("~/env/disturbance_space/n_dims") == 0:
-            rospy.Subscriber(self.simulated_disturbance_topic, Array, self.callback_disturbance)
+            self.disturbance_cache = LatestValue(self.simulated_disturbance_topic, Array, callback=self.callback_disturbance)
 
 
     def callback_state(self, state_msg):
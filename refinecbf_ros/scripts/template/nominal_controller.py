@@ -4,6 +4,7 @@ import rospy
 import numpy as np
 from refinecbf_ros.msg import Array
 from std_msgs.msg import Bool
+from refinecbf_ros.ingestion import LatestValue, log_ingestion_stats
 
 
 class NominalController:
@@ -12,8 +13,8 @@ class NominalController:
     External control inputs (keyboard, joystick, etc.) by default override the nominal control from the autonomy stack if they have been published and/or changed recently.
 
     Subscribers:
-    - state_sub (~topics/state): Subscribes to the robot's state.
-    - external_control_sub (~topics/external_control): Subscribes to the external control input.
+    - state_cache (~topics/state): Latest-value cache of the robot's state, read by publish_control.
+    - external_control_cache (~topics/external_control): Subscribes to the external control input.
 
     Publishers:
     - control_pub (~topics/nominal_control): Publishes the nominal control.
@@ -31,9 +32,11 @@ class NominalController:
         publish_ext_control_flag_topic = rospy.get_param("~topics/publish_external_control_flag")
 
         # Initialize subscribers and publishers
-        self.state_sub = rospy.Subscriber(state_topic, Array, self.callback_state)
+        self.state_cache = LatestValue(state_topic, Array, transform=lambda msg: np.array(msg.value))
         self.control_pub = rospy.Publisher(nominal_control_topic, Array, queue_size=1)
-        self.external_control_sub = rospy.Subscriber(external_control_topic, Array, self.callback_external_control)
+        self.external_control_cache = LatestValue(
+            external_control_topic, Array, callback=self.callback_external_control
+        )
         self.publish_ext_control_flag_pub = rospy.Publisher(publish_ext_control_flag_topic, Bool, queue_size=1)
 
         # Initialize control variables
@@ -43,17 +46,6 @@ class NominalController:
         # Initialize Controller
         self.controller = None
 
-    def callback_state(self, state_array_msg):
-        """
-        Callback for the state subscriber.
-
-        Args:
-            state_array_msg (Array): The incoming state message.
-
-        This method updates the robot's state based on the incoming message.
-        """
-        self.state = np.array(state_array_msg.value)
-
     def callback_external_control(self, control_msg):
         """
         Callback for the external control subscriber.
@@ -94,6 +86,12 @@ class NominalController:
         This method gets the nominal control, prioritizes it with the external control input,
         and publishes the result.
         """
+        # Get the latest state, subclasses set an initial self.state that is used until a state is received
+        state = self.state_cache.get()
+        if state is not None:
+            self.state = state
+        log_ingestion_stats([self.state_cache, self.external_control_cache])
+
         # Get nominal control
         control = self.controller(self.state, rospy.get_time()).squeeze()
 
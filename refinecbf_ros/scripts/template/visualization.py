@@ -6,6 +6,7 @@ from geometry_msgs.msg import Point, Pose
 from std_msgs.msg import ColorRGBA, Bool
 from refinecbf_ros.msg import ValueFunctionMsg, Array, Obstacles
 from refinecbf_ros.config import Config
+from refinecbf_ros.ingestion import LatestValue
 import numpy as np
 import jax.numpy as jnp
 import matplotlib.pyplot as plt
@@ -34,18 +35,18 @@ class Visualization:
         vf_topic = rospy.get_param("~topics/vf_update")
 
         if self.vf_update_method == "pubsub":
-            self.sdf_update_sub = rospy.Subscriber(
-                sdf_update_topic, ValueFunctionMsg, self.callback_sdf_pubsub
+            self.sdf_update_cache = LatestValue(
+                sdf_update_topic, ValueFunctionMsg, callback=self.callback_sdf_pubsub, large=True
             )
-            self.vf_update_sub = rospy.Subscriber(vf_topic, ValueFunctionMsg, self.callback_vf_pubsub)
+            self.vf_update_cache = LatestValue(vf_topic, ValueFunctionMsg, callback=self.callback_vf_pubsub, large=True)
         elif self.vf_update_method == "file":
-            self.sdf_update_sub = rospy.Subscriber(sdf_update_topic, Bool, self.callback_sdf_file)
-            self.vf_update_sub = rospy.Subscriber(vf_topic, Bool, self.callback_vf_file)
+            self.sdf_update_cache = LatestValue(sdf_update_topic, Bool, callback=self.callback_sdf_file)
+            self.vf_update_cache = LatestValue(vf_topic, Bool, callback=self.callback_vf_file)
         else:
             raise NotImplementedError("{} is not a valid vf update method".format(self.vf_update_method))
         
         obstacle_update_topic = rospy.get_param("~topics/obstacle_update")
-        self.obstacle_update_sub = rospy.Subscriber(obstacle_update_topic,Obstacles,self.callback_obstacle)
+        self.obstacle_update_cache = LatestValue(obstacle_update_topic, Obstacles, callback=self.callback_obstacle)
         self.active_obstacle_names = []
 
         # Publisher for Marker messages
@@ -66,7 +67,7 @@ class Visualization:
 
         # Subscriber for Robot State:
         cbf_state_topic = rospy.get_param("~topics/cbf_state")
-        state_sub = rospy.Subscriber(cbf_state_topic, Array, self.callback_state)
+        self.state_cache = LatestValue(cbf_state_topic, Array, callback=self.callback_state)
 
         # load Obstacle and Boundary dictionaries
         self.obstacle_dict = rospy.get_param("~/env/obstacles")
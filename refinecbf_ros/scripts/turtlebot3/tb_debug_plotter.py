@@ -6,6 +6,7 @@ import matplotlib.pyplot as plt
 from std_msgs.msg import Bool
 from refinecbf_ros.msg import ValueFunctionMsg, Array, Obstacles
 from refinecbf_ros.config import Config
+from refinecbf_ros.ingestion import LatestValue
 from geometry_msgs.msg import Twist
 import numpy as np
 import jax.numpy as jnp
@@ -64,27 +65,29 @@ class TurtlebotDebugPlotter():
         vf_topic = rospy.get_param("~topics/vf_update")
 
         if self.vf_update_method == "pubsub":
-            self.sdf_update_sub = rospy.Subscriber(
-                sdf_update_topic, ValueFunctionMsg, self.callback_sdf_pubsub
+            self.sdf_update_cache = LatestValue(
+                sdf_update_topic, ValueFunctionMsg, callback=self.callback_sdf_pubsub, large=True
             )
-            self.vf_update_sub = rospy.Subscriber(vf_topic, ValueFunctionMsg, self.callback_vf_pubsub)
+            self.vf_update_cache = LatestValue(vf_topic, ValueFunctionMsg, callback=self.callback_vf_pubsub, large=True)
         elif self.vf_update_method == "file":
-            self.sdf_update_sub = rospy.Subscriber(sdf_update_topic, Bool, self.callback_sdf_file)
-            self.vf_update_sub = rospy.Subscriber(vf_topic, Bool, self.callback_vf_file)
+            self.sdf_update_cache = LatestValue(sdf_update_topic, Bool, callback=self.callback_sdf_file)
+            self.vf_update_cache = LatestValue(vf_topic, Bool, callback=self.callback_vf_file)
         else:
             raise NotImplementedError("{} is not a valid vf update method".format(self.vf_update_method))
 
         # Subscriber for Robot State:
         cbf_state_topic = rospy.get_param("~topics/cbf_state")
-        state_sub = rospy.Subscriber(cbf_state_topic, Array, self.callback_state)
+        self.state_cache = LatestValue(cbf_state_topic, Array, callback=self.callback_state)
 
         # Set up safe control subscriber
         self.cbf_safe_control_topic = rospy.get_param("~topics/cbf_safe_control")
-        rospy.Subscriber(self.cbf_safe_control_topic, Array, self.callback_safe_control)
+        self.safe_control_cache = LatestValue(self.cbf_safe_control_topic, Array, callback=self.callback_safe_control)
 
         # Set up external control subscriber
         self.robot_external_control_topic = rospy.get_param("~topics/robot_external_control")
-        rospy.Subscriber(self.robot_external_control_topic, Twist, self.callback_external_control)
+        self.external_control_cache = LatestValue(
+            self.robot_external_control_topic, Twist, callback=self.callback_external_control
+        )
 
 
     def callback_sdf_pubsub(self, sdf_msg):
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+BUNDLE_ENV_VARIABLE = "REFINECBF_ENV_BUNDLE"
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def array_hash(array):
+    return hashlib.sha256(np.ascontiguousarray(array).tobytes()).hexdigest()
+
+
+class EnvironmentBundle:
+    """
+    Precompiled environment bundle (see scripts/compile_env_bundle.py): a directory with a manifest.json holding the
+    env / control / CBF parameters, the grid spec and the hashes of its sources, and the arrays (initial SDF, optional
+    initial VF) as .npy files that are memory-mapped on access.
+
+    Args:
+        path (str): Directory of the bundle.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+            raise ValueError(
+                "Bundle {} has format version {}, expected {}".format(
+                    path, self.manifest.get("format_version"), BUNDLE_FORMAT_VERSION
+                )
+            )
+        self.env = self.manifest["env"]
+
+    def section(self, name):
+        """
+        Returns a parameter section of the bundle ("env", "ctr", "cbf"), None if it was not compiled in.
+        """
+        return self.manifest.get(name)
+
+    def has_array(self, name):
+        return name in self.manifest["arrays"]
+
+    def array(self, name):
+        return np.load(os.path.join(self.path, self.manifest["arrays"][name]["file"]), mmap_mode="r")
+
+    def verify(self):
+        """
+        Checks the arrays of the bundle against the hashes in the manifest (reads every array entirely).
+        """
+        for name, entry in self.manifest["arrays"].items():
+            if array_hash(self.array(name)) != entry["sha256"]:
+                raise ValueError("Array {} of bundle {} does not match its hash".format(name, self.path))
+
+
+def find_bundle():
+    """
+    Returns the environment bundle configured with the /env_bundle parameter (or the REFINECBF_ENV_BUNDLE environment
+    variable), None if no bundle is configured or the configured bundle does not exist.
+    """
+    import rospy
+
+    path = rospy.get_param("/env_bundle", "") or os.environ.get(BUNDLE_ENV_VARIABLE, "")
+    if not path:
+        return None
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        rospy.logwarn("Environment bundle {} not found, falling back to the parameter server".format(path))
+        return None
+    return EnvironmentBundle(path)
+
+
+def write_bundle(path, sections, arrays, sources):
+    """
+    Writes a bundle directory.
+
+    Args:
+        path (str): Output directory.
+        sections (dict): Parameter sections, must contain "env".
+        arrays (dict): Arrays to store by name.
+        sources (list): Source files whose hashes are recorded.
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest = {"format_version": BUNDLE_FORMAT_VERSION, "sources": {}, "arrays": {}}
+    manifest.update(sections)
+    for source in sources:
+        manifest["sources"][os.path.basename(source)] = file_hash(source)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        file_name = "{}.npy".format(name)
+        np.save(os.path.join(path, file_name), array)
+        manifest["arrays"][name] = {"file": file_name, "shape": list(array.shape), "sha256": array_hash(array)}
+    hashes = json.dumps(manifest, sort_keys=True).encode()
+    manifest["bundle_hash"] = hashlib.sha256(hashes).hexdigest()
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
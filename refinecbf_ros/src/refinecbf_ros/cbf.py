@@ -0,0 +1,51 @@
+from refine_cbfs import TabularControlAffineCBF
+from refinecbf_ros.tables import interpolate_table, grad_table
+
+
+class GridTabularCBF(TabularControlAffineCBF):
+    """
+    Tabular CBF on a GridSpec: V and grad V are interpolated from NumPy tables with interpolate_table, so the safety
+    filter never builds an hj.Grid (and its full states array). The gradient table uses central differences, one-sided
+    at the edges, which is what hj's default upwind scheme averages to, and is computed once per vf_table.
+
+    Args:
+        dynamics (ControlAffineDynamics): Dynamics of the system.
+        grid (GridSpec): Grid on which vf_table is defined.
+    """
+
+    def __init__(self, dynamics, grid, **kwargs):
+        self._vf_table = None
+        self._grad_vf_table = None
+        super().__init__(dynamics, grid=grid, **kwargs)
+        self.grid = grid
+
+    @property
+    def vf_table(self):
+        return self._vf_table
+
+    @vf_table.setter
+    def vf_table(self, table):
+        self._vf_table = table
+        self._grad_vf_table = None
+
+    @property
+    def grad_vf_table(self):
+        """
+        Gradient table of vf_table, shape grid.shape + (ndim,), computed on first use.
+        """
+        table, grad_values = self._vf_table, self._grad_vf_table
+        if grad_values is None and table is not None:
+            grad_values = grad_table(self.grid, table)
+            if self._vf_table is table:  # Not replaced meanwhile (the QP runs in its own thread)
+                self._grad_vf_table = grad_values
+        return grad_values
+
+    @grad_vf_table.setter
+    def grad_vf_table(self, table):
+        self._grad_vf_table = table
+
+    def vf(self, state, time=0.0):
+        return interpolate_table(self.grid, self.vf_table, state)
+
+    def _grad_vf(self, state, time=0.0):
+        return interpolate_table(self.grid, self.grad_vf_table, state)
@@ -1,29 +1,52 @@
-import hj_reachability as hj
-import jax.numpy as jnp
-import jax
-from cbf_opt import ControlAffineDynamics, ControlAffineCBF
-from refine_cbfs import HJControlAffineDynamics
 import numpy as np
 import rospy
+import os
+from refinecbf_ros.bundle import find_bundle
+from refinecbf_ros.grid import GridSpec
+# The obstacle classes live in refinecbf_ros.obstacles (no ROS dependency), re-exported for existing imports
+from refinecbf_ros.obstacles import Obstacle, Circle, Rectangle, Boundary, OccupancyGridObstacle  # noqa: F401
+
+# The dynamics (and QuadraticCBF) live in refinecbf_ros.dynamics, re-exported lazily so that importing the config
+# does not import cbf_opt
+_DYNAMICS_EXPORTS = ["QuadNearHoverPlanarDynamics", "DubinsCarDynamics", "CrazyflieDynamics", "QuadraticCBF"]
+
+
+def __getattr__(name):
+    if name in _DYNAMICS_EXPORTS:
+        from refinecbf_ros import dynamics
+
+        return getattr(dynamics, name)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
 
 
 class Config:
-    def __init__(self, hj_setup=False):
-        self.dynamics_class = rospy.get_param("~/env/dynamics_class")
+    def __init__(self, hj_setup=False, env=None):
+        # Parameters come from (in order): the env dict passed in, a precompiled environment bundle, or the parameter
+        # server, read as a single namespace instead of one round-trip per parameter
+        self.bundle = None
+        if env is None:
+            self.bundle = find_bundle()
+            env = self.bundle.env if self.bundle is not None else rospy.get_param("~/env")
+        self.env = env
+        self.dynamics_class = self._param("dynamics_class")
         self.dynamics = self.setup_dynamics()
-        self.control_space = rospy.get_param("~/env/control_space")
-        self.disturbance_space = rospy.get_param("~/env/disturbance_space")
-        self.safety_states = rospy.get_param("~/env/safety_states")
-        self.safety_controls = rospy.get_param("~/env/safety_controls")
-        self.state_domain = rospy.get_param("~/env/state_domain")
-        self.grid = self.setup_grid()
+        self.control_space = self._param("control_space")
+        self.disturbance_space = self._param("disturbance_space")
+        self.safety_states = self._param("safety_states")
+        self.safety_controls = self._param("safety_controls")
+        self.state_domain = self._param("state_domain")
+        # Nodes use the grid descriptor, the HJ grid and dynamics (for the solver) import hj_reachability / JAX and
+        # are only built when first accessed
+        self.grid = GridSpec.from_state_domain(self.state_domain)
+        self._hj_grid = None
+        self._hj_dynamics = None
 
         if hj_setup:
-            self.obstacle_list = rospy.get_param("~/env/obstacles")
-            self.actuation_updates_list = rospy.get_param("~/env/actuation_updates")
-            self.disturbance_updates_list = rospy.get_param("~/env/disturbance_updates")
+            self.obstacle_list = self._param("obstacles")
+            self.actuation_updates_list = self._param("actuation_updates")
+            self.disturbance_updates_list = self._param("disturbance_updates")
 
-            self.boundary_env = rospy.get_param("~/env/boundary")
+            self.boundary_env = self._param("boundary")
             (
                 self.detection_obstacles,
                 self.service_obstacles,
@@ -32,31 +55,29 @@ class Config:
                 self.active_obstacle_names,
                 self.boundary,
             ) = self.setup_obstacles()
-            if self.control_space["n_dims"] == 0:
-                control_space_hj = hj.sets.Box(
-                    lo=jnp.array([]), hi=jnp.array([]))
-            else:
-                control_space_hj = hj.sets.Box(
-                    lo=jnp.array(self.control_space["lo"]), hi=jnp.array(self.control_space["hi"])
-                )
-            if self.disturbance_space["n_dims"] == 0:
-                dist_space_hj = hj.sets.Box(lo=jnp.array([]), hi=jnp.array([]))
-            else:
-                dist_space_hj = hj.sets.Box(
-                    lo=jnp.array(self.disturbance_space["lo"]), hi=jnp.array(self.disturbance_space["hi"])
-                )
-            self.hj_dynamics = HJControlAffineDynamics(
-                self.dynamics, control_space=control_space_hj, disturbance_space=dist_space_hj
-            )
 
         self.assert_valid(hj_setup)
 
+    def _param(self, name):
+        return self.env[name]
+
+    @property
+    def hj_grid(self):
+        if self._hj_grid is None:
+            self._hj_grid = self.setup_grid()
+        return self._hj_grid
+
+    @property
+    def hj_dynamics(self):
+        if self._hj_dynamics is None:
+            self._hj_dynamics = self.setup_hj_dynamics()
+        return self._hj_dynamics
+
     def assert_valid(self, hj_setup):
         assert len(self.control_space["lo"]) == self.dynamics.control_dims
         assert len(self.control_space["hi"]) == self.dynamics.control_dims
         assert self.dynamics.n_dims == self.grid.ndim
-        assert self.dynamics.periodic_dims == np.where(
-            self.grid._is_periodic_dim)[0].tolist()
+        assert self.dynamics.periodic_dims == self.grid.periodic_dims
 
         if hj_setup:
             if len(self.obstacle_list) != 0:
@@ -69,6 +90,9 @@ class Config:
                             obstacle["indices"])
                         assert len(obstacle["maxVal"]) == len(
                             obstacle["indices"])
+                    if obstacle["type"] == "OccupancyGrid":
+                        assert len(obstacle["indices"]) == 2
+                        assert obstacle["mode"] != "Detection", "Occupancy grid obstacles can not be detected"
             assert len(self.boundary_env["minVal"]) == len(
                 self.boundary_env["indices"])
             assert len(self.boundary_env["maxVal"]) == len(
@@ -139,6 +163,10 @@ class Config:
                                 updateTime=obstacle["updatetime"],
                             )
                         )
+                    elif obstacle["type"] == "OccupancyGrid":
+                        update_obstacles.append(
+                            self.setup_occupancy_grid(name, obstacle, "Update", updateTime=obstacle["updatetime"])
+                        )
                     else:
                         raise ValueError(
                             "Invalid Obstacle Type: {}".format(obstacle["type"]))
@@ -165,6 +193,8 @@ class Config:
                                 padding=obstacle["padding"],
                             )
                         )
+                    elif obstacle["type"] == "OccupancyGrid":
+                        service_obstacles.append(self.setup_occupancy_grid(name, obstacle, "Service"))
                 elif obstacle["mode"] == "Active":
                     active_obstacle_names.append(name)
                     if obstacle["type"] == "Circle":
@@ -189,6 +219,8 @@ class Config:
                                 padding=obstacle["padding"],
                             )
                         )
+                    elif obstacle["type"] == "OccupancyGrid":
+                        active_obstacles.append(self.setup_occupancy_grid(name, obstacle, "Active"))
                     else:
                         raise ValueError(
                             "Invalid Obstacle Type: {}".format(obstacle["type"]))
@@ -205,7 +237,46 @@ class Config:
 
         return detection_obstacles, service_obstacles, update_obstacles, active_obstacles, active_obstacle_names, boundary
 
+    def setup_occupancy_grid(self, name, obstacle, updateRule, **kwargs):
+        # Occupancy maps are either read from an image (map_server convention) or from a nav_msgs/OccupancyGrid topic
+        if "image" in obstacle:
+            image = os.path.expanduser(obstacle["image"])
+            if not os.path.isabs(image):
+                import rospkg
+
+                image = os.path.join(rospkg.RosPack().get_path("refinecbf_ros"), image)
+            return OccupancyGridObstacle.from_image(
+                stateIndices=obstacle["indices"],
+                obstacleName=name,
+                image=image,
+                resolution=obstacle["resolution"],
+                origin=obstacle["origin"],
+                occupied_thresh=obstacle.get("occupied_thresh", 0.65),
+                negate=obstacle.get("negate", False),
+                updateRule=updateRule,
+                padding=obstacle["padding"],
+                **kwargs,
+            )
+        elif "topic" in obstacle:
+            from nav_msgs.msg import OccupancyGrid
+
+            msg = rospy.wait_for_message(obstacle["topic"], OccupancyGrid, timeout=obstacle.get("timeout", 10.0))
+            return OccupancyGridObstacle.from_msg(
+                stateIndices=obstacle["indices"],
+                obstacleName=name,
+                msg=msg,
+                occupied_thresh=obstacle.get("occupied_thresh", 65),
+                unknown_is_occupied=obstacle.get("unknown_is_occupied", True),
+                updateRule=updateRule,
+                padding=obstacle["padding"],
+                **kwargs,
+            )
+        else:
+            raise ValueError("Occupancy grid obstacle {} needs an image or a topic".format(name))
+
     def setup_dynamics(self):
+        from refinecbf_ros.dynamics import QuadNearHoverPlanarDynamics, DubinsCarDynamics
+
         if self.dynamics_class == "quad_near_hover":
             return QuadNearHoverPlanarDynamics(params={"g": 9.81}, dt=0.05, test=False)
         elif self.dynamics_class == "dubins_car":
@@ -214,208 +285,27 @@ class Config:
             raise ValueError(
                 "Invalid dynamics type: {}".format(self.dynamics_class))
 
-    def setup_grid(self):
-        bounding_box = hj.sets.Box(lo=jnp.array(
-            self.state_domain["lo"]), hi=jnp.array(self.state_domain["hi"]))
-        grid_resolution = self.state_domain["resolution"]
-        p_dims = self.state_domain["periodic_dims"]
-        return hj.Grid.from_lattice_parameters_and_boundary_conditions(
-            bounding_box, grid_resolution, periodic_dims=p_dims
-        )
-
-
-# Obstacle Classes
-class Obstacle:
-    def __init__(self, type, stateIndices, obstacleName, updateRule, padding, updateTime, detectionRadius) -> None:
-        self.type = type
-        self.stateIndices = stateIndices
-        self.obstacleName = obstacleName
-        self.updateRule = updateRule
-        self.padding = padding
-        self.updateTime = updateTime
-        self.detectionRadius = detectionRadius
-
-
-class Circle(Obstacle):
-    def __init__(
-        self, stateIndices, obstacleName, radius, center, updateRule="Time", padding=0, updateTime=None, detectionRadius=None
-    ) -> None:
-        super().__init__("Circle", stateIndices, obstacleName,
-                         updateRule, padding, updateTime, detectionRadius)
-        self.radius = radius
-        self.center = jnp.reshape(np.array(center), (-1, 1))
-
-    def obstacle_sdf(self, x):
-        obstacle_sdf = (
-            jnp.linalg.norm(
-                jnp.array([self.center - jnp.reshape(x[..., self.stateIndices], (-1, 1))]))
-            - self.radius
-            - self.padding
-        )
-        return obstacle_sdf
-
-    def distance_to_obstacle(self, state):
-        point = state[self.stateIndices].reshape(-1)
-        distance = np.linalg.norm(self.center.reshape(-1) - point) - \
-            self.radius - self.padding
-        return distance
-
-
-class Rectangle(Obstacle):
-    def __init__(
-        self, stateIndices, obstacleName, minVal, maxVal, updateRule="Time", padding=0, updateTime=None, detectionRadius=None
-    ) -> None:
-        super().__init__("Rectangle", stateIndices, obstacleName,
-                         updateRule, padding, updateTime, detectionRadius)
-        self.minVal = jnp.reshape(np.array(minVal), (-1, 1))
-        self.maxVal = jnp.reshape(np.array(maxVal), (-1, 1))
-
-    def obstacle_sdf(self, x):
-        max_dist_per_dim = jnp.max(
-            jnp.array(
-                [
-                    self.minVal -
-                    jnp.reshape(x[..., self.stateIndices], (-1, 1)),
-                    jnp.reshape(x[..., self.stateIndices],
-                                (-1, 1)) - self.maxVal,
-                ]
-            ),
-            axis=0,
-        )
-
-        def outside_obstacle(_):
-            return jnp.linalg.norm(jnp.maximum(max_dist_per_dim, 0))
-
-        def inside_obstacle(_):
-            return jnp.max(max_dist_per_dim)
-
-        obstacle_sdf = (
-            jax.lax.cond(jnp.all(max_dist_per_dim < 0.0),
-                         inside_obstacle, outside_obstacle, operand=None)
-            - self.padding
-        )
-        return obstacle_sdf
-
-    def distance_to_obstacle(self, state):
-        point = state[self.stateIndices].reshape(-1)
-        minVal = self.minVal.reshape(-1)
-        maxVal = self.maxVal.reshape(-1)
-        max_dist_per_dim = np.max(np.array([minVal - point, point - maxVal]), axis=0)
-        raw_distance = np.where(np.all(max_dist_per_dim < 0.0), 
-                                np.max(max_dist_per_dim), 
-                                np.linalg.norm(np.maximum(0, max_dist_per_dim)))
-        return raw_distance - self.padding
+    def setup_hj_dynamics(self):
+        import hj_reachability as hj
+        import jax.numpy as jnp
+        from refine_cbfs import HJControlAffineDynamics
 
-
-class Boundary(Obstacle):
-    def __init__(self, stateIndices, minVal, maxVal, padding=0) -> None:
-        super().__init__("Boundary", stateIndices, None, None,
-                         padding, updateTime=None, detectionRadius=None)
-        self.minVal = jnp.reshape(np.array(minVal), (-1, 1))
-        self.maxVal = jnp.reshape(np.array(maxVal), (-1, 1))
-
-    def boundary_sdf(self, x):
-        max_dist_per_dim = jnp.max(
-            jnp.array(
-                [
-                    self.minVal -
-                    jnp.reshape(x[..., self.stateIndices], (-1, 1)),
-                    jnp.reshape(x[..., self.stateIndices],
-                                (-1, 1)) - self.maxVal,
-                ]
-            ),
-            axis=0,
-        )
-
-        def outside_boundary(_):
-            return -jnp.linalg.norm(jnp.maximum(max_dist_per_dim, 0))
-
-        def inside_boundary(_):
-            return -jnp.max(max_dist_per_dim)
-
-        obstacle_sdf = (
-            jax.lax.cond(jnp.all(max_dist_per_dim < 0.0),
-                         inside_boundary, outside_boundary, operand=None)
-            - self.padding
+        if self.control_space["n_dims"] == 0:
+            control_space_hj = hj.sets.Box(
+                lo=jnp.array([]), hi=jnp.array([]))
+        else:
+            control_space_hj = hj.sets.Box(
+                lo=jnp.array(self.control_space["lo"]), hi=jnp.array(self.control_space["hi"])
+            )
+        if self.disturbance_space["n_dims"] == 0:
+            dist_space_hj = hj.sets.Box(lo=jnp.array([]), hi=jnp.array([]))
+        else:
+            dist_space_hj = hj.sets.Box(
+                lo=jnp.array(self.disturbance_space["lo"]), hi=jnp.array(self.disturbance_space["hi"])
+            )
+        return HJControlAffineDynamics(
+            self.dynamics, control_space=control_space_hj, disturbance_space=dist_space_hj
         )
-        return obstacle_sdf
-
-
-# Dynamics Classes
-class QuadNearHoverPlanarDynamics(ControlAffineDynamics):
-    """
-    Simplified dynamics, and we need to convert controls from phi to tan(phi)"""
-
-    STATES = ["y", "z", "v_y", "v_z"]
-    CONTROLS = ["tan(phi)", "T"]
-    DISTURBANCES = ["dy"]
-
-    def open_loop_dynamics(self, state, time: float = 0.0):
-        return jnp.array([state[2], state[3], 0.0, -self.params["g"]])
-
-    def control_matrix(self, state, time: float = 0.0):
-        return jnp.array([[0.0, 0.0], [0.0, 0.0], [-self.params["g"], 0.0], [0.0, 1.0]])
-
-    def disturbance_matrix(self, state, time: float = 0.0):
-        return jnp.array([[1.0, 0.0, 0.0, 0.0]]).reshape(len(self.STATES), len(self.DISTURBANCES))
-
 
-class DubinsCarDynamics(ControlAffineDynamics):
-    """
-    Dubins Car Dynamics for the Turtlebot
-    """
-
-    STATES = ["x", "y", "theta"]
-    CONTROLS = ["omega", "v"]
-    # DISTURBANCES = ["dx", "dy"]
-
-    def open_loop_dynamics(self, state, time: float = 0):
-        return jnp.array([0.0, 0.0, 0.0])
-
-    def control_matrix(self, state, time: float = 0.0):
-        return jnp.array([[jnp.cos(state[2]), 0.0], [jnp.sin(state[2]), 0.0], [0.0, 1.0]])
-
-    # def disturbance_jacobian(self, state, time: float = 0.0):
-    #     return jnp.array([[1.0, 0.0], [0.0, 1.0], [0.0, 0.0]])
-
-
-# Defining the dynamics of the quadrotor
-class CrazyflieDynamics(ControlAffineDynamics):
-    """
-    Simplified dynamics, and we need to convert controls from phi to tan(phi)"""
-
-    STATES = ["y", "z", "v_y", "v_z"]
-    CONTROLS = ["tan(phi)", "T"]
-    DISTURBANCES = []
-
-    def __init__(self, params, test=True, **kwargs):
-        super().__init__(params, test, **kwargs)
-
-    def open_loop_dynamics(self, state, time: float = 0.0):
-        return jnp.array([state[2], state[3], 0.0, -self.params["g"]])
-
-    def control_matrix(self, state, time: float = 0.0):
-        return jnp.array([[0.0, 0.0], [0.0, 0.0], [self.params["g"], 0.0], [0.0, 1.0]])
-
-    def state_jacobian(self, state, control, disturbance=None, time: float = 0.0):
-        return jax.jacfwd(lambda x: self.__call__(x, control, disturbance, time))(state)
-
-
-# Implementing creating CBF
-class QuadraticCBF(ControlAffineCBF):
-    def __init__(self, dynamics, params, test=False, **kwargs):
-        self.scaling = params["scaling"]
-        self.center = params["center"]
-        self.offset = params["offset"]
-        self._vf_grad = jax.vmap(
-            jax.grad(self.vf, argnums=0), in_axes=(0, None))
-        super().__init__(dynamics, params=params, test=False, **kwargs)
-
-    def vf(self, state, time=0.0):
-        val = self.offset - \
-            jnp.sum(np.array(self.scaling) *
-                    (state - np.array(self.center)) ** 2, axis=-1)
-        return val
-
-    def _grad_vf(self, state, time=0.0):
-        return self._vf_grad(state, time)
+    def setup_grid(self):
+        return self.grid.to_hj_grid()
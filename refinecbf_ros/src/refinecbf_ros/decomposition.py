@@ -0,0 +1,306 @@
+import functools
+import numpy as np
+import hj_reachability as hj
+import jax
+import jax.numpy as jnp
+from cbf_opt import ControlAffineDynamics
+from refine_cbfs import HJControlAffineDynamics
+from refinecbf_ros.obstacles import Boundary
+from refinecbf_ros.dynamics import array_module
+from refinecbf_ros.grid import GridSpec
+from refinecbf_ros.sdf import compose_sdf
+
+# Decoupled subsystems per dynamics class: state, control and disturbance indices of each subsystem
+SUBSYSTEMS = {
+    "quad_near_hover": {
+        "y": {"states": [0, 2], "controls": [0], "disturbances": [0]},
+        "z": {"states": [1, 3], "controls": [1], "disturbances": []},
+    },
+}
+
+
+class SubsystemDynamics(ControlAffineDynamics):
+    """
+    Dynamics of a decoupled subsystem of a ControlAffineDynamics: the full dynamics evaluated with the states of the
+    other subsystems at zero, restricted to the rows of the subsystem states and the columns of its controls and
+    disturbances (see assert_decoupled).
+
+    Args:
+        dynamics (ControlAffineDynamics): Full dynamics.
+        states (list): State indices of the subsystem.
+        controls (list): Control indices of the subsystem.
+        disturbances (list): Disturbance indices of the subsystem.
+    """
+
+    def __init__(self, dynamics, states, controls, disturbances):
+        self.full_dynamics = dynamics
+        self.states = list(states)
+        self.controls = list(controls)
+        self.disturbances = list(disturbances)
+        self.STATES = [dynamics.STATES[i] for i in self.states]
+        self.CONTROLS = [dynamics.CONTROLS[i] for i in self.controls]
+        self.DISTURBANCES = [dynamics.DISTURBANCES[i] for i in self.disturbances]
+        self.PERIODIC_DIMS = [self.states.index(i) for i in dynamics.periodic_dims if i in self.states]
+        super().__init__(dynamics.params, test=False, dt=getattr(dynamics, "dt", 0.05))
+
+    def _embed(self, state):
+        xp = array_module(state)
+        zero = xp.zeros_like(state[..., 0])
+        return xp.stack(
+            [
+                state[..., self.states.index(i)] if i in self.states else zero
+                for i in range(self.full_dynamics.n_dims)
+            ],
+            axis=-1,
+        )
+
+    def open_loop_dynamics(self, state, time: float = 0.0):
+        return self.full_dynamics.open_loop_dynamics(self._embed(state), time)[..., self.states]
+
+    def control_matrix(self, state, time: float = 0.0):
+        return self.full_dynamics.control_matrix(self._embed(state), time)[..., self.states, :][..., self.controls]
+
+    def disturbance_matrix(self, state, time: float = 0.0):
+        if len(self.disturbances) == 0:
+            return np.zeros(np.shape(state)[:-1] + (len(self.states), 0))
+        matrix = self.full_dynamics.disturbance_matrix(self._embed(state), time)
+        return matrix[..., self.states, :][..., self.disturbances]
+
+
+@functools.partial(jax.jit, static_argnames=("accuracy", "dynamics", "horizon"))
+def constrained_step(values, sdf, grid, accuracy, dynamics, horizon):
+    """
+    hj.step over horizon seconds with the value postprocessor min(V, sdf). The SDF is a traced argument, so changed
+    constraints reuse the compiled step, which is traced once per subsystem dynamics.
+    """
+    solver_settings = hj.SolverSettings.with_accuracy(accuracy, value_postprocessor=lambda t, x: jnp.minimum(x, sdf))
+    return hj.step(solver_settings, dynamics, grid, 0.0, values, -horizon, progress_bar=False)
+
+
+def assert_decoupled(dynamics, subsystems, lo, hi, n_samples=16, seed=0):
+    """
+    Checks on random states in [lo, hi] that the subsystems partition the states and controls, and that the drift,
+    control and disturbance matrix rows of every subsystem neither depend on the other states nor on the other
+    controls / disturbances. Raises a ValueError otherwise.
+    """
+    states = sorted(i for subsystem in subsystems.values() for i in subsystem["states"])
+    controls = sorted(i for subsystem in subsystems.values() for i in subsystem["controls"])
+    if states != list(range(dynamics.n_dims)) or controls != list(range(dynamics.control_dims)):
+        raise ValueError("Subsystems have to partition the states and controls")
+    lo, hi = np.array(lo, dtype=float), np.array(hi, dtype=float)
+    rng = np.random.default_rng(seed)
+    for name, subsystem in subsystems.items():
+        rows = subsystem["states"]
+        others = [i for i in range(dynamics.n_dims) if i not in rows]
+        other_controls = [i for i in range(dynamics.control_dims) if i not in subsystem["controls"]]
+        other_disturbances = [i for i in range(dynamics.disturbance_dims) if i not in subsystem["disturbances"]]
+        for _ in range(n_samples):
+            state = rng.uniform(lo, hi)
+            perturbed = state.copy()
+            perturbed[others] = rng.uniform(lo[others], hi[others])
+            for matrix in [dynamics.open_loop_dynamics, dynamics.control_matrix, dynamics.disturbance_matrix]:
+                value = np.asarray(matrix(state, 0.0))[rows]
+                if value.size and not np.allclose(value, np.asarray(matrix(perturbed, 0.0))[rows]):
+                    raise ValueError("Subsystem {} depends on the states of other subsystems".format(name))
+            control_matrix = np.asarray(dynamics.control_matrix(state, 0.0))[rows]
+            disturbance_matrix = np.asarray(dynamics.disturbance_matrix(state, 0.0))[rows]
+            if np.any(control_matrix[:, other_controls] != 0) or np.any(disturbance_matrix[:, other_disturbances] != 0):
+                raise ValueError("Subsystem {} is driven by controls / disturbances of other subsystems".format(name))
+
+
+def subsystem_grid(grid, states):
+    """
+    Grid of a subsystem: the dimensions states of grid.
+    """
+    return GridSpec(
+        grid.domain.lo[states],
+        grid.domain.hi[states],
+        [grid.shape[i] for i in states],
+        [states.index(i) for i in grid.periodic_dims if i in states],
+    )
+
+
+def embed_table(values, states, ndim):
+    """
+    Reshapes a table over the subsystem states so that it broadcasts against the full grid.
+    """
+    order = np.argsort(states)
+    shape = [1] * ndim
+    for i in states:
+        shape[i] = values.shape[states.index(i)]
+    return np.transpose(values, order).reshape(shape)
+
+
+def project_sdf(grid, obstacle, states):
+    """
+    SDF of the projection of an obstacle onto the subsystem states, i.e. the minimum of its SDF over its other state
+    dimensions (outside of the obstacle this is the distance to the projected obstacle).
+
+    Returns:
+        np.ndarray: SDF on the subsystem grid.
+    """
+    table = obstacle.sdf_table(grid)
+    other = tuple(i for i in obstacle.stateIndices if i not in states)
+    if other:
+        table = table.min(axis=other, keepdims=True)
+    sub_shape = tuple(grid.shape[i] for i in states)
+    table = np.transpose(table, states + [i for i in range(grid.ndim) if i not in states])
+    return np.array(np.broadcast_to(table.reshape(table.shape[: len(states)]), sub_shape))
+
+
+def boundary_sdf(grid, boundary, states):
+    """
+    SDF of the boundary restricted to the subsystem states (None if the boundary does not constrain them). The
+    boundary is a box, so the minimum over the subsystems of these SDFs has the same zero level set as its SDF.
+    """
+    positions = [k for k, i in enumerate(boundary.stateIndices) if i in states]
+    if not positions:
+        return None
+    sub_boundary = Boundary(
+        stateIndices=[states.index(boundary.stateIndices[k]) for k in positions],
+        minVal=np.reshape(np.array(boundary.minVal), -1)[positions],
+        maxVal=np.reshape(np.array(boundary.maxVal), -1)[positions],
+        padding=boundary.padding,
+    )
+    sub_grid = subsystem_grid(grid, states)
+    return np.array(np.broadcast_to(sub_boundary.sdf_table(sub_grid), sub_grid.shape))
+
+
+class DecomposedReachability:
+    """
+    Safety value function of decoupled dynamics from value functions of their subsystems, each solved on its own
+    lower dimensional grid. Every subsystem s is solved for the constraints only on its states (boundary, obstacles
+    on its states), giving V_s. Obstacles spanning several subsystems (e.g. a rectangle in y and z) are avoided if any
+    one of the subsystems they span avoids their projection, so every subsystem s spanned by such obstacles is also
+    solved for its own constraints plus the projections of all of them, giving V_s^c. The combination
+
+        V(x) = min(min_s V_s(x_s), min_k max_{s spanned by k} V_s^c(x_s))
+
+    is conservative: from {V >= 0} every subsystem follows the policy of V_s^c if V_s^c >= 0 (else of V_s), which
+    keeps it within its own constraints and, for every spanning obstacle, at least one subsystem out of its projection.
+
+    Args:
+        grid (GridSpec): Full grid.
+        dynamics (ControlAffineDynamics): Full dynamics.
+        subsystems (dict): Subsystem name -> {"states", "controls", "disturbances"} indices (see SUBSYSTEMS).
+        control_space (dict): Control space ("lo", "hi") of the full dynamics.
+        disturbance_space (dict): Disturbance space ("lo", "hi", "n_dims") of the full dynamics.
+    """
+
+    def __init__(self, grid, dynamics, subsystems, control_space, disturbance_space):
+        self.grid = grid
+        self.subsystems = {}
+        for name, spec in subsystems.items():
+            sub_grid = subsystem_grid(grid, list(spec["states"]))
+            self.subsystems[name] = {
+                "states": list(spec["states"]),
+                "dynamics": SubsystemDynamics(dynamics, spec["states"], spec["controls"], spec["disturbances"]),
+                "grid": sub_grid,
+                "hj_grid": sub_grid.to_hj_grid(),
+            }
+        disturbance_lo = disturbance_space["lo"] if disturbance_space["n_dims"] != 0 else []
+        disturbance_hi = disturbance_space["hi"] if disturbance_space["n_dims"] != 0 else []
+        self.set_spaces(control_space["lo"], control_space["hi"], disturbance_lo, disturbance_hi)
+        self.sdfs = {}  # (subsystem, "own" / "coupled") -> SDF on the subsystem grid
+        self.sdf_arrays = {}
+        self.values = {}  # (subsystem, "own" / "coupled") -> VF on the subsystem grid
+        self.spans = []  # Subsystems spanned by each group of spanning obstacles
+        self.constraint_sdf = None  # Full-grid SDF of the constraints the subsystems are solved for
+
+    def set_spaces(self, control_lo, control_hi, disturbance_lo, disturbance_hi):
+        for subsystem in self.subsystems.values():
+            dynamics = subsystem["dynamics"]
+            control_space = hj.sets.Box(
+                lo=jnp.array(np.array(control_lo)[dynamics.controls]),
+                hi=jnp.array(np.array(control_hi)[dynamics.controls]),
+            )
+            disturbance_space = hj.sets.Box(
+                lo=jnp.array(np.array(disturbance_lo)[dynamics.disturbances]),
+                hi=jnp.array(np.array(disturbance_hi)[dynamics.disturbances]),
+            )
+            subsystem["hj_dynamics"] = HJControlAffineDynamics(
+                dynamics, control_space=control_space, disturbance_space=disturbance_space
+            )
+
+    def set_environment(self, boundary, obstacles):
+        """
+        Sets the constraints of the subsystems. Value functions of unchanged constraints are kept, value functions of
+        changed constraints are warm started (re-seeded with the SDF where it increased).
+        """
+        self.constraint_sdf = compose_sdf(self.grid, boundary, obstacles)
+        spans = {}
+        for obstacle in obstacles:
+            spanned = frozenset(
+                name for name, subsystem in self.subsystems.items()
+                if any(i in subsystem["states"] for i in obstacle.stateIndices)
+            )
+            spans.setdefault(spanned, []).append(obstacle)
+        self.spans = [spanned for spanned in spans if len(spanned) > 1]
+
+        sdfs = {}
+        for name, subsystem in self.subsystems.items():
+            states = subsystem["states"]
+            own = boundary_sdf(self.grid, boundary, states)
+            if own is None:
+                # Unconstrained: the diameter of the subgrid (farther than any constraint), finite so that the upwind
+                # differences of the solver do not produce NaN (inf - inf)
+                domain = subsystem["grid"].domain
+                own = np.full(subsystem["grid"].shape, np.linalg.norm(np.subtract(domain.hi, domain.lo)))
+            for obstacle in spans.get(frozenset([name]), []):
+                own = np.minimum(own, project_sdf(self.grid, obstacle, states))
+            sdfs[(name, "own")] = own
+            coupled = [obstacle for spanned in self.spans if name in spanned for obstacle in spans[spanned]]
+            if coupled:
+                sdf = own
+                for obstacle in coupled:
+                    sdf = np.minimum(sdf, project_sdf(self.grid, obstacle, states))
+                sdfs[(name, "coupled")] = sdf
+
+        for key, sdf in sdfs.items():
+            if key not in self.values:
+                self.values[key] = sdf.copy()
+            elif not np.array_equal(sdf, self.sdfs[key]):
+                values = np.minimum(np.array(self.values[key]), sdf)
+                self.values[key] = np.where(sdf > self.sdfs[key], sdf, values)
+        for key in [key for key in self.values if key not in sdfs]:
+            del self.values[key]
+        self.sdfs = sdfs
+        self.sdf_arrays = {key: jnp.array(sdf) for key, sdf in sdfs.items()}  # Device copies, passed to every step
+
+    def covers(self, sdf, tolerance=1e-4):
+        """
+        Whether the subsystems are solved for every constraint of a full-grid SDF, i.e. sdf is nowhere below the SDF of
+        their constraints. Otherwise their combination may be unsafe for sdf.
+        """
+        return bool(np.all(np.asarray(sdf) >= self.constraint_sdf - tolerance))
+
+    def step(self, accuracy, horizon):
+        """
+        Advances every subsystem value function by horizon seconds.
+        """
+        for key, values in self.values.items():
+            subsystem = self.subsystems[key[0]]
+            self.values[key] = np.array(
+                constrained_step(
+                    jnp.array(values), self.sdf_arrays[key], subsystem["hj_grid"], accuracy, subsystem["hj_dynamics"],
+                    float(horizon),
+                )
+            )
+
+    def combine(self):
+        """
+        Conservative value function on the full grid (see class docstring).
+        """
+        embedded = {
+            key: embed_table(values, self.subsystems[key[0]]["states"], self.grid.ndim)
+            for key, values in self.values.items()
+        }
+        combined = np.inf
+        for name in self.subsystems:
+            combined = np.minimum(combined, embedded[(name, "own")])
+        for spanned in self.spans:
+            term = -np.inf
+            for name in spanned:
+                term = np.maximum(term, embedded[(name, "coupled")])
+            combined = np.minimum(combined, term)
+        return np.array(np.broadcast_to(combined, self.grid.shape))
@@ -0,0 +1,134 @@
+import itertools
+import numpy as np
+
+
+class _ObstacleGroup:
+    """
+    Struct-of-arrays storage of the Circle / Rectangle obstacles that share the same stateIndices.
+    Circles are stored with lo = hi = center and a positive radius, rectangles with their box and a zero radius, so
+    that one expression evaluates the distance to both: ||max(lo - p, p - hi, 0)|| - radius (or the largest face
+    distance when p is inside a rectangle).
+    """
+
+    def __init__(self, state_indices, obstacles, cell_size=None):
+        self.state_indices = list(state_indices)
+        self.obstacles = list(obstacles)
+        lo, hi, radius = [], [], []
+        for obstacle in self.obstacles:
+            if obstacle.type == "Circle":
+                center = np.reshape(np.array(obstacle.center), -1)
+                lo.append(center)
+                hi.append(center)
+                radius.append(obstacle.radius)
+            elif obstacle.type == "Rectangle":
+                lo.append(np.reshape(np.array(obstacle.minVal), -1))
+                hi.append(np.reshape(np.array(obstacle.maxVal), -1))
+                radius.append(0.0)
+            else:
+                raise ValueError("Invalid Obstacle Type for detection: {}".format(obstacle.type))
+        self.lo = np.array(lo, dtype=float)
+        self.hi = np.array(hi, dtype=float)
+        self.radius = np.array(radius, dtype=float)
+        self.padding = np.array([obstacle.padding for obstacle in self.obstacles], dtype=float)
+        self.detection_radius = np.array([obstacle.detectionRadius for obstacle in self.obstacles], dtype=float)
+        self.detected = np.zeros(len(self.obstacles), dtype=bool)
+
+        # Uniform grid hash over the AABBs expanded by everything that counts towards detection
+        reach = (self.radius + self.padding + self.detection_radius)[:, None]
+        aabb_lo, aabb_hi = self.lo - reach, self.hi + reach
+        if cell_size is None:
+            # Every expanded AABB overlaps at most 2 cells per dimension
+            cell_size = np.max(aabb_hi - aabb_lo, axis=0)
+        self.cell_size = np.maximum(np.broadcast_to(np.array(cell_size, dtype=float), (len(self.state_indices),)), 1e-6)
+        cells = {}
+        cell_lo = np.floor(aabb_lo / self.cell_size).astype(int)
+        cell_hi = np.floor(aabb_hi / self.cell_size).astype(int)
+        for i, (c_lo, c_hi) in enumerate(zip(cell_lo, cell_hi)):
+            for cell in itertools.product(*(range(l, h + 1) for l, h in zip(c_lo, c_hi))):
+                cells.setdefault(cell, []).append(i)
+        self.cells = {cell: np.array(indices) for cell, indices in cells.items()}
+
+    def candidates(self, point):
+        cell = tuple(np.floor(point / self.cell_size).astype(int))
+        return self.cells.get(cell, np.zeros(0, dtype=int))
+
+    def distances(self, point, indices):
+        dists = np.maximum(self.lo[indices] - point, point - self.hi[indices])
+        outside = np.linalg.norm(np.maximum(dists, 0.0), axis=-1)
+        inside = np.max(dists, axis=-1)
+        raw_distance = np.where((inside < 0.0) & (self.radius[indices] == 0.0), inside, outside)
+        return raw_distance - self.radius[indices] - self.padding[indices]
+
+
+class DetectionIndex:
+    """
+    Vectorized detection engine for Detection obstacles.
+    Obstacles are stored as struct-of-arrays per set of stateIndices and hashed into a uniform grid over their
+    detection regions, so a tick only evaluates the (batched) distances to the obstacles in the cell of the robot.
+
+    Args:
+        obstacles (list): Circle / Rectangle obstacles with a detectionRadius.
+        cell_size (float or array, optional): Cell size of the grid hash, defaults to the largest detection region.
+    """
+
+    def __init__(self, obstacles, cell_size=None):
+        groups = {}
+        for obstacle in obstacles:
+            groups.setdefault(tuple(obstacle.stateIndices), []).append(obstacle)
+        self.groups = [_ObstacleGroup(indices, group, cell_size) for indices, group in groups.items()]
+
+    def detect(self, state):
+        """
+        Returns the obstacles that are within their detection radius of state and were not detected before.
+        Detected obstacles are marked, i.e. they are only returned once.
+        """
+        state = np.asarray(state)
+        detected = []
+        for group in self.groups:
+            point = state[group.state_indices].reshape(-1)
+            candidates = group.candidates(point)
+            candidates = candidates[~group.detected[candidates]]
+            if candidates.size == 0:
+                continue
+            hits = candidates[group.distances(point, candidates) <= group.detection_radius[candidates]]
+            group.detected[hits] = True
+            detected.extend(group.obstacles[i] for i in hits)
+        return detected
+
+    def mark_detected(self, obstacle_names):
+        obstacle_names = set(obstacle_names)
+        for group in self.groups:
+            for i, obstacle in enumerate(group.obstacles):
+                if obstacle.obstacleName in obstacle_names:
+                    group.detected[i] = True
+
+    def __len__(self):
+        return sum(len(group.obstacles) for group in self.groups)
+
+
+class UpdateSchedule:
+    """
+    Update obstacles sorted by updateTime, due obstacles are found by advancing a pointer instead of a full scan.
+    """
+
+    def __init__(self, obstacles):
+        self.obstacles = sorted(obstacles, key=lambda obstacle: obstacle.updateTime)
+        self.update_times = np.array([obstacle.updateTime for obstacle in self.obstacles], dtype=float)
+        self.next_index = 0
+
+    def due(self, elapsed_time):
+        """
+        Returns the obstacles whose updateTime has passed since the last call.
+        """
+        end = int(np.searchsorted(self.update_times, elapsed_time, side="right"))
+        due = self.obstacles[self.next_index : end]
+        self.next_index = max(self.next_index, end)
+        return due
+
+    def replace(self, old_obstacle, new_obstacle):
+        """
+        Replaces a scheduled obstacle (e.g. moved before it appeared), keeping its position in the schedule.
+        """
+        for i, obstacle in enumerate(self.obstacles):
+            if obstacle is old_obstacle:
+                self.obstacles[i] = new_obstacle
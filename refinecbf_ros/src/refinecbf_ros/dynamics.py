@@ -0,0 +1,165 @@
+import numpy as np
+from cbf_opt import ControlAffineDynamics, ControlAffineCBF
+
+
+def array_module(*arrays):
+    """
+    Array module matching the inputs: jax.numpy for JAX arrays and tracers (HJ solver, autodiff), NumPy otherwise, so
+    that nodes that only evaluate the dynamics never import JAX.
+    """
+    for array in arrays:
+        if type(array).__module__.startswith("jax"):
+            import jax.numpy as jnp
+
+            return jnp
+    return np
+
+
+def batch_shape(state):
+    return np.shape(state)[:-1]
+
+
+def broadcast_matrix(matrix, state):
+    """
+    Constant matrix broadcast over the batch dimensions of state (a read-only view, nothing is copied).
+    """
+    return np.broadcast_to(matrix, batch_shape(state) + matrix.shape)
+
+
+def constant_matrix(rows):
+    matrix = np.array(rows, dtype=float)
+    matrix.setflags(write=False)
+    return matrix
+
+
+class PlanarQuadDynamics(ControlAffineDynamics):
+    """
+    Planar quadrotor near hover (y, z, v_y, v_z): the drift and every matrix are closed-form, the constant ones are
+    built once, and all of them accept single states (n_dims,) as well as batches (..., n_dims).
+    JAX inputs (HJ solver) get jax.numpy drifts so they stay traceable.
+    """
+
+    STATES = ["y", "z", "v_y", "v_z"]
+    CONTROLS = ["tan(phi)", "T"]
+    DISTURBANCES = []
+    # Sign of the lateral acceleration per unit tan(phi)
+    ROLL_SIGN = 1.0
+
+    def __init__(self, params, test=True, **kwargs):
+        g = params["g"]
+        self._control_matrix = constant_matrix([[0.0, 0.0], [0.0, 0.0], [self.ROLL_SIGN * g, 0.0], [0.0, 1.0]])
+        # Disturbances act on the leading states, in order (dy on y)
+        self._disturbance_matrix = constant_matrix(np.eye(len(self.STATES), len(self.DISTURBANCES)))
+        self._state_jacobian = constant_matrix(
+            [[0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0], [0.0, 0.0, 0.0, 0.0], [0.0, 0.0, 0.0, 0.0]]
+        )
+        super().__init__(params, test, **kwargs)
+
+    def open_loop_dynamics(self, state, time: float = 0.0):
+        xp = array_module(state)
+        if xp is not np:
+            zero = xp.zeros_like(state[..., 0])
+            return xp.stack([state[..., 2], state[..., 3], zero, zero - self.params["g"]], axis=-1)
+        state = np.asarray(state, dtype=float)
+        drift = np.empty(state.shape)
+        drift[..., :2] = state[..., 2:]
+        drift[..., 2] = 0.0
+        drift[..., 3] = -self.params["g"]
+        return drift
+
+    def control_matrix(self, state, time: float = 0.0):
+        return broadcast_matrix(self._control_matrix, state)
+
+    def disturbance_matrix(self, state, time: float = 0.0):
+        return broadcast_matrix(self._disturbance_matrix, state)
+
+    def state_jacobian(self, state, control, disturbance=None, time: float = 0.0):
+        return broadcast_matrix(self._state_jacobian, state)
+
+    def control_jacobian(self, state, control, disturbance=None, time: float = 0.0):
+        return self.control_matrix(state, time)
+
+    def disturbance_jacobian(self, state, time: float = 0.0):
+        return self.disturbance_matrix(state, time)
+
+
+# Dynamics Classes
+class QuadNearHoverPlanarDynamics(PlanarQuadDynamics):
+    """
+    Simplified dynamics, and we need to convert controls from phi to tan(phi)"""
+
+    DISTURBANCES = ["dy"]
+    ROLL_SIGN = -1.0
+
+
+class DubinsCarDynamics(ControlAffineDynamics):
+    """
+    Dubins Car Dynamics for the Turtlebot
+    """
+
+    STATES = ["x", "y", "theta"]
+    CONTROLS = ["omega", "v"]
+    # DISTURBANCES = ["dx", "dy"]
+
+    def __init__(self, params, test=True, **kwargs):
+        self._drift = constant_matrix([0.0, 0.0, 0.0])
+        super().__init__(params, test, **kwargs)
+
+    def open_loop_dynamics(self, state, time: float = 0):
+        return broadcast_matrix(self._drift, state)
+
+    def control_matrix(self, state, time: float = 0.0):
+        xp = array_module(state)
+        if xp is not np:
+            zero = xp.zeros_like(state[..., 2])
+            cos, sin = xp.cos(state[..., 2]), xp.sin(state[..., 2])
+            rows = [xp.stack([cos, zero], -1), xp.stack([sin, zero], -1), xp.stack([zero, zero + 1.0], -1)]
+            return xp.stack(rows, -2)
+        state = np.asarray(state, dtype=float)
+        matrix = np.zeros(batch_shape(state) + (3, 2))
+        matrix[..., 0, 0] = np.cos(state[..., 2])
+        matrix[..., 1, 0] = np.sin(state[..., 2])
+        matrix[..., 2, 1] = 1.0
+        return matrix
+
+    def state_jacobian(self, state, control, disturbance=None, time: float = 0.0):
+        state, control = np.asarray(state, dtype=float), np.asarray(control, dtype=float)
+        jacobian = np.zeros(batch_shape(state) + (3, 3))
+        jacobian[..., 0, 2] = -np.sin(state[..., 2]) * control[..., 0]
+        jacobian[..., 1, 2] = np.cos(state[..., 2]) * control[..., 0]
+        return jacobian
+
+    def control_jacobian(self, state, control, disturbance=None, time: float = 0.0):
+        return self.control_matrix(state, time)
+
+    # def disturbance_jacobian(self, state, time: float = 0.0):
+    #     return jnp.array([[1.0, 0.0], [0.0, 1.0], [0.0, 0.0]])
+
+
+# Defining the dynamics of the quadrotor
+class CrazyflieDynamics(PlanarQuadDynamics):
+    """
+    Simplified dynamics, and we need to convert controls from phi to tan(phi)"""
+
+
+# Implementing creating CBF
+class QuadraticCBF(ControlAffineCBF):
+    def __init__(self, dynamics, params, test=False, **kwargs):
+        import jax
+
+        self.scaling = params["scaling"]
+        self.center = params["center"]
+        self.offset = params["offset"]
+        self._vf_grad = jax.vmap(
+            jax.grad(self.vf, argnums=0), in_axes=(0, None))
+        super().__init__(dynamics, params=params, test=False, **kwargs)
+
+    def vf(self, state, time=0.0):
+        xp = array_module(state)
+        val = self.offset - \
+            xp.sum(np.array(self.scaling) *
+                   (state - np.array(self.center)) ** 2, axis=-1)
+        return val
+
+    def _grad_vf(self, state, time=0.0):
+        return self._vf_grad(state, time)
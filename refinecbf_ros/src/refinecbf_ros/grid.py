@@ -0,0 +1,143 @@
+from collections import namedtuple
+import numpy as np
+from refinecbf_ros.tables import interpolate_table, grad_table
+
+Box = namedtuple("Box", ["lo", "hi"])
+
+DEFAULT_CHUNK_SIZE = 2**16
+
+
+def grid_states(grid, flat_indices):
+    """
+    States (n, ndim) of the grid nodes at the given C-order flat indices, from the coordinate vectors of the grid
+    (GridSpec or hj.Grid).
+    """
+    indices = np.unravel_index(np.asarray(flat_indices), tuple(grid.shape))
+    return np.stack([np.asarray(grid.coordinate_vectors[dim])[index] for dim, index in enumerate(indices)], axis=-1)
+
+
+def chunk_size_for(grid, budget_bytes, values_per_node=1, itemsize=8, overhead=4):
+    """
+    Largest chunk size whose states and values, with overhead times as much for intermediates, fit in budget_bytes.
+    """
+    return max(1, int(budget_bytes // (itemsize * overhead * (grid.ndim + values_per_node))))
+
+
+def evaluate_grid(grid, fn, chunk_size=DEFAULT_CHUNK_SIZE, out=None):
+    """
+    Evaluates fn over all grid nodes, chunk_size nodes at a time, into a preallocated table. Peak memory is the table
+    plus what fn needs for one chunk, instead of the full states array and intermediates of fn over the whole grid.
+    Every chunk is padded to chunk_size (repeating its last state), so jitted functions are compiled only once.
+
+    Args:
+        grid (GridSpec or hj.Grid): Grid to evaluate fn on.
+        fn (callable): Maps a batch of states (n, ndim) to values (n, ...), e.g. a jax.vmap of a pointwise function.
+        chunk_size (int, optional): Number of nodes evaluated at once.
+        out (np.ndarray, optional): Table to write into, of shape grid.shape + value shape.
+
+    Returns:
+        np.ndarray: Table of shape grid.shape + value shape.
+    """
+    size = int(np.prod(grid.shape))
+    chunk_size = min(int(chunk_size), size)
+    flat_out = None if out is None else out.reshape((size,) + out.shape[len(grid.shape):])
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        indices = np.minimum(np.arange(start, start + chunk_size), stop - 1)
+        values = np.asarray(fn(grid_states(grid, indices)))[: stop - start]
+        if flat_out is None:
+            out = np.empty(tuple(grid.shape) + values.shape[1:], dtype=values.dtype)
+            flat_out = out.reshape((size,) + values.shape[1:])
+        flat_out[start:stop] = values
+    return out
+
+
+class GridSpec:
+    """
+    Lightweight description of the state grid (bounds, shape, spacing, periodic dimensions) with the same lattice as
+    hj.Grid.from_lattice_parameters_and_boundary_conditions: non-periodic dimensions include both bounds, periodic
+    dimensions exclude the upper bound. The states are never stored, they are generated on demand (in chunks with
+    iter_states). It is attribute compatible with the parts of hj.Grid the nodes use outside of the solver
+    (coordinate_vectors, spacings, domain, shape, ndim, interpolate, grad_values, nearest_index).
+
+    Args:
+        lo (array): Lower bound of the state domain.
+        hi (array): Upper bound of the state domain.
+        shape (tuple): Number of grid nodes per dimension.
+        periodic_dims (list, optional): Periodic dimensions.
+    """
+
+    def __init__(self, lo, hi, shape, periodic_dims=()):
+        self.shape = tuple(int(n) for n in shape)
+        self.ndim = len(self.shape)
+        self.domain = Box(lo=np.array(lo, dtype=float), hi=np.array(hi, dtype=float))
+        self.periodic_dims = sorted(int(dim) for dim in periodic_dims)
+        self._is_periodic_dim = np.array([dim in self.periodic_dims for dim in range(self.ndim)])
+        coordinate_vectors, spacings = zip(
+            *(
+                np.linspace(l, h, n, endpoint=not periodic, retstep=True)
+                for l, h, n, periodic in zip(self.domain.lo, self.domain.hi, self.shape, self._is_periodic_dim)
+            )
+        )
+        self.coordinate_vectors = tuple(coordinate_vectors)
+        self.spacings = tuple(float(spacing) for spacing in spacings)
+
+    @classmethod
+    def from_state_domain(cls, state_domain):
+        """
+        Builds the grid from the state_domain section of the env parameters.
+        """
+        return cls(
+            state_domain["lo"], state_domain["hi"], state_domain["resolution"], state_domain.get("periodic_dims", [])
+        )
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def states_at(self, flat_indices):
+        """
+        States (n, ndim) of the grid nodes at the given C-order flat indices.
+        """
+        return grid_states(self, flat_indices)
+
+    def iter_states(self, chunk_size):
+        """
+        Iterates over the grid nodes in C order in chunks of at most chunk_size nodes.
+
+        Yields:
+            tuple: Slice of the chunk in the flattened grid and its states (n, ndim).
+        """
+        for start in range(0, self.size, chunk_size):
+            chunk = slice(start, min(start + chunk_size, self.size))
+            yield chunk, self.states_at(np.arange(chunk.start, chunk.stop))
+
+    @property
+    def states(self):
+        """
+        All states (*shape, ndim), materialized on every access: prefer iter_states.
+        """
+        return self.states_at(np.arange(self.size)).reshape(self.shape + (self.ndim,))
+
+    def interpolate(self, values, state):
+        return interpolate_table(self, values, state)
+
+    def grad_values(self, values):
+        return grad_table(self, values)
+
+    def nearest_index(self, state):
+        index = np.round((np.asarray(state, dtype=float) - self.domain.lo) / np.array(self.spacings)).astype(int)
+        shape = np.array(self.shape)
+        return np.where(self._is_periodic_dim, index % shape, np.clip(index, 0, shape - 1))
+
+    def to_hj_grid(self):
+        """
+        Equivalent hj.Grid, for the solver.
+        """
+        import hj_reachability as hj
+        import jax.numpy as jnp
+
+        bounding_box = hj.sets.Box(lo=jnp.array(self.domain.lo), hi=jnp.array(self.domain.hi))
+        return hj.Grid.from_lattice_parameters_and_boundary_conditions(
+            bounding_box, self.shape, periodic_dims=self.periodic_dims
+        )
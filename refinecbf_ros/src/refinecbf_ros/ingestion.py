@@ -0,0 +1,96 @@
+from threading import Lock
+import rospy
+
+# rospy only drops old messages with queue_size=1 if the receive buffer can hold a full message, value functions and
+# SDFs are flattened grids of several MB
+LARGE_MSG_BUFF_SIZE = 2**27
+DEFAULT_BUFF_SIZE = 65536
+
+
+class LatestValue:
+    """
+    Latest-value cache around a rospy.Subscriber with a queue of size 1.
+    Under load only the newest message is kept, so the reader always gets the most recent value instead of working
+    through a backlog of stale ones.
+
+    Counters:
+    - received: Messages that reached the cache.
+    - coalesced: Messages that were overwritten by a newer one before being read with get().
+    - dropped: Messages dropped by the rospy queue before reaching the cache. Only observable for messages with a
+      std_msgs/Header (from gaps in header.seq), zero otherwise.
+
+    Args:
+        topic (str): Topic to subscribe to.
+        msg_type: ROS message type of the topic.
+        transform (callable, optional): Converts the incoming message to the cached value. Defaults to the message.
+        callback (callable, optional): Called with the cached value after every update, for event driven nodes.
+        large (bool, optional): Whether the messages are large (value functions, SDFs), increases the buffer size.
+    """
+
+    def __init__(self, topic, msg_type, transform=None, callback=None, large=False):
+        self.topic = topic
+        self.transform = transform if transform is not None else (lambda msg: msg)
+        self.callback = callback
+        self.lock = Lock()
+        self.value = None
+        self.stamp = None
+        self.unread = False
+        self.last_seq = None
+        self.received = 0
+        self.coalesced = 0
+        self.dropped = 0
+        buff_size = LARGE_MSG_BUFF_SIZE if large else DEFAULT_BUFF_SIZE
+        self.subscriber = rospy.Subscriber(topic, msg_type, self._callback, queue_size=1, buff_size=buff_size)
+
+    def _callback(self, msg):
+        value = self.transform(msg)
+        with self.lock:
+            header = getattr(msg, "header", None)
+            if header is not None:
+                if self.last_seq is not None and header.seq > self.last_seq + 1:
+                    self.dropped += header.seq - self.last_seq - 1
+                self.last_seq = header.seq
+            if self.unread:
+                self.coalesced += 1
+            self.value = value
+            self.stamp = rospy.get_time()
+            self.unread = True
+            self.received += 1
+        if self.callback is not None:
+            self.callback(value)
+
+    def get(self):
+        """
+        Returns the latest value (None if nothing has been received yet) and marks it as read.
+        """
+        return self.get_stamped()[0]
+
+    def get_stamped(self):
+        """
+        Returns the latest value and the time at which it was received, marks it as read.
+        """
+        with self.lock:
+            self.unread = False
+            return self.value, self.stamp
+
+    def age(self):
+        """
+        Returns the time since the latest value was received, infinite if nothing has been received yet.
+        """
+        stamp = self.stamp
+        return float("inf") if stamp is None else rospy.get_time() - stamp
+
+    def has_value(self):
+        return self.stamp is not None
+
+    def stats(self):
+        return "{}: received {}, coalesced {}, dropped {}".format(
+            self.topic, self.received, self.coalesced, self.dropped
+        )
+
+
+def log_ingestion_stats(caches, period=30.0):
+    """
+    Periodically logs the counters of the latest-value caches of a node.
+    """
+    rospy.loginfo_throttle(period, "Ingestion | " + " | ".join(cache.stats() for cache in caches))
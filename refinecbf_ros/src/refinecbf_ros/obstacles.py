@@ -0,0 +1,157 @@
+import hashlib
+import numpy as np
+from refinecbf_ros.sdf import subspace_axes, box_sdf, occupancy_sdf, resample_map
+
+
+# Obstacle Classes
+class Obstacle:
+    def __init__(self, type, stateIndices, obstacleName, updateRule, padding, updateTime, detectionRadius) -> None:
+        self.type = type
+        self.stateIndices = stateIndices
+        self.obstacleName = obstacleName
+        self.updateRule = updateRule
+        self.padding = padding
+        self.updateTime = updateTime
+        self.detectionRadius = detectionRadius
+
+    def sdf_table(self, grid):
+        """
+        SDF of the obstacle on the subgrid of its stateIndices, broadcastable against grid.shape.
+        """
+        return self.sdf_on_axes(subspace_axes(grid, self.stateIndices))
+
+    def sdf_on_axes(self, axes):
+        raise NotImplementedError("Must be subclassed")
+
+    def geometry(self):
+        raise NotImplementedError("Must be subclassed")
+
+    def cache_key(self):
+        """
+        Hashable key that changes whenever the SDF table of the obstacle changes.
+        """
+        return (self.type, self.obstacleName, tuple(self.stateIndices), float(self.padding)) + self.geometry()
+
+
+class Circle(Obstacle):
+    def __init__(
+        self, stateIndices, obstacleName, radius, center, updateRule="Time", padding=0, updateTime=None, detectionRadius=None
+    ) -> None:
+        super().__init__("Circle", stateIndices, obstacleName,
+                         updateRule, padding, updateTime, detectionRadius)
+        self.radius = radius
+        self.center = np.reshape(np.array(center), (-1, 1))
+
+    def geometry(self):
+        return (float(self.radius), tuple(np.reshape(np.array(self.center), -1).tolist()))
+
+    def sdf_on_axes(self, axes):
+        center = np.reshape(np.array(self.center), -1)
+        return np.sqrt(sum((axis - c) ** 2 for axis, c in zip(axes, center))) - self.radius - self.padding
+
+    def distance_to_obstacle(self, state):
+        point = state[self.stateIndices].reshape(-1)
+        distance = np.linalg.norm(self.center.reshape(-1) - point) - \
+            self.radius - self.padding
+        return distance
+
+
+class Rectangle(Obstacle):
+    def __init__(
+        self, stateIndices, obstacleName, minVal, maxVal, updateRule="Time", padding=0, updateTime=None, detectionRadius=None
+    ) -> None:
+        super().__init__("Rectangle", stateIndices, obstacleName,
+                         updateRule, padding, updateTime, detectionRadius)
+        self.minVal = np.reshape(np.array(minVal), (-1, 1))
+        self.maxVal = np.reshape(np.array(maxVal), (-1, 1))
+
+    def geometry(self):
+        return (tuple(np.reshape(np.array(self.minVal), -1).tolist()), tuple(np.reshape(np.array(self.maxVal), -1).tolist()))
+
+    def sdf_on_axes(self, axes):
+        return box_sdf(axes, np.array(self.minVal), np.array(self.maxVal)) - self.padding
+
+    def distance_to_obstacle(self, state):
+        point = state[self.stateIndices].reshape(-1)
+        minVal = self.minVal.reshape(-1)
+        maxVal = self.maxVal.reshape(-1)
+        max_dist_per_dim = np.max(np.array([minVal - point, point - maxVal]), axis=0)
+        raw_distance = np.where(np.all(max_dist_per_dim < 0.0), 
+                                np.max(max_dist_per_dim), 
+                                np.linalg.norm(np.maximum(0, max_dist_per_dim)))
+        return raw_distance - self.padding
+
+
+class Boundary(Obstacle):
+    def __init__(self, stateIndices, minVal, maxVal, padding=0) -> None:
+        super().__init__("Boundary", stateIndices, None, None,
+                         padding, updateTime=None, detectionRadius=None)
+        self.minVal = np.reshape(np.array(minVal), (-1, 1))
+        self.maxVal = np.reshape(np.array(maxVal), (-1, 1))
+
+    def sdf_on_axes(self, axes):
+        return -box_sdf(axes, np.array(self.minVal), np.array(self.maxVal)) - self.padding
+
+
+class OccupancyGridObstacle(Obstacle):
+    """
+    Obstacle given by a 2D occupancy map over stateIndices (x, y), e.g. a map image or a nav_msgs/OccupancyGrid.
+    The signed distance is computed once on the map with a Euclidean distance transform and resampled onto the grid.
+
+    Args:
+        occupancy (np.ndarray): Boolean map indexed [row = y, column = x], True for occupied cells.
+        resolution (float): Size of a map cell.
+        origin (list): Position (x, y) of the center of cell [0, 0].
+    """
+
+    def __init__(
+        self, stateIndices, obstacleName, occupancy, resolution, origin, updateRule="Time", padding=0, updateTime=None,
+        detectionRadius=None
+    ) -> None:
+        super().__init__("OccupancyGrid", stateIndices, obstacleName,
+                         updateRule, padding, updateTime, detectionRadius)
+        assert len(stateIndices) == 2, "Occupancy grid obstacles are defined on 2 state dimensions"
+        self.occupancy = np.asarray(occupancy, dtype=bool)
+        self.resolution = float(resolution)
+        self.origin = np.reshape(np.array(origin, dtype=float), -1)[:2]
+        self.map_sdf = occupancy_sdf(self.occupancy, self.resolution)
+        self.map_hash = hashlib.sha1(np.packbits(self.occupancy).tobytes()).hexdigest()
+
+    @classmethod
+    def from_image(cls, stateIndices, obstacleName, image, resolution, origin, occupied_thresh=0.65, negate=False,
+                   **kwargs):
+        """
+        Loads a map image following the map_server convention: dark pixels are occupied, the top row is the
+        largest y.
+        """
+        from matplotlib.image import imread
+
+        pixels = np.asarray(imread(image), dtype=float)
+        if pixels.ndim == 3:
+            pixels = pixels[..., :3].mean(axis=-1)
+        if pixels.max() > 1.0:
+            pixels = pixels / 255.0
+        occupancy_probability = pixels if negate else 1.0 - pixels
+        occupancy = np.flipud(occupancy_probability > occupied_thresh)
+        return cls(stateIndices, obstacleName, occupancy, resolution, origin, **kwargs)
+
+    @classmethod
+    def from_msg(cls, stateIndices, obstacleName, msg, occupied_thresh=65, unknown_is_occupied=True, **kwargs):
+        """
+        Builds the obstacle from a nav_msgs/OccupancyGrid (row-major from the origin, -1 for unknown cells).
+        """
+        data = np.array(msg.data, dtype=np.int16).reshape(msg.info.height, msg.info.width)
+        occupancy = (data >= occupied_thresh) | ((data < 0) & unknown_is_occupied)
+        resolution = msg.info.resolution
+        origin = [msg.info.origin.position.x + resolution / 2, msg.info.origin.position.y + resolution / 2]
+        return cls(stateIndices, obstacleName, occupancy, resolution, origin, **kwargs)
+
+    def geometry(self):
+        return (self.resolution, tuple(self.origin.tolist()), self.occupancy.shape, self.map_hash)
+
+    def sdf_on_axes(self, axes):
+        return resample_map(self.map_sdf, self.resolution, self.origin, axes) - self.padding
+
+    def distance_to_obstacle(self, state):
+        point = np.reshape(state[self.stateIndices], (2, 1))
+        return float(self.sdf_on_axes(list(point))[0])
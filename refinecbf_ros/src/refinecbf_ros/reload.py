@@ -0,0 +1,57 @@
+import yaml
+
+# Sections the grid, the dynamics and every compiled function depend on, changing them requires a relaunch
+RELAUNCH_SECTIONS = ["dynamics_class", "state_domain", "safety_states", "safety_controls"]
+# Parameters set at runtime in the /env namespace, not part of the environment description
+RUNTIME_PARAMS = ["experiment_start_time"]
+
+
+def load_env(env_file=None, ctr_file=None, bundle=None):
+    """
+    Loads an environment description from an env (and optional control) YAML or from an environment bundle.
+
+    Returns:
+        tuple: The env parameters and the control parameters (None if not given).
+    """
+    if bundle:
+        from refinecbf_ros.bundle import EnvironmentBundle
+
+        bundle = EnvironmentBundle(bundle)
+        return bundle.env, bundle.section("ctr")
+    with open(env_file) as f:
+        env = yaml.safe_load(f)
+    ctr = None
+    if ctr_file:
+        with open(ctr_file) as f:
+            ctr = yaml.safe_load(f)
+    return env, ctr
+
+
+def diff_env(old_env, new_env):
+    """
+    Top level sections of the env parameters that differ between old_env and new_env (runtime parameters ignored).
+
+    Returns:
+        list: Names of the changed sections, sorted.
+    """
+    keys = (set(old_env) | set(new_env)) - set(RUNTIME_PARAMS)
+    return sorted(key for key in keys if old_env.get(key) != new_env.get(key))
+
+
+def diff_obstacles(old_obstacles, new_obstacles):
+    """
+    Diffs two lists of obstacles by name, an obstacle changed if its SDF table (cache_key) or how it is activated did.
+
+    Returns:
+        tuple: Names of the added, removed and changed obstacles.
+    """
+    old = {obstacle.obstacleName: obstacle for obstacle in old_obstacles}
+    new = {obstacle.obstacleName: obstacle for obstacle in new_obstacles}
+    added = [name for name in new if name not in old]
+    removed = [name for name in old if name not in new]
+    changed = [name for name in new if name in old and _obstacle_spec(new[name]) != _obstacle_spec(old[name])]
+    return added, removed, changed
+
+
+def _obstacle_spec(obstacle):
+    return obstacle.cache_key() + (obstacle.updateRule, obstacle.updateTime, obstacle.detectionRadius)
@@ -0,0 +1,118 @@
+import numpy as np
+from refinecbf_ros.sdf import truncated_sdf
+
+
+def laser_scan_points(msg):
+    """
+    Hits of a sensor_msgs/LaserScan as points (n, 2) in the sensor frame, returns outside of the valid range dropped.
+    """
+    ranges = np.array(msg.ranges, dtype=float)
+    angles = msg.angle_min + msg.angle_increment * np.arange(len(ranges))
+    valid = np.isfinite(ranges) & (ranges > msg.range_min) & (ranges < msg.range_max)
+    return np.stack([ranges[valid] * np.cos(angles[valid]), ranges[valid] * np.sin(angles[valid])], axis=-1)
+
+
+def point_cloud_points(msg, z_range=(-np.inf, np.inf)):
+    """
+    Points of a sensor_msgs/PointCloud2 projected to (n, 2) in the sensor frame, keeping points with z in z_range.
+    """
+    from sensor_msgs import point_cloud2
+
+    points = np.array(list(point_cloud2.read_points(msg, field_names=("x", "y", "z"), skip_nans=True)), dtype=float)
+    if points.size == 0:
+        return np.zeros((0, 2))
+    points = points[(points[:, 2] >= z_range[0]) & (points[:, 2] <= z_range[1])]
+    return points[:, :2]
+
+
+def transform_points(points, pose, sensor_offset=(0.0, 0.0)):
+    """
+    Transforms sensor frame points (n, 2) to the world frame given the robot pose (x, y, yaw).
+    """
+    x, y, yaw = pose
+    c, s = np.cos(yaw), np.sin(yaw)
+    points = points + np.array(sensor_offset)
+    return np.stack([x + c * points[:, 0] - s * points[:, 1], y + s * points[:, 0] + c * points[:, 1]], axis=-1)
+
+
+class RollingOccupancy:
+    """
+    Decaying occupancy buffer of sensed hits on a 2D subspace (indexed [row = y, column = x]) and its truncated SDF.
+    Hits set the confidence of a cell to 1, confidences decay with time constant decay_time and a cell is occupied
+    while its confidence is above threshold. The SDF is only recomputed in tiles within the truncation distance of a
+    cell whose occupancy changed, each tile from a distance transform over the tile and a halo of truncation width.
+
+    Args:
+        lo (array): Lower (x, y) corner of the buffer.
+        hi (array): Upper (x, y) corner of the buffer.
+        resolution (float): Size of a buffer cell.
+        truncation (float): Distances are clipped to [-truncation, truncation].
+        decay_time (float): Time constant of the confidence decay in seconds.
+        threshold (float, optional): Confidence above which a cell is occupied.
+        tile_size (int, optional): Size of the tiles (in cells) the SDF is recomputed in.
+    """
+
+    def __init__(self, lo, hi, resolution, truncation, decay_time, threshold=0.5, tile_size=32):
+        self.lo = np.array(lo, dtype=float)
+        self.resolution = float(resolution)
+        self.truncation = float(truncation)
+        self.decay_time = float(decay_time)
+        self.threshold = threshold
+        self.tile_size = int(tile_size)
+        self.shape = tuple((np.ceil((np.array(hi) - self.lo) / self.resolution).astype(int) + 1)[::-1])
+        self.confidence = np.zeros(self.shape, dtype=np.float32)
+        self.occupied = np.zeros(self.shape, dtype=bool)
+        self.sdf = np.full(self.shape, self.truncation)
+        self.halo = int(np.ceil(self.truncation / self.resolution)) + 1
+        self.n_tiles = tuple(int(np.ceil(n / self.tile_size)) for n in self.shape)
+        self.dirty_tiles = np.zeros(self.n_tiles, dtype=bool)
+        self.revision = 0
+
+    def integrate(self, points):
+        """
+        Rasterizes world frame hits (n, 2) into the buffer, hits outside of the buffer are ignored.
+        """
+        cells = np.round((np.asarray(points) - self.lo) / self.resolution).astype(int)
+        inside = np.all((cells >= 0) & (cells < np.array(self.shape[::-1])), axis=-1)
+        cols, rows = cells[inside, 0], cells[inside, 1]
+        self.confidence[rows, cols] = 1.0
+        self._mark_changes()
+
+    def decay(self, dt):
+        self.confidence *= np.float32(np.exp(-dt / self.decay_time))
+        self._mark_changes()
+
+    def _mark_changes(self):
+        occupied = self.confidence > self.threshold
+        changed = occupied != self.occupied
+        if changed.any():
+            self.occupied = occupied
+            rows, cols = np.nonzero(changed)
+            self.dirty_tiles[rows // self.tile_size, cols // self.tile_size] = True
+
+    def is_dirty(self):
+        return bool(self.dirty_tiles.any())
+
+    def update_sdf(self):
+        """
+        Recomputes the SDF in the dirty tiles and the tiles within the truncation distance of them.
+
+        Returns:
+            int: Number of recomputed tiles.
+        """
+        if not self.is_dirty():
+            return 0
+        reach = int(np.ceil(self.halo / self.tile_size))
+        dirty = np.zeros_like(self.dirty_tiles)
+        for tile_row, tile_col in zip(*np.nonzero(self.dirty_tiles)):
+            dirty[max(tile_row - reach, 0) : tile_row + reach + 1, max(tile_col - reach, 0) : tile_col + reach + 1] = True
+        for tile_row, tile_col in zip(*np.nonzero(dirty)):
+            r0, c0 = tile_row * self.tile_size, tile_col * self.tile_size
+            r1, c1 = min(r0 + self.tile_size, self.shape[0]), min(c0 + self.tile_size, self.shape[1])
+            hr0, hc0 = max(r0 - self.halo, 0), max(c0 - self.halo, 0)
+            hr1, hc1 = min(r1 + self.halo, self.shape[0]), min(c1 + self.halo, self.shape[1])
+            region = truncated_sdf(self.occupied[hr0:hr1, hc0:hc1], self.resolution, self.truncation)
+            self.sdf[r0:r1, c0:c1] = region[r0 - hr0 : r1 - hr0, c0 - hc0 : c1 - hc0]
+        self.dirty_tiles[:] = False
+        self.revision += 1
+        return int(dirty.sum())
@@ -0,0 +1,233 @@
+import numpy as np
+from collections import OrderedDict
+
+
+def subspace_axes(grid, state_indices):
+    """
+    Coordinate vectors of the grid dimensions in state_indices, each reshaped so that it broadcasts against the full
+    grid. Functions evaluated on these axes only materialize the subgrid of state_indices (singleton elsewhere).
+
+    Args:
+        grid (GridSpec or hj.Grid): Grid on which the SDF is defined.
+        state_indices (list): Grid dimensions the function depends on.
+
+    Returns:
+        list: One array per index of shape (1, ..., grid.shape[i], ..., 1).
+    """
+    axes = []
+    for i in state_indices:
+        shape = [1] * grid.ndim
+        shape[i] = grid.shape[i]
+        axes.append(np.reshape(np.asarray(grid.coordinate_vectors[i]), shape))
+    return axes
+
+
+def box_distances(axes, min_val, max_val):
+    """
+    Per dimension signed distances to the faces of the box [min_val, max_val], negative inside the box.
+    """
+    return [
+        np.maximum(lo - axis, axis - hi)
+        for axis, lo, hi in zip(axes, np.reshape(min_val, -1), np.reshape(max_val, -1))
+    ]
+
+
+def box_sdf(axes, min_val, max_val):
+    """
+    Signed distance to the box [min_val, max_val] (negative inside), evaluated with broadcasting on axes.
+    """
+    dists = box_distances(axes, min_val, max_val)
+    outside = np.sqrt(sum(np.maximum(dist, 0.0) ** 2 for dist in dists))
+    inside = dists[0]
+    for dist in dists[1:]:
+        inside = np.maximum(inside, dist)
+    return np.where(inside < 0.0, inside, outside)
+
+
+def compose_sdf(grid, boundary, obstacles):
+    """
+    Builds the SDF of the environment on the full grid: the boundary SDF and the minimum with every obstacle SDF.
+    Each primitive is evaluated on the subgrid of its stateIndices and combined by broadcasting.
+
+    Returns:
+        np.ndarray: SDF of shape grid.shape.
+    """
+    sdf = boundary.sdf_table(grid)
+    for obstacle in obstacles:
+        sdf = np.minimum(sdf, obstacle.sdf_table(grid))
+    return np.array(np.broadcast_to(sdf, grid.shape))
+
+
+def occupancy_sdf(occupancy, resolution):
+    """
+    Exact Euclidean signed distance of a 2D occupancy map (positive in free space, negative inside obstacles).
+    The distance transform measures between cell centers, the obstacle surface lies half a cell before them.
+    A map without free (occupied) cells is at minus (plus) the map diagonal everywhere, so that it stays finite.
+
+    Args:
+        occupancy (np.ndarray): Boolean map, True for occupied cells.
+        resolution (float): Size of a map cell.
+
+    Returns:
+        np.ndarray: Signed distance per map cell, same shape as occupancy.
+    """
+    from scipy.ndimage import distance_transform_edt  # Only required for occupancy grid obstacles
+
+    occupancy = np.asarray(occupancy, dtype=bool)
+    diagonal = resolution * float(np.hypot(*occupancy.shape))
+    if not occupancy.any():
+        return np.full(occupancy.shape, diagonal)
+    if occupancy.all():
+        return np.full(occupancy.shape, -diagonal)
+    outside = distance_transform_edt(~occupancy, sampling=resolution)
+    inside = distance_transform_edt(occupancy, sampling=resolution)
+    return np.where(occupancy, resolution / 2 - inside, outside - resolution / 2)
+
+
+def truncated_sdf(occupancy, resolution, truncation):
+    """
+    Signed distance of a 2D occupancy map clipped to [-truncation, truncation], also defined for maps that are
+    entirely free or entirely occupied.
+    """
+    occupancy = np.asarray(occupancy, dtype=bool)
+    if not occupancy.any():
+        return np.full(occupancy.shape, truncation, dtype=float)
+    if occupancy.all():
+        return np.full(occupancy.shape, -truncation, dtype=float)
+    return np.clip(occupancy_sdf(occupancy, resolution), -truncation, truncation)
+
+
+def resample_map(values, resolution, origin, axes):
+    """
+    Bilinear resampling of a 2D map (indexed [row = y, column = x]) onto broadcastable axes (x, y).
+    States outside of the map take the value of the closest map cell.
+    """
+    from scipy.ndimage import map_coordinates
+
+    x, y = np.broadcast_arrays(*axes)
+    rows = (y - origin[1]) / resolution
+    cols = (x - origin[0]) / resolution
+    coordinates = np.stack([rows.reshape(-1), cols.reshape(-1)])
+    return map_coordinates(values, coordinates, order=1, mode="nearest").reshape(x.shape)
+
+
+class SDFTableCache:
+    """
+    Least recently used cache of per-obstacle SDF tables (on the subgrid of each obstacle's stateIndices).
+    Tables are keyed by the obstacle geometry, so they survive deactivation / reactivation of the obstacle, and the
+    least recently used tables are evicted once the cached tables exceed budget_bytes.
+    """
+
+    def __init__(self, grid, budget_bytes):
+        self.grid = grid
+        self.budget_bytes = budget_bytes
+        self.tables = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, obstacle):
+        key = obstacle.cache_key()
+        if key in self.tables:
+            self.hits += 1
+            self.tables.move_to_end(key)
+            return self.tables[key]
+        self.misses += 1
+        table = obstacle.sdf_table(self.grid)
+        self.tables[key] = table
+        self.nbytes += table.nbytes
+        while self.nbytes > self.budget_bytes and len(self.tables) > 1:
+            _, evicted = self.tables.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return table
+
+
+def mask_region(mask):
+    """
+    Bounding box of the True cells of mask as (lo, hi) index arrays (hi exclusive), None if there are none.
+    """
+    if not mask.any():
+        return None
+    lo, hi = [], []
+    for dim in range(mask.ndim):
+        indices = np.nonzero(mask.any(axis=tuple(d for d in range(mask.ndim) if d != dim)))[0]
+        lo.append(indices[0])
+        hi.append(indices[-1] + 1)
+    return np.array(lo), np.array(hi)
+
+
+def union_region(region_a, region_b):
+    """
+    Bounding box of two regions (None is the empty region).
+    """
+    if region_a is None:
+        return region_b
+    if region_b is None:
+        return region_a
+    return np.minimum(region_a[0], region_b[0]), np.maximum(region_a[1], region_b[1])
+
+
+def region_slices(region, shape):
+    """
+    Slices selecting region in an array of shape, dimensions of size 1 (broadcast tables) are selected entirely.
+    """
+    lo, hi = region
+    return tuple(slice(None) if n == 1 else slice(l, h) for l, h, n in zip(lo, hi, shape))
+
+
+class IncrementalSDF:
+    """
+    Running SDF of the environment: the boundary SDF composed with the SDF tables of the active obstacles.
+    Adding an obstacle is a single elementwise minimum. Removing, moving or changing an obstacle only recomposes the
+    bounding box of the old and new footprints (the cells where the old table attained the minimum or the new table
+    is below it) from the cached tables.
+    Every modification returns the region of the grid in which the SDF changed, None if it did not change.
+    """
+
+    def __init__(self, grid, boundary, cache, obstacles=(), initial_sdf=None):
+        self.grid = grid
+        self.cache = cache
+        self.boundary_table = boundary.sdf_table(grid)
+        self.obstacles = OrderedDict()
+        for obstacle in obstacles:
+            self.obstacles[obstacle.obstacleName] = obstacle
+        if initial_sdf is not None:  # Precompiled SDF of exactly these obstacles
+            self.sdf = np.array(initial_sdf, dtype=self.boundary_table.dtype).reshape(self.grid.shape)
+        else:
+            self.recompose()
+
+    def recompose(self):
+        self.sdf = np.array(np.broadcast_to(self.boundary_table, self.grid.shape))
+        for obstacle in self.obstacles.values():
+            np.minimum(self.sdf, self.cache.get(obstacle), out=self.sdf)
+        return self.sdf
+
+    def recompose_region(self, region):
+        if region is None:
+            return
+        view = self.sdf[region_slices(region, self.sdf.shape)]
+        view[...] = self.boundary_table[region_slices(region, self.boundary_table.shape)]
+        for obstacle in self.obstacles.values():
+            table = self.cache.get(obstacle)
+            np.minimum(view, table[region_slices(region, table.shape)], out=view)
+
+    def add(self, obstacle):
+        self.obstacles[obstacle.obstacleName] = obstacle
+        table = self.cache.get(obstacle)
+        region = mask_region(table < self.sdf)
+        np.minimum(self.sdf, table, out=self.sdf)
+        return region
+
+    def remove(self, obstacle_name):
+        old_table = self.cache.get(self.obstacles.pop(obstacle_name))
+        region = mask_region(old_table <= self.sdf)
+        self.recompose_region(region)
+        return region
+
+    def replace(self, obstacle):
+        old_table = self.cache.get(self.obstacles[obstacle.obstacleName])
+        new_table = self.cache.get(obstacle)
+        self.obstacles[obstacle.obstacleName] = obstacle
+        region = union_region(mask_region(old_table <= self.sdf), mask_region(new_table < self.sdf))
+        self.recompose_region(region)
+        return region
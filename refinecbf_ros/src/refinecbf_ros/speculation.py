@@ -0,0 +1,62 @@
+from collections import OrderedDict
+import numpy as np
+
+
+def rank_candidates(obstacles, state, active_names, max_candidates):
+    """
+    Ranks the not yet active Detection obstacles by how close the robot is to detecting them, i.e. by the distance
+    from the state to the obstacle minus its detectionRadius (negative once within detection range).
+
+    Returns:
+        list: Up to max_candidates obstacles, most likely next activation first.
+    """
+    candidates = [obstacle for obstacle in obstacles if obstacle.obstacleName not in active_names]
+    margins = [obstacle.distance_to_obstacle(state) - obstacle.detectionRadius for obstacle in candidates]
+    order = np.argsort(margins, kind="stable")[:max_candidates]
+    return [candidates[i] for i in order]
+
+
+class SpeculativeVFCache:
+    """
+    Least recently used cache of speculatively solved value functions, keyed by the frozenset of active obstacle
+    names they were solved for, evicting the least recently used entries once they exceed budget_bytes.
+    """
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.values = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key):
+        if key not in self.values:
+            return None
+        self.hits += 1
+        self.values.move_to_end(key)
+        return self.values[key]
+
+    def put(self, key, values):
+        if key in self.values:
+            self.nbytes -= self.values.pop(key).nbytes
+        self.values[key] = values
+        self.nbytes += values.nbytes
+        while self.nbytes > self.budget_bytes and len(self.values) > 1:
+            _, evicted = self.values.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        self.values.clear()
+        self.nbytes = 0
+
+    def discard_stale(self, active_names):
+        """
+        Drops entries that can not become the active set anymore (obstacles are never deactivated by detection, so
+        any entry missing a currently active obstacle is unreachable).
+        """
+        for key in [key for key in self.values if not active_names <= key]:
+            self.nbytes -= self.values.pop(key).nbytes
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+import numpy as np
+
+
+def safest_control_table(dynamics, grid, values, control_lo, control_hi, chunk_size=None):
+    """
+    Tabulates the control that maximizes Lg V(x) . u over the control box [control_lo, control_hi] at every grid node.
+    Evaluated in NumPy in chunks of grid nodes (see evaluate_grid), with the batched control matrix of the dynamics.
+
+    Args:
+        dynamics (ControlAffineDynamics): Dynamics providing the control matrix g(x).
+        grid (GridSpec or hj.Grid): Grid on which values is defined.
+        values (np.ndarray): Value function table of shape grid.shape.
+        control_lo (array): Lower bound of the control space.
+        control_hi (array): Upper bound of the control space.
+        chunk_size (int, optional): Number of nodes evaluated at once.
+
+    Returns:
+        np.ndarray: Table of shape grid.shape + (control_dims,).
+    """
+    from refinecbf_ros.grid import evaluate_grid, DEFAULT_CHUNK_SIZE
+
+    control_lo = np.asarray(control_lo, dtype=float)
+    control_hi = np.asarray(control_hi, dtype=float)
+    grad_values = grad_table(grid, values).reshape(-1, grid.ndim)
+    lo = np.array([coordinate_vector[0] for coordinate_vector in grid.coordinate_vectors])
+    spacings = np.array(grid.spacings)
+
+    def safest_control(states):
+        # The states are grid nodes, their flat index gives their gradient
+        index = np.rint((states - lo) / spacings).astype(int)
+        flat_index = np.ravel_multi_index(tuple(np.moveaxis(index, -1, 0)), tuple(grid.shape), mode="wrap")
+        lg_v = np.einsum("ni,nij->nj", grad_values[flat_index], np.asarray(dynamics.control_matrix(states, 0.0)))
+        return np.where(lg_v >= 0.0, control_hi, control_lo)
+
+    return evaluate_grid(grid, safest_control, DEFAULT_CHUNK_SIZE if chunk_size is None else chunk_size)
+
+
+def interpolate_table(grid, table, states):
+    """
+    Multilinear interpolation of a (possibly vector valued) grid table in NumPy, without dispatching to JAX.
+    States outside of the grid are projected onto it for non-periodic dimensions.
+
+    Args:
+        grid (GridSpec or hj.Grid): Grid on which table is defined.
+        table (np.ndarray): Table of shape grid.shape + trailing dimensions.
+        states (np.ndarray): Single state (ndim,) or batch of states (..., ndim).
+
+    Returns:
+        np.ndarray: Interpolated values of shape states.shape[:-1] + table.shape[grid.ndim:].
+    """
+    states = np.asarray(states, dtype=float)
+    shape = np.array(grid.shape)
+    lo = np.array([coordinate_vector[0] for coordinate_vector in grid.coordinate_vectors])
+    periodic = np.array(grid._is_periodic_dim)
+
+    position = (states - lo) / np.array(grid.spacings)
+    position = np.where(periodic, position, np.clip(position, 0, shape - 1))
+    index_lo = np.floor(position).astype(int)
+    index_lo = np.where(periodic, index_lo, np.minimum(index_lo, shape - 2))
+    weight_hi = position - index_lo
+    index_hi = np.where(periodic, (index_lo + 1) % shape, index_lo + 1)
+    index_lo = np.where(periodic, index_lo % shape, index_lo)
+
+    result = 0.0
+    for corner in np.ndindex(*(2,) * grid.ndim):
+        corner = np.array(corner, dtype=bool)
+        index = np.where(corner, index_hi, index_lo)
+        weight = np.prod(np.where(corner, weight_hi, 1.0 - weight_hi), axis=-1)
+        corner_values = table[tuple(np.moveaxis(index, -1, 0))]
+        result = result + weight[(...,) + (np.newaxis,) * (corner_values.ndim - weight.ndim)] * corner_values
+    return result
+
+
+def grad_table(grid, values):
+    """
+    Central difference gradient of a grid table in NumPy (one-sided at non-periodic boundaries).
+
+    Args:
+        grid (GridSpec or hj.Grid): Grid on which values is defined.
+        values (np.ndarray): Table of shape grid.shape.
+
+    Returns:
+        np.ndarray: Gradient table of shape grid.shape + (grid.ndim,).
+    """
+    values = np.asarray(values)
+    grads = []
+    for dim, (spacing, periodic) in enumerate(zip(grid.spacings, grid._is_periodic_dim)):
+        if periodic:
+            grad = (np.roll(values, -1, axis=dim) - np.roll(values, 1, axis=dim)) / (2 * spacing)
+        else:
+            grad = np.gradient(values, spacing, axis=dim)
+        grads.append(grad)
+    return np.stack(grads, axis=-1)
+
+
+def lipschitz_bound(grad_values):
+    """
+    Grid estimate of the Lipschitz constant of a table, i.e. the maximum of |grad V| over its gradient table.
+    """
+    return float(np.max(np.linalg.norm(grad_values, axis=-1)))
+
+
+class GradientTableCache:
+    """
+    Least recently used cache of the gradient tables of the slices of a stack of value functions (e.g. a time-varying
+    VF of shape (n_slices, *grid.shape)), computed on first use and evicted once the cached tables exceed
+    budget_bytes.
+    """
+
+    def __init__(self, grid, values, budget_bytes):
+        self.grid = grid
+        self.values = values
+        self.budget_bytes = budget_bytes
+        self.tables = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, index):
+        index = int(index)
+        if index in self.tables:
+            self.hits += 1
+            self.tables.move_to_end(index)
+            return self.tables[index]
+        self.misses += 1
+        table = grad_table(self.grid, self.values[index])
+        self.tables[index] = table
+        self.nbytes += table.nbytes
+        while self.nbytes > self.budget_bytes and len(self.tables) > 1:
+            _, evicted = self.tables.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return table
+
+    def precompute(self):
+        """
+        Computes the gradient tables of all slices, as far as they fit in the budget.
+        """
+        for index in range(len(self.values)):
+            if self.nbytes + self.grid_table_nbytes() > self.budget_bytes:
+                break
+            self.get(index)
+
+    def grid_table_nbytes(self):
+        return int(np.prod(self.grid.shape)) * self.grid.ndim * self.values.dtype.itemsize
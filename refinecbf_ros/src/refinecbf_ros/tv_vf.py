@@ -0,0 +1,74 @@
+import numpy as np
+import hj_reachability as hj
+import jax.numpy as jnp
+
+
+def scheduled_sdfs(grid, base_sdf, update_obstacles, sdf_tables):
+    """
+    SDFs of the environment over the schedule of Update obstacles.
+
+    Args:
+        grid (hj.Grid): Grid on which the SDFs are defined.
+        base_sdf (np.ndarray): SDF before any Update obstacle appeared.
+        update_obstacles (list): Update obstacles with their updateTime.
+        sdf_tables (SDFTableCache): Cache of per-obstacle SDF tables.
+
+    Returns:
+        tuple: Sorted appearance times (K,) and the SDFs (K + 1, *grid.shape), entry k holding the first k obstacles.
+    """
+    obstacles = sorted(update_obstacles, key=lambda obstacle: obstacle.updateTime)
+    sdfs = [np.array(np.broadcast_to(base_sdf, grid.shape))]
+    for obstacle in obstacles:
+        sdfs.append(np.minimum(sdfs[-1], sdf_tables.get(obstacle)))
+    return np.array([obstacle.updateTime for obstacle in obstacles], dtype=float), np.stack(sdfs)
+
+
+def solve_tv_vf(accuracy, hj_dynamics, grid, initial_values, appear_times, sdfs, dt, terminal_horizon):
+    """
+    Time-varying value function over the schedule of obstacle appearances.
+    The final environment (all obstacles) is solved for terminal_horizon seconds from initial_values, then the
+    solution is propagated backward from the last appearance time to 0 with the time-dependent obstacle constraint
+    min(V, sdf(t)), so that V(t, .) anticipates every obstacle appearing after t.
+
+    Args:
+        accuracy (str): hj_reachability solver accuracy.
+        hj_dynamics (HJControlAffineDynamics): Dynamics of the reachability problem.
+        grid (hj.Grid): Grid of the value function.
+        initial_values (np.ndarray): Initial guess of the value function of the final environment.
+        appear_times (np.ndarray): Sorted appearance times (K,) from scheduled_sdfs.
+        sdfs (np.ndarray): SDFs (K + 1, *grid.shape) from scheduled_sdfs.
+        dt (float): Time step between the stored value functions.
+        terminal_horizon (float): Horizon of the solve of the final environment.
+
+    Returns:
+        tuple: Ascending times (T,) and value functions (T, *grid.shape).
+    """
+    appear_times_jnp = jnp.array(appear_times)
+    sdfs_jnp = jnp.array(sdfs)
+    final_settings = hj.SolverSettings.with_accuracy(
+        accuracy, value_postprocessor=lambda t, x: jnp.minimum(x, sdfs_jnp[-1])
+    )
+    terminal_values = hj.step(
+        final_settings, hj_dynamics, grid, 0.0, jnp.minimum(initial_values, sdfs_jnp[-1]), -terminal_horizon,
+        progress_bar=False,
+    )
+    if len(appear_times) == 0:
+        return np.array([0.0]), np.array(terminal_values)[None]
+
+    def scheduled_obstacles(t, x):
+        # Solver time is experiment time, obstacles with updateTime <= t are present
+        return jnp.minimum(x, sdfs_jnp[jnp.searchsorted(appear_times_jnp, t, side="right")])
+
+    t_end = float(appear_times[-1])
+    times = np.linspace(t_end, 0.0, max(int(np.ceil(t_end / dt)), 1) + 1)
+    solver_settings = hj.SolverSettings.with_accuracy(accuracy, value_postprocessor=scheduled_obstacles)
+    values = hj.solve(solver_settings, hj_dynamics, grid, times, terminal_values, progress_bar=False)
+    return times[::-1].copy(), np.array(values)[::-1].copy()
+
+
+def tv_index(times, t):
+    """
+    Index of the stored value function to use at experiment time t: the first stored time at or after t, which is
+    the more conservative of the two neighbors (values only decrease towards an obstacle appearance).
+    """
+    return int(np.clip(np.searchsorted(times, t, side="left"), 0, len(times) - 1))
@@ -0,0 +1,59 @@
+import time
+from threading import Condition
+import rospy
+from refinecbf_ros.msg import EnvironmentAck
+
+
+def next_env_version(last_version):
+    """
+    Next environment version: strictly increasing for a publisher and, being based on the wall clock in ns, ordered
+    across the publishers of environment changes (obstacle node, modify environment server).
+    """
+    return max(last_version + 1, time.time_ns())
+
+
+class EnvironmentAckWaiter:
+    """
+    Waits for the safety filter to acknowledge an environment version, i.e. to enforce a value function that
+    incorporates it. Versions are monotonic, so any acknowledgment of a later version also covers earlier ones.
+
+    Args:
+        topic (str): Topic on which the safety filter publishes EnvironmentAck messages.
+    """
+
+    def __init__(self, topic):
+        self.condition = Condition()
+        self.latest_ack = None
+        self.subscriber = rospy.Subscriber(topic, EnvironmentAck, self._callback, queue_size=10)
+
+    def _callback(self, msg):
+        with self.condition:
+            if self.latest_ack is None or msg.env_version > self.latest_ack.env_version:
+                self.latest_ack = msg
+                self.condition.notify_all()
+
+    def wait(self, env_version, timeout):
+        """
+        Blocks until env_version is acknowledged or timeout (seconds) has passed.
+
+        Returns:
+            EnvironmentAck: The acknowledgment covering env_version, None on timeout.
+        """
+        acknowledged = lambda: self.latest_ack is not None and self.latest_ack.env_version >= env_version
+        with self.condition:
+            if self.condition.wait_for(acknowledged, timeout):
+                return self.latest_ack
+            return None
+
+    def fill_response(self, response, timeout):
+        """
+        Waits for the version of a service response and fills in whether it was acknowledged and the propagation
+        latencies (from the publication of the change) to the HJ node, to the published VF and to the safety filter.
+        """
+        ack = self.wait(response.env_version, timeout)
+        response.acknowledged = ack is not None
+        if ack is not None:
+            response.hj_latency = ack.hj_received_stamp - ack.env_stamp
+            response.vf_latency = ack.vf_stamp - ack.env_stamp
+            response.filter_latency = ack.filter_stamp - ack.env_stamp
+        return response
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Run against the package sources (catkin devel spaces put them on the path already)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
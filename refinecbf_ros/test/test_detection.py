@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from refinecbf_ros.obstacles import Circle, Rectangle
+from refinecbf_ros.detection import DetectionIndex
+
+
+def random_obstacles(rng, n):
+    obstacles = []
+    for i in range(n):
+        state_indices = [[0, 1], [0, 2]][i % 2]
+        if i % 3 == 0:
+            lo = rng.uniform(-5, 4, 2)
+            obstacles.append(Rectangle(state_indices, "rectangle_{}".format(i), minVal=lo,
+                                       maxVal=lo + rng.uniform(0.1, 1, 2), updateRule="Detection", padding=0.1,
+                                       detectionRadius=rng.uniform(0.2, 1.5)))
+        else:
+            obstacles.append(Circle(state_indices, "circle_{}".format(i), radius=rng.uniform(0.1, 0.5),
+                                    center=rng.uniform(-5, 5, 2), updateRule="Detection", padding=0.1,
+                                    detectionRadius=rng.uniform(0.2, 1.5)))
+    return obstacles
+
+
+@pytest.mark.parametrize("cell_size", [None, 0.5])
+def test_detect_matches_brute_force(cell_size):
+    rng = np.random.default_rng(1)
+    obstacles = random_obstacles(rng, 60)
+    index = DetectionIndex(obstacles, cell_size)
+    detected = set()
+    for _ in range(300):
+        state = rng.uniform(-6, 6, 3)
+        expected = {
+            obstacle.obstacleName
+            for obstacle in obstacles
+            if obstacle.obstacleName not in detected
+            and obstacle.distance_to_obstacle(state) <= obstacle.detectionRadius
+        }
+        found = {obstacle.obstacleName for obstacle in index.detect(state)}
+        assert found == expected
+        detected |= found
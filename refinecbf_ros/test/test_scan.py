@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("scipy")  # Distance transforms
+
+from refinecbf_ros.scan import RollingOccupancy
+from refinecbf_ros.sdf import truncated_sdf
+
+
+def test_rolling_occupancy_matches_full_truncated_sdf():
+    rng = np.random.default_rng(4)
+    occupancy = RollingOccupancy([0, 0], [9.9, 6.3], resolution=0.1, truncation=0.5, decay_time=1.0, tile_size=16)
+    for _ in range(15):
+        center = rng.uniform([0, 0], [10, 6.4])
+        occupancy.integrate(center + rng.normal(scale=0.3, size=(40, 2)))
+        occupancy.decay(rng.uniform(0.0, 0.8))
+        occupancy.update_sdf()
+        expected = truncated_sdf(occupancy.occupied, occupancy.resolution, occupancy.truncation)
+        np.testing.assert_allclose(occupancy.sdf, expected)
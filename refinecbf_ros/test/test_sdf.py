@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from refinecbf_ros.grid import GridSpec, grid_states
+from refinecbf_ros.obstacles import Boundary, Circle, OccupancyGridObstacle, Rectangle
+from refinecbf_ros.sdf import IncrementalSDF, SDFTableCache, compose_sdf, occupancy_sdf
+
+
+def random_obstacle(rng, name):
+    state_indices = sorted(rng.choice(3, size=2, replace=False).tolist())
+    if rng.random() < 0.5:
+        return Circle(state_indices, name, radius=rng.uniform(0.1, 0.5), center=rng.uniform(-1, 1, 2),
+                      padding=rng.uniform(0, 0.1))
+    lo = rng.uniform(-1, 0.5, 2)
+    return Rectangle(state_indices, name, minVal=lo, maxVal=lo + rng.uniform(0.1, 0.5, 2), padding=rng.uniform(0, 0.1))
+
+
+def test_compose_sdf_matches_pointwise_distances():
+    rng = np.random.default_rng(0)
+    grid = GridSpec([-1, -1, -1], [1, 1, 1], [21, 17, 13])
+    boundary = Boundary([0, 1], minVal=[-0.9, -0.9], maxVal=[0.9, 0.9], padding=0.05)
+    obstacles = [random_obstacle(rng, "obstacle_{}".format(i)) for i in range(8)]
+    # The boundary SDF is minus the SDF of the rectangle it encloses
+    box = Rectangle([0, 1], "box", minVal=[-0.9, -0.9], maxVal=[0.9, 0.9])
+
+    sdf = compose_sdf(grid, boundary, obstacles)
+    states = grid_states(grid, np.arange(int(np.prod(grid.shape))))
+    expected = [
+        min([-box.distance_to_obstacle(state) - boundary.padding]
+            + [obstacle.distance_to_obstacle(state) for obstacle in obstacles])
+        for state in states
+    ]
+    np.testing.assert_allclose(sdf.reshape(-1), expected, atol=1e-12)
+
+
+def test_incremental_sdf_matches_compose_sdf():
+    rng = np.random.default_rng(0)
+    grid = GridSpec([-1, -1, -1], [1, 1, 1], [21, 17, 13])
+    boundary = Boundary([0, 1], minVal=[-0.9, -0.9], maxVal=[0.9, 0.9])
+    active = {}
+    composer = IncrementalSDF(grid, boundary, SDFTableCache(grid, 2**20))
+    for step in range(40):
+        action = rng.choice(["add", "remove", "replace"]) if active else "add"
+        if action == "add":
+            obstacle = random_obstacle(rng, "obstacle_{}".format(step))
+            active[obstacle.obstacleName] = obstacle
+            composer.add(obstacle)
+        elif action == "remove":
+            name = rng.choice(sorted(active))
+            del active[name]
+            composer.remove(name)
+        else:
+            name = rng.choice(sorted(active))
+            active[name] = random_obstacle(rng, name)
+            composer.replace(active[name])
+        np.testing.assert_allclose(composer.sdf, compose_sdf(grid, boundary, list(active.values())))
+
+
+def test_occupancy_sdf_measures_to_the_cell_faces():
+    pytest.importorskip("scipy")
+    occupancy = np.zeros((9, 11), dtype=bool)
+    occupancy[3:6, 4:7] = True
+    sdf = occupancy_sdf(occupancy, 0.1)
+    # Along a row through the obstacle, free cells are (k - 1/2) cells from its face, occupied ones -(k - 1/2)
+    np.testing.assert_allclose(sdf[4, :5], [0.35, 0.25, 0.15, 0.05, -0.05])
+    np.testing.assert_allclose(sdf[4, 5], -0.15)
+
+
+@pytest.mark.parametrize("occupied", [False, True])
+def test_occupancy_sdf_is_finite_for_uniform_maps(occupied):
+    pytest.importorskip("scipy")
+    occupancy = np.full((6, 8), occupied)
+    sdf = occupancy_sdf(occupancy, 0.5)
+    assert np.all(np.isfinite(sdf))
+    assert np.all(sdf < 0) if occupied else np.all(sdf > 0)
+
+    obstacle = OccupancyGridObstacle([0, 1], "map", occupancy, resolution=0.5, origin=[0, 0])
+    table = obstacle.sdf_table(GridSpec([-1, -1, 0], [5, 4, 1], [13, 11, 3]))
+    assert np.all(np.isfinite(table))
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from refinecbf_ros.grid import GridSpec
+from refinecbf_ros.tables import interpolate_table
+
+
+def test_interpolate_table_is_exact_for_multilinear_functions():
+    rng = np.random.default_rng(2)
+    grid = GridSpec([-1, 0, -2], [1, 2, 2], [11, 7, 9])
+    coefficients = rng.normal(size=4)
+
+    def f(states):
+        x, y, z = np.moveaxis(states, -1, 0)
+        return coefficients[0] + coefficients[1] * x * y + coefficients[2] * y * z + coefficients[3] * x * y * z
+
+    table = f(grid.states)
+    states = rng.uniform(grid.domain.lo, grid.domain.hi, (200, 3))
+    np.testing.assert_allclose(interpolate_table(grid, table, states), f(states), atol=1e-10)
+    np.testing.assert_allclose(interpolate_table(grid, table, states[0]), f(states[0]), atol=1e-10)
+
+
+def test_interpolate_table_matches_hj_grid():
+    hj = pytest.importorskip("hj_reachability")
+    jnp = pytest.importorskip("jax.numpy")
+    rng = np.random.default_rng(3)
+    grid = GridSpec([-1, -1, 0], [1, 1, 2 * np.pi], [13, 9, 16], periodic_dims=[2])
+    hj_grid = grid.to_hj_grid()
+    table = rng.normal(size=grid.shape)
+    for state in rng.uniform(grid.domain.lo, grid.domain.hi, (50, 3)):
+        expected = float(hj_grid.interpolate(jnp.array(table), jnp.array(state)))
+        np.testing.assert_allclose(interpolate_table(grid, table, state), expected, rtol=1e-5, atol=1e-5)